@@ -5,11 +5,51 @@ fish data.
 Original Author: Thomas Kono (konox006@umn.edu) 2017
 Rewritten/Edited: Emma Roback (robac028@umn.edu) 2025 """
 
+import time
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
 
 
+def run_model(args, model, deadline=None):
+    """Fit one model with the parsed arguments, and write its results. The
+    optimizations stop at deadline (a time.time() value), if given."""
+    # Import the demographic model class
+    from cavefish_dadi.Models import demo_model
+    # Start a new DemoMod object. This reads the SFS data, sets the model
+    # function, and sets the optima search algorithm. The processes it starts
+    # are stopped at the end of the with block, even if the run fails
+    with demo_model.DemoModel(
+            args.sfs,
+            model,
+            args.pop,
+            args.out,
+            args.grid_jobs) as dm:
+        # Set the grids of each optimization stage
+        dm.set_schedule(
+            {'hot': args.hot_grid, 'cold': args.cold_grid, 'bfgs': args.bfgs_grid},
+            args.hot_project)
+        dm.set_search(args.search, args.popsize)
+        dm.set_budget(deadline, args.max_evals)
+        dm.set_profile(args.profile, args.profile_points)
+        dm.set_store(args.results_db)
+        # Then, fit the model to the data. The output file is written as the
+        # replicates go, so that partial results survive the job being killed
+        dm.infer(args.niter, args.replicates, args.jobs, args.seed, args.halving, args.length)
+        dm.summarize(args.length)
+        # Estimate the uncertainty of the best fit from the bootstrap spectra
+        if args.bootstrap:
+            dm.uncertainty(args.bootstrap, args.length, args.gim_step, args.jobs)
+        dm.write_out(args.niter, args.length)
+        # Profile likelihoods of the parameters asked for
+        dm.profile(args.niter, args.jobs)
+        # There is no model spectrum to plot if the budget ran out before any
+        # replicate finished
+        if dm.model_sfs is not None:
+            dm.plot(vmin=1, vmax=100000)
+    return dm
+
+
 def main():
     """The main function. Controls the execution of the script."""
     # Import and run the module testing script
@@ -20,27 +60,20 @@ def main():
         sys.exit(1)
     # Import the argument checking script
     from cavefish_dadi.Support import arguments
-    # Import the demographic model class
-    from cavefish_dadi.Models import demo_model
     # Parse the arguments
     args = arguments.parse_args()
     if not args:
         sys.exit(1)
+    # The time budget is shared by all of the models
+    deadline = None
+    if args.time_budget is not None:
+        deadline = time.time() + args.time_budget
     # For each model
     for model in args.model:
-        # Start a new DemoMod object. This reads the SFS data, sets the model
-        # function, and sets the optima search algorithm
-        dm = demo_model.DemoModel(
-            args.sfs,
-            model,
-            args.pop,
-            args.out)
-        # Then, fit the model to the data
-        dm.infer(args.niter, args.replicates)
-        dm.summarize(args.length)
-        dm.write_out(args.niter, args.length)
-        dm.plot(vmin=1, vmax=100000)
+        run_model(args, model, deadline)
     return
 
 
-main()
+# Guard the entry point, since worker processes may import this script
+if __name__ == '__main__':
+    main()
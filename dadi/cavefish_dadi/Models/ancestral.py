@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""Grids and starting phi shared by all of the models. These only depend on
+the number of grid points, so each is computed once per process and reused
+for every evaluation of every model. The arrays are read-only, so a model
+can never change them for the next call; dadi's integration functions work on
+a copy of the phi they are given."""
+
+import dadi
+
+# Grids and post-split phi, keyed by the number of grid points
+_grids = {}
+_split_phis = {}
+
+
+def grid(pts):
+    """Return the default dadi grid with pts points."""
+    pts = int(pts)
+    if pts not in _grids:
+        xx = dadi.Numerics.default_grid(pts)
+        xx.setflags(write=False)
+        _grids[pts] = xx
+    return _grids[pts]
+
+
+def split_phi(pts):
+    """Return phi for the equilibrium ancestral population just after it
+    splits into two, on the grid with pts points."""
+    pts = int(pts)
+    if pts not in _split_phis:
+        xx = grid(pts)
+        # phi for the equilibrium ancestral population
+        phi = dadi.PhiManip.phi_1D(xx)
+        # Now do the divergence event
+        phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        phi.setflags(write=False)
+        _split_phis[pts] = phi
+    return _split_phis[pts]
@@ -4,29 +4,124 @@
 import dadi
 import pylab
 from ..Optim import dadi_custom
+from ..Optim import model_cache
+from ..Optim import extrapolation
+from ..Optim import godambe
+from ..Support import results_db
 import numpy
 import math
+import os
 import sys
+import time
+import multiprocessing
+import sqlite3
+
+
+# Grid points for the hot annealing, cold annealing and BFGS stages. A stage
+# with more than one grid size is extrapolated to an infinitely fine grid.
+DEFAULT_GRIDS = {'hot': [50], 'cold': [50], 'bfgs': [50]}
+
+# The stages of each replicate, in the order they are run
+STAGES = ['hot', 'cold', 'bfgs']
+
+# Mutation rate per site per generation (from common carp), used to convert
+# theta to the ancestral population size
+MUTATION_RATE = 5.62e-9
+
+# Normal quantile for the 95% confidence intervals from the Godambe
+# standard errors
+CI_Z = 1.959963984540054
+
+# The model of each worker process when replicates are run in a pool, set up
+# by _start_worker
+_worker_model = None
+
+
+def _start_worker(sfs, model, popnames, output, grids, project, search, popsize,
+                  deadline=None, max_evals=None):
+    """Load the SFS and set up the model once in each worker process."""
+    global _worker_model
+    _worker_model = DemoModel(sfs, model, popnames, output)
+    _worker_model.set_schedule(grids, project)
+    _worker_model.set_search(search, popsize)
+    _worker_model.set_budget(deadline, max_evals)
+    return
+
+
+def _advance_replicate(task):
+    """Run the next stage of a (niter, index, state) replicate in a worker
+    process. Returns the index and the new state."""
+    niter, index, state = task
+    return index, _worker_model.advance(state, niter)
+
+
+def _profile_chain(task):
+    """Run one (niter, index, values, start) chain of a profile likelihood in
+    a worker process."""
+    return _worker_model.profile_chain(*task)
+
+
+def replicate_seeds(seed, reps):
+    """Derive an independent RNG seed for each replicate from one seed, so
+    that replicates give the same results however they are scheduled."""
+    children = numpy.random.SeedSequence(seed).spawn(reps)
+    return [int(c.generate_state(1)[0]) for c in children]
 
 
 class DemoModel(object):
     """A class to hold data and methods for running a demographic model in dadi.
     Will store the model function, and joint SFS data."""
 
-    def __init__(self, sfs, model, popnames, output):
+    def __init__(self, sfs, model, popnames, output, grid_jobs=1):
         """Initialization function. Sets the model name and function, path to
-        input data, and the output filename."""
+        input data, and the output filename. With grid_jobs > 1 the grid sizes
+        of an extrapolated model evaluation are integrated in that many
+        processes."""
         self.sfs = self.load_sfs(sfs)
+        self.sfs_file = sfs
         self.modelname = model
-        # Make an extrapolating version of the function
-        self.modelfunc = dadi.Numerics.make_extrap_log_func(
-            self.set_model_func(model))
+        # Make an extrapolating version of the function, and keep the spectra
+        # it computes so that the same parameters are not integrated twice
+        if grid_jobs > 1:
+            extrap_func = extrapolation.ConcurrentExtrapModel(
+                self.set_model_func(model),
+                grid_jobs)
+        else:
+            extrap_func = dadi.Numerics.make_extrap_log_func(self.set_model_func(model))
+        self.extrap_func = extrap_func
+        self.modelfunc = model_cache.CachedModel(extrap_func, model)
         self.params = self.set_parameters()
         self.popnames = popnames
+        self.outprefix = output
+        # Number of processes for the evaluations within a replicate (the
+        # BFGS gradient and the population search), set by infer
+        self.eval_jobs = 1
+        self.set_schedule()
+        self.set_search()
+        self.set_budget()
+        self.set_profile()
+        self.set_store()
+        # Godambe uncertainties of the best replicate, set by uncertainty
+        self.gim = None
         self.output = '_'.join(popnames + [output, model]) + '.txt'
         self.figout = '_'.join(popnames + [output, model]) + '_Comp.pdf'
+        self.traceout = '_'.join(popnames + [output, model]) + '_Trace.txt'
+        return
+
+    def close(self):
+        """Stop the processes the grid sizes are integrated in (with
+        grid_jobs > 1), once the run is finished."""
+        if isinstance(self.extrap_func, extrapolation.ConcurrentExtrapModel):
+            self.extrap_func.close()
         return
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
     def load_sfs(self, sfs):
         """Parse the dadi SFS file and return it as a Spectrum object. Dadi will
         do basic checking of the spectrum, but we will be more thorough."""
@@ -37,6 +132,67 @@ class DemoModel(object):
             exit(1)
         return fs
 
+    def set_schedule(self, grids=None, project=None):
+        """Set the grid points of each optimization stage, from a dictionary
+        with any of the keys of DEFAULT_GRIDS, and the sample sizes to project
+        the SFS down to for the hot annealing (None to use the full SFS)."""
+        self.grids = dict(DEFAULT_GRIDS)
+        self.grids.update(grids or {})
+        self.project = project
+        self.hot_sfs = self.sfs
+        if project:
+            if (len(project) != len(self.sfs.sample_sizes)
+                    or any(p < 2 or p > n for p, n in zip(project, self.sfs.sample_sizes))):
+                sys.stderr.write(
+                    'Error, the projection sample sizes must be between 2 and '
+                    'the sample sizes of the SFS (' +
+                    ' '.join([str(n) for n in self.sfs.sample_sizes]) + ').\n')
+                sys.exit(1)
+            self.hot_sfs = self.sfs.project(project)
+        return
+
+    def set_search(self, search='anneal', popsize=15):
+        """Set the global search of the hot stage: 'anneal' for dual annealing,
+        which evaluates one point at a time, or 'de' for differential
+        evolution, which evaluates a population of popsize points per
+        parameter at a time."""
+        self.search = search
+        self.popsize = popsize
+        return
+
+    def set_budget(self, deadline=None, max_evals=None):
+        """Set a deadline (a time.time() value) for the optimizations and a
+        maximum number of objective function evaluations per replicate. When
+        either runs out, the stage in progress returns the best parameters it
+        has seen and the later stages of the replicate are skipped."""
+        self.deadline = deadline
+        self.max_evals = max_evals
+        return
+
+    def set_profile(self, names=None, points=11):
+        """Set the parameters to compute the profile likelihood of after the
+        fit (see profile), and the number of values to fix each of them at.
+        Names that are not parameters of this model are skipped, with a
+        warning, so that one list can be given for several models."""
+        self.profile_names = []
+        for name in names or []:
+            if name in self.params['Names']:
+                self.profile_names.append(name)
+            else:
+                sys.stderr.write(
+                    'Warning, ' + name + ' is not a parameter of the ' +
+                    self.modelname + ' model (' + ', '.join(self.params['Names']) +
+                    '), so its profile likelihood is skipped.\n')
+        self.profile_points = points
+        return
+
+    def set_store(self, path=None):
+        """Set the SQLite database (see cavefish_dadi.Support.results_db)
+        that write_out also stores the results in, or None for only the
+        output file."""
+        self.store = path
+        return
+
     def set_model_func(self, model):
         """Given a model name, set the function that has to be called to run
         that model. This should be safe because we restrict the user input for
@@ -156,9 +312,61 @@ class DemoModel(object):
         params['Lower'] = lower_bounds
         return params
 
-    def infer(self, niter, reps):
+    def infer(self, niter, reps, jobs=1, seed=None, halving=1, locuslen=None):
         """Inference function. This borrows heavily from the callmodel()
-        function in 'script_inference_anneal2_newton.py' from SEA lab."""
+        function in 'script_inference_anneal2_newton.py' from SEA lab.
+        Replicates are run in a pool of jobs processes if jobs > 1. With a
+        single replicate the jobs processes compute the finite difference
+        gradients of the BFGS stage, and evaluate the population of the
+        differential evolution search, instead. Each replicate gets its own
+        RNG seed derived from seed (random if None), so the results do not
+        depend on jobs. With halving > 1 only the best 1/halving of the
+        replicates go on after each stage (see run_stages). If locuslen is
+        given, the output file is written again after each stage of each
+        replicate, so that the results so far are kept if the run is
+        stopped."""
+        if seed is None:
+            seed = numpy.random.SeedSequence().entropy
+        self.seed = seed
+        self.rep_seeds = replicate_seeds(seed, reps)
+        self.halving = halving
+        # Get the sample sizes from the SFS
+        sample_sizes = self.sfs.sample_sizes
+        # Use the grid points of the final optimization
+        grid = self.grids['bfgs']
+        # Apply mask
+        # Calculate the model SFS
+        mod_sfs = self.modelfunc(self.params['Values'], sample_sizes, grid)
+        # Calculate the likelihood of the data given the model SFS that we just
+        # generated
+        self.data_like = dadi.Inference.ll_multinom(mod_sfs, self.sfs)
+        states = [self.start_replicate(s) for s in self.rep_seeds]
+        progress = None if locuslen is None else (niter, locuslen)
+        # Worker processes cannot start pools of their own, so evaluations
+        # within a replicate are only run in parallel when the replicates are
+        # not
+        self.eval_jobs = jobs if reps == 1 else 1
+        self.pooled = jobs > 1 and reps > 1
+        if self.pooled:
+            with multiprocessing.Pool(
+                    min(jobs, reps),
+                    initializer=_start_worker,
+                    initargs=self.worker_args()) as pool:
+                states = self.run_stages(states, niter, halving, pool, progress)
+        else:
+            states = self.run_stages(states, niter, halving, progress=progress)
+        self.collect(states)
+        return
+
+    def worker_args(self):
+        """Return the arguments of _start_worker that set up a copy of this
+        model in a worker process."""
+        return (self.sfs_file, self.modelname, self.popnames, self.outprefix,
+                self.grids, self.project, self.search, self.popsize,
+                self.deadline, self.max_evals)
+
+    def collect(self, states):
+        """Set the results of each replicate from their states."""
         # Start containers to hold the optimized parameters
         self.p_init = []
         self.hot_params = []
@@ -168,73 +376,332 @@ class DemoModel(object):
         self.mod_like = []
         self.opt_like = []
         self.aic = []
-        # Get the sample sizes from the SFS
-        sample_sizes = self.sfs.sample_sizes
-        # Generate the points of the grid for the optimization
-        grid = 50
-        # Apply mask
-        # Calculate the model SFS
-        mod_sfs = self.modelfunc(self.params['Values'], sample_sizes, grid)
-        # Calculate the likelihood of the data given the model SFS that we just
-        # generated
-        mod_like = dadi.Inference.ll_multinom(mod_sfs, self.sfs)
-        # Start with hot annealing, then cold annealing, then BFGS
-        r = 0
-        while r < reps:
-            p_init = dadi.Misc.perturb_params(
-                self.params['Values'],
-                fold=1,
-                lower_bound=self.params['Lower'],
-                upper_bound=self.params['Upper'])
+        self.evaluations = []
+        self.model_time = []
+        self.elapsed = []
+        self.trace = []
+        self.last_stage = []
+        self.stopped = []
+        # Spectra computed in worker processes
+        self.worker_hits = 0
+        self.worker_misses = 0
+        results = [self.replicate_result(s) for s in states]
+        for res in results:
+            self.p_init.append(res['p_init'])
+            self.hot_params.append(res['p_hot'])
+            self.cold_params.append(res['p_cold'])
+            self.opt_params.append(res['p_bfgs'])
+            # Estimate theta
+            self.theta.append(res['theta'])
+            # And calculate the AIC
+            aic = 2 * len(self.params) - 2 * res['opt_like']
+            self.mod_like.append(self.data_like)
+            self.opt_like.append(res['opt_like'])
+            self.aic.append(aic)
+            self.evaluations.append(res['evaluations'])
+            self.model_time.append(res['model_time'])
+            self.elapsed.append(res['elapsed'])
+            self.trace.append(res['trace'])
+            self.last_stage.append(str(res['stage']))
+            self.stopped.append(res['stopped'])
+            if self.pooled:
+                self.worker_hits += res['hits']
+                self.worker_misses += res['misses']
+        # Set these as class variables for printing later, from the last
+        # replicate that finished (None if none did)
+        finished = [r['opt_sfs'] for r in results if r['opt_sfs'] is not None]
+        self.model_sfs = finished[-1] if finished else None
+        return
+
+    def run_stages(self, states, niter, halving=1, pool=None, progress=None):
+        """Advance replicates (from start_replicate) through the stages in
+        rounds, in a pool of processes if one is given. After each stage but
+        the last, only the best 1/halving of the replicates that are still
+        running (at least one), ranked by the log likelihood of the stage, go
+        on to the next; the others are abandoned where they are. If progress
+        is (niter, locuslen), the output file is written each time a
+        replicate finishes a stage. Returns the states of all of the
+        replicates."""
+        states = list(states)
+        active = list(range(len(states)))
+        for stage in STAGES:
+            tasks = [(niter, i, states[i]) for i in active]
+            if pool is not None:
+                advanced = pool.imap_unordered(_advance_replicate, tasks)
+            else:
+                advanced = ((i, self.advance(s, n)) for n, i, s in tasks)
+            for i, state in advanced:
+                states[i] = state
+                if progress is not None:
+                    self.collect(states)
+                    self.summarize(progress[1])
+                    self.write_out(*progress)
+            if stage != STAGES[-1] and halving > 1:
+                keep = max(1, int(math.ceil(len(active) / halving)))
+                # Failed optimizations rank last
+                ranked = sorted(
+                    active,
+                    key=lambda i: -math.inf if math.isnan(states[i]['ll']) else states[i]['ll'],
+                    reverse=True)
+                active = sorted(ranked[:keep])
+        return states
+
+    def start_replicate(self, seed):
+        """Start a replicate by perturbing the starting parameters. Returns
+        its state: the stage it has finished (None so far), the parameters
+        and log likelihood of each stage, the state of the RNG, its
+        OptimizationContext, and the spectrum cache hits and misses."""
+        # Both perturb_params and the annealing draw from the global RNG
+        numpy.random.seed(seed)
+        p_init = dadi.Misc.perturb_params(
+            self.params['Values'],
+            fold=1,
+            lower_bound=self.params['Lower'],
+            upper_bound=self.params['Upper'])
+        context = dadi_custom.OptimizationContext(
+            deadline=self.deadline,
+            max_evaluations=self.max_evals)
+        context.suspend()
+        return {
+            'stage': None,
+            'p_init': p_init,
+            'p_hot': None,
+            'p_cold': None,
+            'p_bfgs': None,
+            'll': None,
+            'stopped': False,
+            'rng': numpy.random.get_state(),
+            'context': context,
+            'hits': 0,
+            'misses': 0}
+
+    def advance(self, state, niter):
+        """Run the next stage of a replicate: hot annealing (or differential
+        evolution, see set_search), cold annealing or BFGS, each on the grids
+        set by set_schedule (the hot stage on the projected SFS, if any).
+        Returns the new state. The RNG state is carried from stage to stage,
+        so a replicate gives the same results however its stages are
+        scheduled. The three optimizations share one OptimizationContext, so
+        replicates running in the same process keep separate counts. Once the
+        budget of the context has run out, the state is returned unchanged."""
+        state = dict(state)
+        if state['context'].exhausted():
+            state['stopped'] = True
+            return state
+        numpy.random.set_state(state['rng'])
+        context = state['context']
+        context.resume()
+        hits, misses = self.modelfunc.hits, self.modelfunc.misses
+        if state['stage'] is None:
             # Get some hot-optimized parameters
-            p_hot = dadi_custom.optimize_anneal(
-                p_init,
+            context.stage = 'hot'
+            if self.search == 'de':
+                p_hot, fun = dadi_custom.optimize_de(
+                    state['p_init'],
+                    self.hot_sfs,
+                    self.modelfunc,
+                    self.grids['hot'],
+                    lower_bound=self.params['Lower'],
+                    upper_bound=self.params['Upper'],
+                    maxiter=niter,
+                    full_output=True,
+                    popsize=self.popsize,
+                    processes=self.eval_jobs,
+                    context=context)[:2]
+            else:
+                p_hot, fun = dadi_custom.optimize_anneal(
+                    state['p_init'],
+                    self.hot_sfs,
+                    self.modelfunc,
+                    self.grids['hot'],
+                    lower_bound=self.params['Lower'],
+                    upper_bound=self.params['Upper'],
+                    maxiter=niter,
+                    full_output=True,
+                    Tini=100,
+                    Tfin=0,
+                    learn_rate=0.005,
+                    schedule="cauchy",
+                    context=context)[:2]
+            state['p_hot'] = p_hot
+            state['ll'] = -fun
+            # The best log likelihood of the hot stage may be on a projected
+            # SFS
+            context.reset_best()
+        elif state['stage'] == 'hot':
+            context.stage = 'cold'
+            p_cold, fun = dadi_custom.optimize_anneal(
+                state['p_hot'],
                 self.sfs,
                 self.modelfunc,
-                grid,
+                self.grids['cold'],
                 lower_bound=self.params['Lower'],
                 upper_bound=self.params['Upper'],
                 maxiter=niter,
-                Tini=100,
+                full_output=True,
+                Tini=50,
                 Tfin=0,
-                learn_rate=0.005,
-                schedule="cauchy")
-            p_cold = dadi_custom.optimize_anneal(
-                p_hot,
+                learn_rate=0.01,
+                schedule="cauchy",
+                context=context)[:2]
+            state['p_cold'] = p_cold
+            state['ll'] = -fun
+        else:
+            context.stage = 'bfgs'
+            p_bfgs = dadi_custom.optimize_log(
+                state['p_cold'],
                 self.sfs,
                 self.modelfunc,
-                grid,
+                self.grids['bfgs'],
                 lower_bound=self.params['Lower'],
                 upper_bound=self.params['Upper'],
                 maxiter=niter,
-                Tini=50,
-                Tfin=0,
-                learn_rate=0.01,
-                schedule="cauchy")
-            p_bfgs = dadi.Inference.optimize_log(
-                p_cold,
+                context=context,
+                gradient_processes=self.eval_jobs)
+            opt_sfs = self.modelfunc(p_bfgs, self.sfs.sample_sizes, self.grids['bfgs'])
+            state['p_bfgs'] = p_bfgs
+            state['opt_sfs'] = opt_sfs
+            state['ll'] = dadi.Inference.ll_multinom(opt_sfs, self.sfs)
+            state['theta'] = dadi.Inference.optimal_sfs_scaling(opt_sfs, self.sfs)
+        state['stage'] = context.stage
+        state['stopped'] = context.exhausted()
+        state['rng'] = numpy.random.get_state()
+        state['hits'] += self.modelfunc.hits - hits
+        state['misses'] += self.modelfunc.misses - misses
+        context.suspend()
+        return state
+
+    def replicate_result(self, state):
+        """Return a dictionary of the parameters found at each stage of a
+        replicate (NaN for stages it was abandoned before), the last stage it
+        ran, whether it was stopped by the budget, the optimized likelihood,
+        theta and model spectrum (NaN and None if it was abandoned), the
+        spectrum cache hits and misses, the number of objective function
+        evaluations, seconds spent in the model and in total, and the trace
+        of the best log likelihood."""
+        missing = numpy.full(len(self.params['Names']), numpy.nan)
+        finished = state['stage'] == STAGES[-1]
+        context = state['context']
+        return {
+            'stage': state['stage'],
+            'stopped': state['stopped'],
+            'p_init': state['p_init'],
+            'p_hot': missing if state['p_hot'] is None else state['p_hot'],
+            'p_cold': missing if state['p_cold'] is None else state['p_cold'],
+            'p_bfgs': missing if state['p_bfgs'] is None else state['p_bfgs'],
+            'opt_like': state['ll'] if finished else numpy.nan,
+            'theta': state['theta'] if finished else numpy.nan,
+            'opt_sfs': state['opt_sfs'] if finished else None,
+            'hits': state['hits'],
+            'misses': state['misses'],
+            'evaluations': context.evaluations,
+            'model_time': context.model_time,
+            'elapsed': context.elapsed(),
+            'trace': context.trace}
+
+    def profile(self, niter, jobs=1):
+        """Compute the profile likelihood of each of the parameters set by
+        set_profile, starting from the replicate with the best optimized
+        likelihood. Each parameter is fixed in turn at evenly spaced values
+        between its bounds, and the other parameters are optimized with BFGS on the grids
+        of the BFGS stage. The values below and above the best estimate are
+        run as two chains that move away from it, each optimization starting
+        from the solution of the value before. The chains are run in a pool of
+        jobs processes if jobs > 1. A table is written for each parameter (see
+        write_profile). Nothing is done if no replicate finished."""
+        names = self.profile_names
+        if not names:
+            return
+        finished = [i for i, ll in enumerate(self.opt_like) if not math.isnan(ll)]
+        if not finished:
+            sys.stderr.write('Warning, no replicate finished, so there is no profile likelihood.\n')
+            return
+        best = max(finished, key=lambda i: self.opt_like[i])
+        start = numpy.array(self.opt_params[best], dtype=float)
+        tasks = []
+        for name in names:
+            index = self.params['Names'].index(name)
+            grid = numpy.linspace(
+                self.params['Lower'][index],
+                self.params['Upper'][index],
+                self.profile_points)
+            below = [v for v in grid[::-1] if v <= start[index]]
+            above = [v for v in grid if v > start[index]]
+            tasks += [(niter, index, values, start) for values in (below, above) if values]
+        if jobs > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(
+                    min(jobs, len(tasks)),
+                    initializer=_start_worker,
+                    initargs=self.worker_args()) as pool:
+                chains = pool.map(_profile_chain, tasks)
+        else:
+            chains = [self.profile_chain(*t) for t in tasks]
+        for name in names:
+            index = self.params['Names'].index(name)
+            rows = [row for task, chain in zip(tasks, chains) if task[1] == index for row in chain]
+            self.write_profile(name, sorted(rows, key=lambda row: row[0]), best)
+        return
+
+    def profile_chain(self, niter, index, values, start):
+        """Fix parameter index at each of values in turn and optimize the
+        others with BFGS, starting from start and then from the solution for
+        the previous value. Returns a list of (value, log likelihood,
+        parameters, evaluations, stopped) rows. Each optimization has its
+        own budget (see set_budget); the chain stops once the deadline has
+        passed."""
+        rows = []
+        params = numpy.array(start, dtype=float)
+        for value in values:
+            fixed = [None] * len(params)
+            fixed[index] = value
+            # The previous row keeps its own copy of the parameters
+            params = params.copy()
+            params[index] = value
+            context = dadi_custom.OptimizationContext(
+                deadline=self.deadline,
+                max_evaluations=self.max_evals)
+            if context.exhausted():
+                break
+            params = dadi_custom.optimize_log(
+                params,
                 self.sfs,
                 self.modelfunc,
-                grid,
+                self.grids['bfgs'],
                 lower_bound=self.params['Lower'],
                 upper_bound=self.params['Upper'],
-                maxiter=niter)
-            self.p_init.append(p_init)
-            self.hot_params.append(p_hot)
-            self.cold_params.append(p_cold)
-            self.opt_params.append(p_bfgs)
-            opt_sfs = self.modelfunc(p_bfgs, sample_sizes, grid)
-            opt_like = dadi.Inference.ll_multinom(opt_sfs, self.sfs)
-            # Estimate theta
-            self.theta.append(dadi.Inference.optimal_sfs_scaling(opt_sfs, self.sfs))
-            # And calculate the AIC
-            aic = 2 * len(self.params) - 2 * opt_like
-            self.mod_like.append(mod_like)
-            self.opt_like.append(opt_like)
-            self.aic.append(aic)
-            r += 1
-        # Set these as class variables for printing later
-        self.model_sfs = opt_sfs
+                maxiter=niter,
+                fixed_params=fixed,
+                context=context)
+            fs = self.modelfunc(params, self.sfs.sample_sizes, self.grids['bfgs'])
+            ll = dadi.Inference.ll_multinom(fs, self.sfs)
+            rows.append((value, ll, params, context.evaluations, context.exhausted()))
+        return rows
+
+    def write_profile(self, name, rows, best):
+        """Write the profile likelihood of one parameter: for each value it
+        was fixed at, the log likelihood, twice its difference from the best
+        optimized likelihood (the likelihood ratio statistic), the other
+        parameters, the number of objective function evaluations and whether
+        the optimization was stopped by the budget."""
+        path = '_'.join(self.popnames + [self.outprefix, self.modelname]) + '_Profile_' + name + '.txt'
+        try:
+            handle = open(path + '.tmp', 'w')
+        except OSError:
+            print('Error, you do not have permission to write files here.')
+            sys.exit(1)
+        handle.write('#Model: ' + self.modelname + '\n')
+        handle.write('#Parameter: ' + name + '\n')
+        handle.write('#Best replicate: ' + str(best) + '\n')
+        handle.write('#Best Log_Likelihood: ' + str(self.opt_like[best]) + '\n')
+        handle.write('#BFGS grid: ' + ' '.join([str(s) for s in self.grids['bfgs']]) + '\n')
+        handle.write('\t'.join([name, 'Log_Likelihood', 'LR'] + self.params['Names'] + ['Evaluations', 'Stopped']) + '\n')
+        for value, ll, params, evaluations, stopped in rows:
+            lr = 2 * (self.opt_like[best] - ll)
+            handle.write('\t'.join(
+                [str(value), str(ll), str(lr)] + [str(p) for p in params]
+                + [str(evaluations), str(stopped)]) + '\n')
+        handle.close()
+        os.replace(path + '.tmp', path)
         return
 
     def summarize(self, locuslen):
@@ -245,46 +712,104 @@ class DemoModel(object):
         hot_means = []
         for r_t in zip(*self.hot_params):
             v = [x for x in r_t if not math.isnan(x)]
-            hot_means.append(sum(v)/len(v))
+            hot_means.append(sum(v)/len(v) if v else math.nan)
         cold_means = []
         for r_t in zip(*self.cold_params):
             v = [x for x in r_t if not math.isnan(x)]
-            cold_means.append(sum(v)/len(v))
+            cold_means.append(sum(v)/len(v) if v else math.nan)
         bfgs_means = []
         for r_t in zip(*self.opt_params):
             v = [x for x in r_t if not math.isnan(x)]
-            bfgs_means.append(sum(v)/len(v))
-        theta_mean = sum(self.theta) / len(self.theta)
+            bfgs_means.append(sum(v)/len(v) if v else math.nan)
+        # Abandoned replicates have no theta
+        thetas = [x for x in self.theta if not math.isnan(x)]
+        theta_mean = sum(thetas) / len(thetas) if thetas else math.nan
         # Then, convert the parameters into meaningful values
         #   the theta estimate is 4*Na*u*L (mutation rate taken from common carp)
-        anc_ne = theta_mean / (4 * 5.62e-9 * locuslen)
-        #   Then, the parameters are scaled by that. Population sizes are scaled
-        #   by theta (4Na), and times and migration rates are given in units of
-        #   2N.
-        scaled_params = []
-        for name, val in zip(self.params['Names'], bfgs_means):
-            if name.startswith('N'):
-                scaled_params.append(val * anc_ne)
-            elif name.startswith('m'):
-                scaled_params.append(val /(anc_ne * 2))
-            elif name.startswith('T'):
-                scaled_params.append(val * anc_ne * 2)
-            else:
-                scaled_params.append(val)
+        anc_ne = theta_mean / (4 * MUTATION_RATE * locuslen)
         # Write these values into the class data
         self.hot_mean = hot_means
         self.cold_mean = cold_means
         self.bfgs_mean = bfgs_means
         self.theta_mean = theta_mean
         self.Na = anc_ne
-        self.scaled_params = scaled_params
+        self.scaled_params = [self.scale_param(name, val, anc_ne)[0]
+                              for name, val in zip(self.params['Names'], bfgs_means)]
+        return
+
+    def scale_param(self, name, val, anc_ne):
+        """Convert a parameter into meaningful units, given the ancestral
+        population size. Population sizes are scaled by theta (4Na), and
+        times and migration rates are given in units of 2N. Returns the
+        scaled value, and its derivatives with respect to the parameter and
+        to Na."""
+        if name.startswith('N'):
+            return val * anc_ne, anc_ne, val
+        elif name.startswith('m'):
+            return val / (anc_ne * 2), 1 / (anc_ne * 2), -val / (2 * anc_ne**2)
+        elif name.startswith('T'):
+            return val * anc_ne * 2, anc_ne * 2, val * 2
+        else:
+            return val, 1, 0
+
+    def uncertainty(self, boot_files, locuslen, eps=0.01, jobs=1):
+        """Estimate the standard errors of the parameters of the replicate
+        with the best optimized likelihood from the Godambe information
+        matrix, using the bootstrap spectra in boot_files, and the 95%
+        confidence intervals of Na and the scaled parameters from them with
+        the delta method, since Na comes from theta. The perturbed model
+        spectra are computed in jobs processes. Nothing is done if no
+        replicate finished."""
+        self.gim = None
+        finished = [i for i, ll in enumerate(self.opt_like) if not math.isnan(ll)]
+        if not finished:
+            sys.stderr.write('Warning, no replicate finished, so there are no standard errors.\n')
+            return
+        boots = []
+        for path in boot_files:
+            boot = self.load_sfs(path)
+            if list(boot.sample_sizes) != list(self.sfs.sample_sizes):
+                sys.stderr.write(
+                    'Error, the bootstrap spectrum ' + path +
+                    ' has different sample sizes from the SFS.\n')
+                sys.exit(1)
+            boots.append(boot)
+        best = max(finished, key=lambda i: self.opt_like[i])
+        se, cov, evaluations = godambe.gim_uncert(
+            self.modelfunc,
+            self.grids['bfgs'],
+            boots,
+            self.opt_params[best],
+            self.sfs,
+            eps,
+            jobs)
+        # Na only depends on theta, which is the last parameter
+        theta = self.theta[best]
+        na_per_theta = 1 / (4 * MUTATION_RATE * locuslen)
+        anc_ne = theta * na_per_theta
+        intervals = [('Na', anc_ne, se[-1] * na_per_theta)]
+        for k, (name, val) in enumerate(zip(self.params['Names'], self.opt_params[best])):
+            scaled, d_param, d_na = self.scale_param(name, val, anc_ne)
+            grad = numpy.zeros(len(se))
+            grad[k] = d_param
+            grad[-1] = d_na * na_per_theta
+            intervals.append((name, scaled, math.sqrt(grad @ cov @ grad)))
+        self.gim = {
+            'replicate': best,
+            'bootstraps': len(boots),
+            'eps': eps,
+            'evaluations': evaluations,
+            'se': list(se),
+            'intervals': intervals}
         return
 
 
     def write_out(self, niter, locuslen):
-        """Write some output summaries for the dadi runs."""
+        """Write some output summaries for the dadi runs. The file is written
+        under a temporary name first, since it is rewritten as the replicates
+        run and the job may be killed at any time."""
         try:
-            handle = open(self.output, 'w')
+            handle = open(self.output + '.tmp', 'w')
         except OSError:
             print('Error, you do not have permission to write files here.')
             sys.exit(1)
@@ -294,6 +819,27 @@ class DemoModel(object):
         # Then write the run parameters
         handle.write('#Model: ' + self.modelname + '\n')
         handle.write('#Max iterations: ' + str(niter) + '\n')
+        handle.write('#Halving ratio: ' + str(self.halving) + '\n')
+        handle.write('#Last stage: ' + ' '.join(self.last_stage) + '\n')
+        if self.deadline is None:
+            handle.write('#Deadline: None\n')
+        else:
+            handle.write('#Deadline: ' + time.ctime(self.deadline) + '\n')
+        handle.write('#Max evaluations: ' + str(self.max_evals) + '\n')
+        handle.write('#Stopped by budget: ' + ' '.join([str(s) for s in self.stopped]) + '\n')
+        handle.write('#Seed: ' + str(self.seed) + '\n')
+        handle.write('#Replicate seeds: ' + ' '.join([str(s) for s in self.rep_seeds]) + '\n')
+        if self.search == 'de':
+            handle.write('#Search: de (population size ' + str(self.popsize) + ')\n')
+        else:
+            handle.write('#Search: anneal\n')
+        handle.write('#Hot grid: ' + ' '.join([str(s) for s in self.grids['hot']]) + '\n')
+        handle.write('#Cold grid: ' + ' '.join([str(s) for s in self.grids['cold']]) + '\n')
+        handle.write('#BFGS grid: ' + ' '.join([str(s) for s in self.grids['bfgs']]) + '\n')
+        if self.project:
+            handle.write('#Hot projection: ' + ' '.join([str(s) for s in self.project]) + '\n')
+        else:
+            handle.write('#Hot projection: None\n')
         # Then write some model summaries
         handle.write('#Data Likelihoods: ' + ' '.join([str(s) for s in self.mod_like]) + '\n')
         handle.write('#Optimized Likelihoods: ' + ' '.join([str(s) for s in self.opt_like]) + '\n')
@@ -301,9 +847,26 @@ class DemoModel(object):
         handle.write('#LocusLem: ' + str(locuslen) + '\n')
         handle.write('#4*Na*u*L: ' + str(self.theta_mean) + '\n')
         handle.write('#Na: ' + str(self.Na) + '\n')
+        handle.write('#Spectrum cache hits: ' + str(self.modelfunc.hits + self.worker_hits) + '\n')
+        handle.write('#Spectrum cache misses: ' + str(self.modelfunc.misses + self.worker_misses) + '\n')
+        handle.write('#Evaluations: ' + ' '.join([str(s) for s in self.evaluations]) + '\n')
+        handle.write('#Model time: ' + ' '.join(['%.2f' % s for s in self.model_time]) + '\n')
+        handle.write('#Evaluations per second: ' + ' '.join(
+            ['%.2f' % (n / t) for n, t in zip(self.evaluations, self.elapsed)]) + '\n')
         for name, val in zip(self.params['Names'], self.scaled_params):
             towrite = '#' + name + ': ' + str(val) + '\n'
             handle.write(towrite)
+        # Standard errors of the parameters of the best replicate, and the
+        # confidence intervals of the scaled values, if they were estimated
+        if self.gim is not None:
+            handle.write('#GIM replicate: ' + str(self.gim['replicate']) + '\n')
+            handle.write('#GIM bootstraps: ' + str(self.gim['bootstraps']) + '\n')
+            handle.write('#GIM step: ' + str(self.gim['eps']) + '\n')
+            handle.write('#GIM model evaluations: ' + str(self.gim['evaluations']) + '\n')
+            for name, se in zip(self.params['Names'] + ['theta'], self.gim['se']):
+                handle.write('#SE ' + name + ': ' + str(se) + '\n')
+            for name, val, se in self.gim['intervals']:
+                handle.write('#' + name + ' 95% CI: ' + str(val - CI_Z * se) + ' ' + str(val + CI_Z * se) + '\n')
         # Then a table of the parameters that were found
         handle.write('Iteration\t' + '\t'.join(self.params['Names']) + '\n')
         handle.write('Initial\t' + '\t'.join([str(s) for s in self.params['Values']]) + '\n')
@@ -329,6 +892,97 @@ class DemoModel(object):
         handle.write('BFGS_Mean\t' + '\t'.join([str(s) for s in self.bfgs_mean]) + '\n')
         handle.flush()
         handle.close()
+        os.replace(self.output + '.tmp', self.output)
+        self.write_trace()
+        if self.store is not None:
+            self.store_results(niter, locuslen)
+        return
+
+    def store_results(self, niter, locuslen):
+        """Store what write_out writes in the results database, replacing
+        what was stored for this run before. The run goes on if the database
+        cannot be written, since the output file has the same results."""
+        names = self.params['Names']
+        run = {
+            'pop1': self.popnames[0],
+            'pop2': self.popnames[1],
+            'output': self.outprefix,
+            'model': self.modelname,
+            'sfs': self.sfs_file,
+            'max_iterations': niter,
+            'locus_length': locuslen,
+            'seed': str(self.seed),
+            'search': self.search,
+            'theta_mean': float(self.theta_mean),
+            'na': float(self.Na)}
+        replicates = []
+        parameters = []
+        for index in range(len(self.opt_like)):
+            replicates.append({
+                'replicate': index,
+                'seed': str(self.rep_seeds[index]),
+                'last_stage': self.last_stage[index],
+                'stopped': int(self.stopped[index]),
+                'data_likelihood': float(self.mod_like[index]),
+                'optimized_likelihood': float(self.opt_like[index]),
+                'aic': float(self.aic[index]),
+                'theta': float(self.theta[index]),
+                'evaluations': int(self.evaluations[index]),
+                'model_time': float(self.model_time[index]),
+                'elapsed': float(self.elapsed[index])})
+            for k, name in enumerate(names):
+                parameters.append({
+                    'replicate': index,
+                    'name': name,
+                    'perturbed': float(self.p_init[index][k]),
+                    'hot': float(self.hot_params[index][k]),
+                    'cold': float(self.cold_params[index][k]),
+                    'bfgs': float(self.opt_params[index][k])})
+        # The mean of each parameter and its scaled value, with the standard
+        # errors of the best replicate if they were estimated. The standard
+        # errors are of the fitted values (as in the mean column) and the
+        # intervals of the scaled values, so theta has a row of its own for
+        # its standard error and Na one for its interval
+        estimates = []
+        rows = ([('theta', self.theta_mean, None), ('Na', None, self.Na)]
+                + list(zip(names, self.bfgs_mean, self.scaled_params)))
+        for position, (name, mean, scaled) in enumerate(rows):
+            estimates.append({
+                'name': name,
+                'position': position,
+                'mean': None if mean is None else float(mean),
+                'scaled': None if scaled is None else float(scaled),
+                'se': None,
+                'ci_low': None,
+                'ci_high': None})
+        if self.gim is not None:
+            by_name = dict((row['name'], row) for row in estimates)
+            for name, se in zip(names + ['theta'], self.gim['se']):
+                by_name[name]['se'] = float(se)
+            for name, val, ci_se in self.gim['intervals']:
+                by_name[name]['ci_low'] = float(val - CI_Z * ci_se)
+                by_name[name]['ci_high'] = float(val + CI_Z * ci_se)
+        try:
+            results_db.save_run(self.store, run, replicates, parameters, estimates)
+        except sqlite3.Error as e:
+            sys.stderr.write('Warning, could not store the results in ' + self.store + ': ' + str(e) + '\n')
+        return
+
+    def write_trace(self):
+        """Write the best log likelihood of each replicate against time, one
+        row each time it improved. Log likelihoods of a hot stage on a
+        projected SFS are for the projected SFS."""
+        try:
+            handle = open(self.traceout + '.tmp', 'w')
+        except OSError:
+            print('Error, you do not have permission to write files here.')
+            sys.exit(1)
+        handle.write('Replicate\tStage\tSeconds\tEvaluations\tLog_Likelihood\n')
+        for index, trace in enumerate(self.trace):
+            for stage, seconds, evaluations, ll in trace:
+                handle.write('\t'.join([str(index), stage, '%.3f' % seconds, str(evaluations), str(ll)]) + '\n')
+        handle.close()
+        os.replace(self.traceout + '.tmp', self.traceout)
         return
 
     def plot(self, vmin, vmax, resid_range=None,
@@ -3,6 +3,7 @@
 
 import numpy
 import dadi
+from . import ancestral
 
 
 def sc(params, ns, pts):
@@ -20,13 +21,13 @@ def sc(params, ns, pts):
     n1,n2: Size of fs to generate.
     pts: Number of points to use in grid for evaluation.
     """
-    # Define the grid we'll use
-    xx = dadi.Numerics.default_grid(pts)
+    # Define the grid we'll use. The grid and the starting phi are computed
+    # once per number of points, and shared by all models.
+    xx = ancestral.grid(pts)
 
-    # phi for the equilibrium ancestral population
-    phi = dadi.PhiManip.phi_1D(xx)
-    # Now do the divergence event
-    phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+    # phi for the equilibrium ancestral population, just after the divergence
+    # event
+    phi = ancestral.split_phi(pts)
     # We set the population sizes after the split to nu1 and nu2 and the migration rate to zero
     phi = dadi.Integration.two_pops(phi, xx, Ts, nu1, nu2, m12=0, m21=0)
     # We keep the population sizes after the split to nu1 and nu2 and set the migration rates to m12 and m21
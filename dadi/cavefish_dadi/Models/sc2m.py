@@ -3,6 +3,7 @@
 
 import numpy
 import dadi
+from . import ancestral
 
 
 def sc2m(params, ns, pts):
@@ -23,30 +24,28 @@ def sc2m(params, ns, pts):
     n1,n2: Size of fs to generate.
     pts: Number of points to use in grid for evaluation.
     """
-    # Define the grid we'll use
-    xx = dadi.Numerics.default_grid(pts)
+    # Define the grid we'll use. The grid and the starting phi are computed
+    # once per number of points, and shared by all models.
+    xx = ancestral.grid(pts)
 
-    ### Calculate the neutral spectrum
-    # phi for the equilibrium ancestral population
-    phiN = dadi.PhiManip.phi_1D(xx)
-    # Now do the divergence event
-    phiN = dadi.PhiManip.phi_1D_to_2D(xx, phiN)
+    ### The history shared by the neutral and genomic island spectra
+    # phi for the equilibrium ancestral population, just after the divergence
+    # event
+    phi = ancestral.split_phi(pts)
     # We set the population sizes after the split to nu1 and nu2 and the migration rate to zero
-    phiN = dadi.Integration.two_pops(phiN, xx, Ts, nu1, nu2, m12=0, m21=0)
+    phi = dadi.Integration.two_pops(phi, xx, Ts, nu1, nu2, m12=0, m21=0)
+    # The two categories of loci only differ after secondary contact.
+    # two_pops integrates a copy of phi, so both can start from the same array.
+
+    ### Calculate the neutral spectrum
     # We keep the population sizes after the split to nu1 and nu2 and set the migration rates to m12 and m21
-    phiN = dadi.Integration.two_pops(phiN, xx, Tsc, nu1, nu2, m12=m12, m21=m21)
+    phiN = dadi.Integration.two_pops(phi, xx, Tsc, nu1, nu2, m12=m12, m21=m21)
     # calculate the spectrum.
     fsN = dadi.Spectrum.from_phi(phiN, (n1,n2), (xx,xx))
 
     ### Calculate the genomic island spectrum
-    # phi for the equilibrium ancestral population
-    phiI = dadi.PhiManip.phi_1D(xx)
-    # Now do the divergence event
-    phiI = dadi.PhiManip.phi_1D_to_2D(xx, phiI)
-    # We set the population sizes after the split to nu1 and nu2 and the migration rate to zero
-    phiI = dadi.Integration.two_pops(phiI, xx, Ts, nu1, nu2, m12=0, m21=0)
     # We keep the population sizes after the split to nu1 and nu2 and set the migration rates to me12 and me21
-    phiI = dadi.Integration.two_pops(phiI, xx, Tsc, nu1, nu2, m12=me12, m21=me21)
+    phiI = dadi.Integration.two_pops(phi, xx, Tsc, nu1, nu2, m12=me12, m21=me21)
     # calculate the spectrum.
     fsI = dadi.Spectrum.from_phi(phiI, (n1,n2), (xx,xx))
 
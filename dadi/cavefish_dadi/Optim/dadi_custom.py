@@ -3,93 +3,425 @@
 
 import os
 import sys
+import time
+import collections
+import multiprocessing
 import numpy as np
 from numpy import logical_and, logical_not
 from dadi import Misc, Numerics
 from scipy.special import gammaln
 import scipy.optimize
 
-_theta_store = {}
-_counter = 0
 _out_of_bounds_val = -1e8
+# Number of optimal thetas an OptimizationContext keeps by default
+THETA_STORE_SIZE = 10000
+
+class BudgetExhausted(Exception):
+    """Raised by an objective function when its OptimizationContext has run
+    out of time or evaluations."""
+
+class OptimizationContext(object):
+    """The state of one optimization run: the count of objective function
+    evaluations, a bounded store of the optimal theta of the most recently
+    evaluated parameters, the stream for verbose output, timing statistics,
+    and a trace of the best log likelihood found against time. Optimizations
+    with their own contexts can run at the same time in one process without
+    interfering. A context can be suspended between the stages of a longer
+    optimization, and pickled to carry on in another process (without its
+    output stream, which becomes sys.stdout). A context with a deadline (a
+    time.time() value) or a maximum number of evaluations stops the
+    optimizations using it when either is reached; they return the best
+    parameters seen."""
+
+    def __init__(self, output_stream=sys.stdout, theta_store_size=THETA_STORE_SIZE,
+                 deadline=None, max_evaluations=None):
+        self.output_stream = output_stream
+        self.deadline = deadline
+        self.max_evaluations = max_evaluations
+        self.theta_store_size = theta_store_size
+        self.theta_store = collections.OrderedDict()
+        self.evaluations = 0
+        self.out_of_bounds = 0
+        # Seconds spent in the model function, and since the context was made
+        self.model_time = 0.0
+        self.started = time.time()
+        # Seconds elapsed when the clock was suspended, None while running
+        self.paused = None
+        # The name of the current stage of the optimization, set by the
+        # caller, and (stage, seconds, evaluations, log likelihood) each time
+        # the best log likelihood improves, with the parameters it was found at
+        self.stage = None
+        self.best = None
+        self.best_params = None
+        self.trace = []
+
+    def store_theta(self, params, theta):
+        """Keep the optimal theta of a parameter vector, forgetting the oldest
+        one if the store is full."""
+        self.theta_store[params] = theta
+        self.theta_store.move_to_end(params)
+        while len(self.theta_store) > self.theta_store_size:
+            self.theta_store.popitem(last=False)
+
+    def elapsed(self):
+        if self.paused is not None:
+            return self.paused
+        return time.time() - self.started
+
+    def suspend(self):
+        """Stop the clock, e.g. while other optimizations run."""
+        self.paused = self.elapsed()
+
+    def resume(self):
+        """Start the clock again after suspend."""
+        if self.paused is not None:
+            self.started = time.time() - self.paused
+            self.paused = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['output_stream']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.output_stream = sys.stdout
+
+    def improve(self, ll, params=None):
+        """Add a log likelihood to the trace if it is the best so far, and
+        keep the parameters it was found at."""
+        if self.best is None or ll > self.best:
+            self.best = ll
+            self.best_params = params
+            self.trace.append((self.stage, self.elapsed(), self.evaluations, ll))
+
+    def reset_best(self):
+        """Forget the best log likelihood, e.g. when the data change."""
+        self.best = None
+        self.best_params = None
+
+    def exhausted(self):
+        """Check whether the time or evaluation budget has run out."""
+        return ((self.deadline is not None and time.time() >= self.deadline)
+                or (self.max_evaluations is not None
+                    and self.evaluations >= self.max_evaluations))
+
+    def check(self):
+        """Raise BudgetExhausted if the budget has run out."""
+        if self.exhausted():
+            raise BudgetExhausted()
+
+# Used by _object_func when it is not given a context
+_default_context = OptimizationContext()
+
+# The PreparedObjectives of recent _object_func calls, so that an optimizer
+# calling it over and over only prepares the data once. The data spectrum is
+# identified by id, so it must not be changed in place between calls.
+PREPARED_CACHE_SIZE = 8
+_prepared = collections.OrderedDict()
+
+def _settings_key(value):
+    """Turn the settings of an _object_func call other than the data into
+    something hashable. Objects other than numbers, strings and containers
+    (the model function, streams and contexts) are identified by id; the
+    cached PreparedObjective keeps them alive, so their ids are not reused
+    while it is in the cache."""
+    if value is None or isinstance(value, (bool, int, float, str, np.number)):
+        return value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_settings_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _settings_key(v)) for k, v in value.items()))
+    return ('id', id(value))
 
 def _object_func(params, data, model_func, pts,
                  lower_bound=None, upper_bound=None,
                  verbose=0, multinom=True, flush_delay=0,
                  func_args=None, func_kwargs=None, fixed_params=None, ll_scale=1,
-                 output_stream=sys.stdout, store_thetas=False):
-    global _counter
-    _counter += 1
-
-    func_args = func_args or []
-    func_kwargs = func_kwargs or {}
-
-    params_up = _project_params_up(params, fixed_params)
-
-    if lower_bound is not None:
-        for pval, bound in zip(params_up, lower_bound):
-            if bound is not None and pval < bound:
-                return -_out_of_bounds_val / ll_scale
-    if upper_bound is not None:
-        for pval, bound in zip(params_up, upper_bound):
-            if bound is not None and pval > bound:
-                return -_out_of_bounds_val / ll_scale
-
-    ns = data.sample_sizes
-    all_args = [params_up, ns] + list(func_args)
-    func_kwargs = func_kwargs.copy()
-    func_kwargs["pts"] = pts
-
-    sfs = model_func(*all_args, **func_kwargs)
-    result = ll_multinom(sfs, data) if multinom else ll(sfs, data)
-
-    if store_thetas:
-        _theta_store[tuple(params)] = optimal_sfs_scaling(sfs, data)
-
-    if np.isnan(result):
-        result = _out_of_bounds_val
-
-    if verbose > 0 and (_counter % verbose == 0):
-        param_str = 'array([%s])' % ', '.join(f'{v: -12g}' for v in params_up)
-        output_stream.write(f"{_counter:<8d}, {result:<12g}, {param_str}{os.linesep}")
-        Misc.delayed_flush(delay=flush_delay)
-
-    return -result / ll_scale
+                 output_stream=None, store_thetas=False, context=None):
+    settings = (data, model_func, pts, lower_bound, upper_bound, verbose,
+                multinom, flush_delay, func_args, func_kwargs, fixed_params,
+                ll_scale, output_stream, store_thetas, context or _default_context)
+    key = (id(data), _settings_key(settings[1:]))
+    objective = _prepared.get(key)
+    if objective is None:
+        objective = PreparedObjective(*settings)
+        _prepared[key] = objective
+        if len(_prepared) > PREPARED_CACHE_SIZE:
+            _prepared.popitem(last=False)
+    else:
+        _prepared.move_to_end(key)
+    return objective(params)
 
 def _object_func_log(log_params, *args, **kwargs):
     return _object_func(np.exp(log_params), *args, **kwargs)
 
+class PreparedObjective(object):
+    """The objective function of _object_func for one data spectrum, with
+    everything that does not depend on the parameters (the data mask and
+    values, their log-factorial term and the bounds) computed once. The
+    multinomial log-likelihood is evaluated with plain ndarray operations
+    instead of masked array arithmetic. Non-finite likelihoods count as out of
+    bounds. Evaluations are counted in context, which is new for this
+    objective if not given; verbose output goes to output_stream if given,
+    otherwise to the stream of the context."""
+
+    def __init__(self, data, model_func, pts,
+                 lower_bound=None, upper_bound=None,
+                 verbose=0, multinom=True, flush_delay=0,
+                 func_args=None, func_kwargs=None, fixed_params=None, ll_scale=1,
+                 output_stream=None, store_thetas=False, context=None):
+        self.data = data
+        self.model_func = model_func
+        self.pts = pts
+        self.verbose = verbose
+        self.multinom = multinom
+        self.flush_delay = flush_delay
+        self.func_args = list(func_args or [])
+        self.func_kwargs = dict(func_kwargs or {})
+        self.func_kwargs["pts"] = pts
+        self.fixed_params = fixed_params
+        self.ll_scale = ll_scale
+        self.context = context or OptimizationContext()
+        self.output_stream = output_stream or self.context.output_stream
+        self.store_thetas = store_thetas
+
+        self.ns = data.sample_sizes
+        self.folded = data.folded
+        self.data_mask = np.ma.getmaskarray(data)
+        self.data_values = np.asarray(np.ma.getdata(data), dtype=float)
+        # Masked cells may hold anything, so keep them out of the log-factorial
+        safe = np.where(self.data_mask, 0, self.data_values)
+        self.gammaln_data = gammaln(safe + 1)
+
+        self.lower = self._bound_array(lower_bound, -np.inf)
+        self.upper = self._bound_array(upper_bound, np.inf)
+        if fixed_params is not None:
+            self.free = np.array([fix is None for fix in fixed_params])
+            self.fixed_values = np.array(
+                [0 if fix is None else fix for fix in fixed_params], dtype=float)
+
+    @staticmethod
+    def _bound_array(bound, missing):
+        if bound is None:
+            return None
+        return np.array([missing if b is None else b for b in bound], dtype=float)
+
+    def params_up(self, params):
+        """Vectorized _project_params_up."""
+        if self.fixed_params is None:
+            return params
+        pout = self.fixed_values.copy()
+        pout[self.free] = params
+        return pout
+
+    def log_likelihood(self, model):
+        """Return the log-likelihood of the data given a model spectrum and
+        the optimal theta (theta is None unless multinom)."""
+        if self.folded and not model.folded:
+            model = model.fold()
+        values = np.ma.getdata(model)
+        keep = ~(self.data_mask | np.ma.getmaskarray(model))
+        model_kept = values[keep]
+        data_kept = self.data_values[keep]
+        theta = None
+        if self.multinom:
+            theta = data_kept.sum() / model_kept.sum()
+            model_kept = theta * model_kept
+        # Cells where the model is not positive do not contribute
+        positive = ~(model_kept <= 0)
+        model_kept = model_kept[positive]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = (-model_kept + data_kept[positive] * np.log(model_kept)
+                      - self.gammaln_data[keep][positive]).sum()
+        return result, theta
+
+    def __call__(self, params):
+        context = self.context
+        context.check()
+        context.evaluations += 1
+
+        params_up = self.params_up(params)
+
+        if ((self.lower is not None and np.any(params_up < self.lower))
+                or (self.upper is not None and np.any(params_up > self.upper))):
+            context.out_of_bounds += 1
+            return -_out_of_bounds_val / self.ll_scale
+
+        all_args = [params_up, self.ns] + self.func_args
+        start = time.perf_counter()
+        sfs = self.model_func(*all_args, **self.func_kwargs)
+        context.model_time += time.perf_counter() - start
+        result, theta = self.log_likelihood(sfs)
+
+        if self.store_thetas:
+            if theta is None:
+                theta = optimal_sfs_scaling(sfs, self.data)
+            context.store_theta(tuple(params), theta)
+
+        if not np.isfinite(result):
+            result = _out_of_bounds_val
+        context.improve(result, params_up)
+
+        if self.verbose > 0 and (context.evaluations % self.verbose == 0):
+            param_str = 'array([%s])' % ', '.join(f'{v: -12g}' for v in params_up)
+            self.output_stream.write(f"{context.evaluations:<8d}, {result:<12g}, {param_str}{os.linesep}")
+            Misc.delayed_flush(delay=self.flush_delay)
+
+        return -result / self.ll_scale
+
+    def log(self, log_params):
+        """The objective for parameters in log space."""
+        return self(np.exp(log_params))
+
+    def stopped_result(self, p0, transform):
+        """The result of an optimization stopped by BudgetExhausted: the best
+        parameters seen (p0 if there were none), in the space of the
+        optimizer."""
+        context = self.context
+        if context.best_params is None:
+            params, fun = p0, -_out_of_bounds_val / self.ll_scale
+        else:
+            params, fun = context.best_params, -context.best / self.ll_scale
+        x = np.asarray(_project_params_down(params, self.fixed_params), dtype=float)
+        if transform == "log":
+            x = np.log(x)
+        return scipy.optimize.OptimizeResult(
+            x=x, fun=fun, nit=0, nfev=context.evaluations, success=False,
+            message='Budget exhausted')
+
+# The objective and the function to evaluate (the objective itself or its log
+# space version) in each worker process of an ObjectivePool, set up by
+# _start_objective_worker
+_worker_objective = None
+_worker_func = None
+
+def _start_objective_worker(objective, transform):
+    """Keep the objective in a worker process, with its own context and
+    without verbose output."""
+    global _worker_objective, _worker_func
+    objective.verbose = 0
+    objective.context = OptimizationContext()
+    _worker_objective = objective
+    _worker_func = objective.log if transform == "log" else objective
+    return
+
+def _evaluate_point(params):
+    """Evaluate the objective at one point in a worker process. Returns the
+    value and the seconds spent in the model function."""
+    context = _worker_objective.context
+    model_time = context.model_time
+    value = _worker_func(params)
+    return value, context.model_time - model_time
+
+class ObjectivePool(object):
+    """A pool of processes that evaluate an objective at many points at once.
+    The objective (with its model function and data) is handed to each worker
+    once when the pool starts; this relies on the fork start method, since
+    extrapolating model functions cannot be pickled. The evaluations, time in
+    the model and improvements are counted in the context of the objective."""
+
+    def __init__(self, objective, transform, processes):
+        self.objective = objective
+        self.transform = transform
+        self.context = objective.context
+        self.ll_scale = objective.ll_scale
+        self.pool = multiprocessing.get_context('fork').Pool(
+            processes,
+            initializer=_start_objective_worker,
+            initargs=(objective, transform))
+
+    def map(self, points):
+        """Return the objective at each of the points. Raises
+        BudgetExhausted when the budget of the context has run out, before or
+        after the points are evaluated."""
+        self.context.check()
+        results = self.pool.map(_evaluate_point, points)
+        for point, (value, model_time) in zip(points, results):
+            self.context.evaluations += 1
+            self.context.model_time += model_time
+            params = np.exp(point) if self.transform == "log" else point
+            self.context.improve(-value * self.ll_scale, self.objective.params_up(params))
+        self.context.check()
+        return [value for value, _ in results]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class ParallelGradient(object):
+    """The forward difference gradient that fmin_bfgs computes when it is
+    given epsilon, with the perturbed points evaluated concurrently in an
+    ObjectivePool. The value at the unperturbed point is evaluated here,
+    where fmin_bfgs has just asked for it, so a cached model function does not
+    compute it again."""
+
+    def __init__(self, objective, transform, epsilon, processes):
+        self.func = objective.log if transform == "log" else objective
+        self.epsilon = epsilon
+        self.pool = ObjectivePool(objective, transform, processes)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        f0 = self.func(x)
+        steps = np.broadcast_to(self.epsilon, x.shape)
+        points = []
+        for i, step in enumerate(steps):
+            point = x.copy()
+            point[i] += step
+            points.append(point)
+        values = self.pool.map(points)
+        # Divide by the step actually taken, as scipy does
+        return np.array([(f - f0) / (point[i] - x[i])
+                         for i, (f, point) in enumerate(zip(values, points))])
+
+    def close(self):
+        self.pool.close()
+
 def optimize_log(*args, **kwargs):
-    return _optimize_wrapper(scipy.optimize.fmin_bfgs, _object_func_log, transform="log", *args, **kwargs)
+    return _optimize_wrapper(scipy.optimize.fmin_bfgs, "log", *args, **kwargs)
 
 def optimize_log_fmin(*args, **kwargs):
-    return _optimize_wrapper(scipy.optimize.fmin, _object_func_log, transform="log", *args, **kwargs)
+    return _optimize_wrapper(scipy.optimize.fmin, "log", *args, **kwargs)
 
 def optimize(*args, **kwargs):
-    return _optimize_wrapper(scipy.optimize.fmin_bfgs, _object_func, transform=None, *args, **kwargs)
+    return _optimize_wrapper(scipy.optimize.fmin_bfgs, None, *args, **kwargs)
 
-def _optimize_wrapper(opt_func, objective_func, transform, p0, data, model_func, pts,
+def _optimize_wrapper(opt_func, transform, p0, data, model_func, pts,
                       lower_bound=None, upper_bound=None,
                       verbose=0, flush_delay=0.5, epsilon=1e-3,
                       gtol=1e-5, multinom=True, maxiter=None, full_output=False,
                       func_args=None, func_kwargs=None, fixed_params=None,
-                      ll_scale=1, output_file=None):
-    func_args = func_args or []
-    func_kwargs = func_kwargs or []
-
-    output_stream = open(output_file, 'w') if output_file else sys.stdout
+                      ll_scale=1, output_file=None, context=None,
+                      gradient_processes=1):
+    output_stream = open(output_file, 'w') if output_file else None
 
-    args = (data, model_func, pts, lower_bound, upper_bound, verbose,
-            multinom, flush_delay, func_args, func_kwargs, fixed_params,
-            ll_scale, output_stream)
+    objective = PreparedObjective(data, model_func, pts, lower_bound, upper_bound,
+                                  verbose, multinom, flush_delay, func_args,
+                                  func_kwargs, fixed_params, ll_scale, output_stream,
+                                  context=context)
+    objective_func = objective.log if transform == "log" else objective
 
     p0_opt = _project_params_down(p0, fixed_params)
     if transform == "log":
         p0_opt = np.log(p0_opt)
 
-    outputs = opt_func(objective_func, p0_opt, args=args,
-                       epsilon=epsilon, gtol=gtol,
-                       full_output=True, disp=False, maxiter=maxiter)
+    opt_kwargs = {'full_output': True, 'disp': False, 'maxiter': maxiter}
+    gradient = None
+    if opt_func is scipy.optimize.fmin_bfgs:
+        opt_kwargs.update(epsilon=epsilon, gtol=gtol)
+        if gradient_processes > 1:
+            gradient = ParallelGradient(objective, transform, epsilon, gradient_processes)
+            opt_kwargs['fprime'] = gradient
+    try:
+        outputs = opt_func(objective_func, p0_opt, **opt_kwargs)
+    except BudgetExhausted:
+        # Only the best parameters and their value are known
+        result = objective.stopped_result(p0, transform)
+        outputs = (result.x, result.fun)
+    finally:
+        if gradient is not None:
+            gradient.close()
 
     xopt = outputs[0]
     xopt = np.exp(xopt) if transform == "log" else xopt
@@ -149,43 +481,53 @@ def _project_params_up(pin, fixed_params):
 from scipy.optimize import dual_annealing
 
 
+def _log_bounds(lower_bound, upper_bound):
+    """Return (low, high) bounds in log space for a global search, with
+    missing or non-positive bounds replaced by 1e-5 and 100."""
+    bounds = []
+    for i, (lo, hi) in enumerate(zip(lower_bound, upper_bound)):
+        lo = 1e-5 if lo is None or lo <= 0 or np.isnan(lo) else lo
+        hi = 100.0 if hi is None or hi <= lo or np.isnan(hi) else hi
+        try:
+            log_lo = np.log(lo)
+            log_hi = np.log(hi)
+            bounds.append((log_lo, log_hi))
+        except ValueError:
+            raise ValueError(f"Invalid bounds at index {i}: lo={lo}, hi={hi}")
+    return bounds
+
 def optimize_anneal(p0, data, model_func, pts,
                     lower_bound=None, upper_bound=None,
                     verbose=0, flush_delay=0.5,
                     multinom=True, maxiter=None, full_output=False,
                     func_args=None, func_kwargs=None, fixed_params=None,
                     ll_scale=1, output_file=None,
-                    Tini=None, Tfin=None, learn_rate=None, schedule=None):
+                    Tini=None, Tfin=None, learn_rate=None, schedule=None,
+                    context=None):
 
     from scipy.optimize import dual_annealing
 
     func_args = func_args or []
     func_kwargs = func_kwargs or {}
 
-    output_stream = open(output_file, 'w') if output_file else sys.stdout
+    output_stream = open(output_file, 'w') if output_file else None
 
-    args = (data, model_func, pts, lower_bound, upper_bound, verbose,
-            multinom, flush_delay, func_args, func_kwargs, fixed_params,
-            ll_scale, output_stream)
+    objective = PreparedObjective(data, model_func, pts, lower_bound, upper_bound,
+                                  verbose, multinom, flush_delay, func_args,
+                                  func_kwargs, fixed_params, ll_scale, output_stream,
+                                  context=context)
 
     p0_down = _project_params_down(p0, fixed_params)
 
-    bounds = []
-    for i, (lo, hi) in enumerate(zip(lower_bound, upper_bound)):
-        lo = 1e-5 if lo is None or lo <= 0 or np.isnan(lo) else lo
-        hi = 100.0 if hi is None or hi <= lo or np.isnan(hi) else hi
-        try:
-            log_lo = np.log(lo)
-            log_hi = np.log(hi)
-            bounds.append((log_lo, log_hi))
-        except ValueError:
-            raise ValueError(f"Invalid bounds at index {i}: lo={lo}, hi={hi}")
+    bounds = _log_bounds(lower_bound, upper_bound)
 
-    result = dual_annealing(_object_func_log,
-                            bounds=bounds,
-                            args=args,
-                            maxiter=maxiter or 500,
-                            no_local_search=True)
+    try:
+        result = dual_annealing(objective.log,
+                                bounds=bounds,
+                                maxiter=maxiter or 500,
+                                no_local_search=True)
+    except BudgetExhausted:
+        result = objective.stopped_result(p0, "log")
 
     xopt = np.exp(result.x)
     xopt = _project_params_up(xopt, fixed_params)
@@ -198,28 +540,56 @@ def optimize_anneal(p0, data, model_func, pts,
     else:
         return xopt, result.fun, result.nit, result.nfev, result.message
 
-    func_args = func_args or []
-    func_kwargs = func_kwargs or {}
-
-    output_stream = open(output_file, 'w') if output_file else sys.stdout
-
-    args = (data, model_func, pts, lower_bound, upper_bound, verbose,
-            multinom, flush_delay, func_args, func_kwargs, fixed_params,
-            ll_scale, output_stream)
-
-    p0_down = _project_params_down(p0, fixed_params)
-
-    bounds = []
-    for lo, hi in zip(lower_bound, upper_bound):
-        lo = lo if lo is not None else 1e-5
-        hi = hi if hi is not None else 100
-        bounds.append((np.log(lo), np.log(hi)))
-
-    result = dual_annealing(_object_func_log,
-                            bounds=bounds,
-                            args=args,
-                            maxiter=maxiter or 500,
-                            no_local_search=True)
+def optimize_de(p0, data, model_func, pts,
+                lower_bound=None, upper_bound=None,
+                verbose=0, flush_delay=0.5,
+                multinom=True, maxiter=None, full_output=False,
+                func_args=None, func_kwargs=None, fixed_params=None,
+                ll_scale=1, output_file=None,
+                popsize=15, processes=1, context=None):
+    """A global search by differential evolution in log parameter space, as
+    an alternative to optimize_anneal. Each generation of candidate
+    parameters is evaluated as a batch, in an ObjectivePool of processes if
+    processes > 1. p0 is included in the first generation. The random state
+    is drawn from numpy's global RNG, like the annealing."""
+
+    from scipy.optimize import differential_evolution
+
+    output_stream = open(output_file, 'w') if output_file else None
+
+    objective = PreparedObjective(data, model_func, pts, lower_bound, upper_bound,
+                                  verbose, multinom, flush_delay, func_args,
+                                  func_kwargs, fixed_params, ll_scale, output_stream,
+                                  context=context)
+
+    bounds = _log_bounds(lower_bound, upper_bound)
+    lo, hi = np.array(bounds).T
+    x0 = np.clip(np.log(_project_params_down(p0, fixed_params)), lo, hi)
+
+    pool = ObjectivePool(objective, "log", processes) if processes > 1 else None
+
+    def evaluate_generation(x):
+        # One candidate per column
+        points = list(np.asarray(x).T)
+        if pool is not None:
+            return np.array(pool.map(points))
+        return np.array([objective.log(point) for point in points])
+
+    try:
+        result = differential_evolution(evaluate_generation,
+                                        bounds=bounds,
+                                        maxiter=maxiter or 100,
+                                        popsize=popsize,
+                                        seed=np.random.randint(2**31),
+                                        polish=False,
+                                        x0=x0,
+                                        vectorized=True,
+                                        updating='deferred')
+    except BudgetExhausted:
+        result = objective.stopped_result(p0, "log")
+    finally:
+        if pool is not None:
+            pool.close()
 
     xopt = np.exp(result.x)
     xopt = _project_params_up(xopt, fixed_params)
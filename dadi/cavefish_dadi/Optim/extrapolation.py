@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""A version of dadi.Numerics.make_extrap_log_func that integrates the model
+for each grid size at the same time. The integrations for different grid sizes
+are independent, so with idle cores an extrapolated evaluation takes about as
+long as one on the largest grid. dadi's integrators hold the GIL, so the grid
+sizes are run in a pool of processes rather than threads."""
+
+import multiprocessing
+import numpy
+import dadi
+
+
+class ConcurrentExtrapModel(object):
+    """Wrap a model function (e.g. cavefish_dadi.Models.si.si) so that it is
+    extrapolated over a list of grid sizes like the function returned by
+    dadi.Numerics.make_extrap_log_func, with the grid sizes integrated in a
+    pool of processes. The spectra are combined by dadi's own extrapolation
+    code, so the result is the same as the serial version. The model function
+    must be picklable, i.e. defined at the top level of a module.
+
+    The pool is started on the first call with more than one grid size. Pool
+    workers (e.g. of a pool of replicates) cannot start pools of their own, so
+    in those the grid sizes are integrated one after the other. The pool is
+    stopped by close(), or at the end of a with block."""
+
+    def __init__(self, model_func, processes):
+        """Set the model function and the largest number of processes to run
+        the grid sizes in."""
+        self.model_func = model_func
+        self.processes = processes
+        self.pool = None
+        self.__name__ = model_func.__name__
+        self.__doc__ = model_func.__doc__
+        return
+
+    def __call__(self, params, ns, pts):
+        """Return the model spectrum extrapolated over the grid sizes pts (or
+        computed on one grid, if pts is a single number)."""
+        pts_l = [pts] if numpy.isscalar(pts) else list(pts)
+        tasks = [(params, ns, p) for p in pts_l]
+        if (len(pts_l) > 1 and self.processes > 1
+                and not multiprocessing.current_process().daemon):
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes)
+            results = self.pool.starmap(self.model_func, tasks)
+        else:
+            results = [self.model_func(*t) for t in tasks]
+        # Hand the spectra to dadi's extrapolation in place of the model
+        spectra = dict(zip(pts_l, results))
+        extrap_func = dadi.Numerics.make_extrap_log_func(lambda p: spectra[p])
+        return extrap_func(pts_l)
+
+    def close(self):
+        """Stop the pool of processes, if it was started. The model can still
+        be called afterwards, and starts a new pool if it needs one."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
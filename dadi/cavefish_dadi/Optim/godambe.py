@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Parameter uncertainties from the Godambe information matrix (GIM), as in
+dadi.Godambe.GIM_uncert with multinom=True, for many bootstrap spectra at
+once. dadi computes the finite difference derivatives one bootstrap spectrum
+at a time. Here every perturbed model spectrum is computed only once, in a
+pool of processes if asked, and all of them are scored against the data and
+every bootstrap spectrum in one stacked likelihood computation."""
+
+import multiprocessing
+import numpy
+from scipy.special import gammaln
+import dadi
+
+# The model function of each worker process, set up by _start_model_worker
+_worker_model = None
+
+
+def _start_model_worker(model_func):
+    """Keep the model function in a worker process."""
+    global _worker_model
+    _worker_model = model_func
+    return
+
+
+def _evaluate_model(task):
+    """Compute the model spectrum of one (params, ns, pts) task in a worker
+    process."""
+    params, ns, pts = task
+    return _worker_model(numpy.array(params), ns, pts)
+
+
+def step_sizes(p0, eps):
+    """Return the finite difference step of each parameter, and whether its
+    derivatives are taken on both sides, following dadi.Godambe: the step is
+    eps times the parameter, or eps itself for a parameter that is zero or so
+    small that the relative step would be lost. Both of those are only
+    stepped upwards. dadi's get_hess and get_grad only mark the small
+    non-zero parameters as one-sided, but hessian_elem and get_grad then take
+    two-sided differences only where the parameter is not zero either, so a
+    migration rate of 0 is never stepped to a negative value."""
+    p0 = numpy.asarray(p0, dtype=float)
+    central = (p0 != 0) & (p0 * eps >= 1e-6)
+    steps = numpy.where(central, eps * p0, eps)
+    return steps, central
+
+
+def _shifted(p0, steps, shifts):
+    """Return p0 moved by the given number of steps of each parameter, as a
+    tuple so that it can be used as a key."""
+    point = numpy.array(p0, dtype=float)
+    for i, k in shifts.items():
+        point[i] = p0[i] + k * steps[i]
+    return tuple(point.tolist())
+
+
+def hessian_terms(p0, steps, central):
+    """Return the finite difference formula of each element (i, j) of the
+    Hessian, as in dadi.Godambe.hessian_elem: a list of (weight, point)
+    pairs whose weighted values sum to the element."""
+    terms = {}
+    n = len(p0)
+    for i in range(n):
+        if central[i]:
+            terms[(i, i)] = [
+                (1.0, _shifted(p0, steps, {i: 1})),
+                (-2.0, _shifted(p0, steps, {})),
+                (1.0, _shifted(p0, steps, {i: -1}))]
+        else:
+            terms[(i, i)] = [
+                (1.0, _shifted(p0, steps, {i: 2})),
+                (-2.0, _shifted(p0, steps, {i: 1})),
+                (1.0, _shifted(p0, steps, {}))]
+        terms[(i, i)] = [(w / steps[i]**2, p) for w, p in terms[(i, i)]]
+        for j in range(i + 1, n):
+            if central[i] and central[j]:
+                scale = 1.0 / (4 * steps[i] * steps[j])
+                terms[(i, j)] = [
+                    (scale, _shifted(p0, steps, {i: 1, j: 1})),
+                    (-scale, _shifted(p0, steps, {i: 1, j: -1})),
+                    (-scale, _shifted(p0, steps, {i: -1, j: 1})),
+                    (scale, _shifted(p0, steps, {i: -1, j: -1}))]
+            else:
+                scale = 1.0 / (steps[i] * steps[j])
+                terms[(i, j)] = [
+                    (scale, _shifted(p0, steps, {i: 1, j: 1})),
+                    (-scale, _shifted(p0, steps, {i: 1})),
+                    (-scale, _shifted(p0, steps, {j: 1})),
+                    (scale, _shifted(p0, steps, {}))]
+    return terms
+
+
+def gradient_terms(p0, steps, central):
+    """Return the finite difference formula of each element of the
+    gradient, as in dadi.Godambe.get_grad, in the form of hessian_terms."""
+    terms = []
+    for i in range(len(p0)):
+        if central[i]:
+            scale = 1.0 / (2 * steps[i])
+            terms.append([
+                (scale, _shifted(p0, steps, {i: 1})),
+                (-scale, _shifted(p0, steps, {i: -1}))])
+        else:
+            scale = 1.0 / steps[i]
+            terms.append([
+                (scale, _shifted(p0, steps, {i: 1})),
+                (-scale, _shifted(p0, steps, {}))])
+    return terms
+
+
+def stacked_ll(models, spectra):
+    """Return the Poisson log likelihood (dadi.Inference.ll) of each of a list
+    of spectra given each of a list of model spectra, as a matrix with a row
+    per model. Cells masked in a spectrum or model, or where the model is not
+    positive, are left out, as dadi does."""
+    values = numpy.array([numpy.ma.getdata(m).ravel() for m in models], dtype=float)
+    usable = numpy.array([~numpy.ma.getmaskarray(m).ravel() for m in models]) & (values > 0)
+    counts = numpy.array([numpy.ma.getdata(s).ravel() for s in spectra], dtype=float)
+    weights = numpy.array([~numpy.ma.getmaskarray(s).ravel() for s in spectra], dtype=float)
+    # Every term is zero where the model is not usable, so each sum over the
+    # cells is a matrix product with the weights of the unmasked data cells
+    safe = numpy.where(usable, values, 1.0)
+    terms = (-numpy.where(usable, values, 0.0) @ weights.T
+             + numpy.where(usable, numpy.log(safe), 0.0) @ (counts * weights).T
+             - usable.astype(float) @ (gammaln(counts + 1) * weights).T)
+    return terms
+
+
+def gim_uncert(model_func, pts, boots, p0, data, eps=0.01, processes=1):
+    """Return the standard deviations of the parameters p0 fitted to data,
+    from the Godambe information matrix estimated with the bootstrap spectra
+    boots, along with the covariance matrix (the inverse GIM) and the number
+    of model spectra computed. As with dadi.Godambe.GIM_uncert and
+    multinom=True, theta is treated as an extra parameter, which comes last
+    in the results. The model spectra of the perturbed parameters are
+    computed in a pool of processes if processes > 1; the pool relies on the
+    fork start method, since extrapolating model functions cannot be
+    pickled."""
+    ns = data.sample_sizes
+    p0 = [float(p) for p in p0]
+    model0 = model_func(numpy.array(p0), ns, pts)
+    theta = dadi.Inference.optimal_sfs_scaling(model0, data)
+    full = numpy.array(p0 + [theta])
+    steps, central = step_sizes(full, eps)
+    hess = hessian_terms(full, steps, central)
+    grad = gradient_terms(full, steps, central)
+    points = sorted(set(p for terms in list(hess.values()) + grad for _w, p in terms))
+    # theta only scales the spectrum, so points that differ only in theta
+    # share one model spectrum
+    needed = sorted(set(p[:-1] for p in points) - {tuple(p0)})
+    tasks = [(params, ns, pts) for params in needed]
+    if processes > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(
+                processes,
+                initializer=_start_model_worker,
+                initargs=(model_func,)) as pool:
+            results = pool.map(_evaluate_model, tasks)
+    else:
+        results = [model_func(numpy.array(params), ns, pts) for params in needed]
+    spectra = dict(zip(needed, results))
+    spectra[tuple(p0)] = model0
+    # Score every point against the data (row 0) and each bootstrap
+    ll = stacked_ll([p[-1] * spectra[p[:-1]] for p in points], [data] + list(boots))
+    row = dict((p, k) for k, p in enumerate(points))
+
+    def derivative(terms):
+        return sum(w * ll[row[p]] for w, p in terms)
+
+    n = len(full)
+    hessian = numpy.empty((n, n))
+    for (i, j), terms in hess.items():
+        hessian[i, j] = hessian[j, i] = -derivative(terms)[0]
+    # One row of scores per bootstrap spectrum
+    scores = numpy.array([derivative(terms)[1:] for terms in grad]).T
+    J = scores.T @ scores / len(scores)
+    godambe = hessian @ numpy.linalg.inv(J) @ hessian
+    covariance = numpy.linalg.inv(godambe)
+    return numpy.sqrt(numpy.diag(covariance)), covariance, len(needed) + 1
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""A bounded cache of the spectra computed by a dadi model function, so that
+the same parameters are only integrated once."""
+
+import collections
+import numpy
+
+# Number of spectra to keep by default. A 2D spectrum for the sample sizes we
+# use is only tens of kilobytes.
+MAXSIZE = 1000
+# Parameters are rounded to this many significant digits in the cache key, so
+# that values that differ only by floating point noise (e.g. after a round
+# trip through log space) share a spectrum.
+DIGITS = 12
+
+
+def _freeze(value):
+    """Turn a parameter vector, sample sizes or grid sizes into something
+    hashable, rounding floating point values."""
+    if isinstance(value, (list, tuple, numpy.ndarray)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (float, numpy.floating)):
+        return float('%.*g' % (DIGITS, value))
+    if isinstance(value, numpy.integer):
+        return int(value)
+    return value
+
+
+class CachedModel(object):
+    """Wrap a model function (usually made by make_extrap_log_func) with a
+    least recently used cache of the spectra it returns, keyed on the model
+    name, rounded parameters, sample sizes and grid points. Counts the cache
+    hits and misses."""
+
+    def __init__(self, model_func, name, maxsize=MAXSIZE):
+        """Set the function to call, the name of the model it implements and
+        the number of spectra to keep."""
+        self.model_func = model_func
+        self.name = name
+        self.maxsize = maxsize
+        self.spectra = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def __call__(self, params, ns, *args, **kwargs):
+        """Return the model spectrum, computing it only if it is not cached.
+        A copy is returned, so callers may modify it. The grid points may be
+        given as the last positional argument or as pts=, as dadi allows; they
+        are passed on as pts= either way, so both forms share a cache entry."""
+        if 'pts' not in kwargs:
+            kwargs['pts'] = args[-1]
+            args = args[:-1]
+        key = (self.name, _freeze(params), _freeze(ns), _freeze(args),
+               tuple(sorted((k, _freeze(v)) for k, v in kwargs.items())))
+        if key in self.spectra:
+            self.hits += 1
+            self.spectra.move_to_end(key)
+            return self.spectra[key].copy()
+        self.misses += 1
+        fs = self.model_func(params, ns, *args, **kwargs)
+        if self.maxsize > 0:
+            self.spectra[key] = fs.copy()
+            if len(self.spectra) > self.maxsize:
+                self.spectra.popitem(last=False)
+        return fs
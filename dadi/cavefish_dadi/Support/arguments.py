@@ -6,10 +6,13 @@ import argparse
 
 # A list of models that have been implemented already.
 MODELS = ['SI', 'SC', 'AM', 'IM', 'SC2M', 'AM2M', 'IM2M']
+# Global searches for the hot stage of the optimization
+SEARCHES = ['anneal', 'de']
 
 
-def parse_args():
-    """Set up an argument parser, and parse then arguments with it."""
+def parse_args(argv=None):
+    """Set up an argument parser, and parse then arguments with it. The
+    arguments are taken from the command line unless a list is given."""
     # This is the main argument parser object
     parser = argparse.ArgumentParser(
         description='Cave fish dadi analyses',
@@ -55,15 +58,131 @@ def parse_args():
         default=1,
         type=int,
         help='Number of replicates to perform for each model.')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        required=False,
+        default=1,
+        type=int,
+        help='Number of processes to run the replicates of each model in. With one replicate, the gradients of the final BFGS optimization are computed in this many processes instead. Defaults to 1.')
+    parser.add_argument(
+        '-s',
+        '--seed',
+        required=False,
+        default=None,
+        type=int,
+        help='Random seed, from which a seed for each replicate is derived. Results are the same for any number of jobs. Defaults to a random seed, which is written to the output file.')
+    parser.add_argument(
+        '--halving',
+        required=False,
+        default=1,
+        type=float,
+        help='Successive halving ratio. After the hot and the cold stage, only the best 1/HALVING of the replicates are carried on; the rest are abandoned and reported with the stages they finished. Defaults to 1, which runs every replicate to the end.')
+    parser.add_argument(
+        '--time-budget',
+        required=False,
+        default=None,
+        type=float,
+        metavar='SECONDS',
+        help='Wall-clock time in seconds for the optimizations of all models. When it runs out, each replicate keeps the best parameters found so far and the rest of its stages are skipped. Results are written after every stage of every replicate either way. Defaults to no limit.')
+    parser.add_argument(
+        '--max-evals',
+        required=False,
+        default=None,
+        type=int,
+        metavar='N',
+        help='Maximum number of objective function evaluations per replicate, handled like --time-budget. Defaults to no limit.')
+    parser.add_argument(
+        '--search',
+        required=False,
+        default='anneal',
+        choices=SEARCHES,
+        help='Global search for the hot stage: simulated annealing (anneal), or differential evolution (de), which evaluates a population of parameters at a time and uses the -j processes with one replicate. Defaults to anneal.')
+    parser.add_argument(
+        '--popsize',
+        required=False,
+        default=15,
+        type=int,
+        help='Population size per parameter for --search de. Defaults to 15.')
+    parser.add_argument(
+        '--hot-grid',
+        required=False,
+        default=[50],
+        nargs='+',
+        metavar='PTS',
+        type=int,
+        help='Grid points for the hot annealing. Several values are extrapolated to an infinite grid. Defaults to 50.')
+    parser.add_argument(
+        '--cold-grid',
+        required=False,
+        default=[50],
+        nargs='+',
+        metavar='PTS',
+        type=int,
+        help='Grid points for the cold annealing. Defaults to 50.')
+    parser.add_argument(
+        '--bfgs-grid',
+        required=False,
+        default=[50],
+        nargs='+',
+        metavar='PTS',
+        type=int,
+        help='Grid points for the final BFGS optimization and the reported likelihoods. Defaults to 50.')
+    parser.add_argument(
+        '--hot-project',
+        required=False,
+        default=None,
+        nargs=2,
+        metavar='N',
+        type=int,
+        help='Project the SFS down to these sample sizes (one per population) for the hot annealing. Defaults to the full SFS.')
+    parser.add_argument(
+        '--grid-jobs',
+        required=False,
+        default=1,
+        type=int,
+        help='Number of processes to integrate the grid sizes of an extrapolated model evaluation in (see --hot-grid). Used when the replicates are not run in a pool. Defaults to 1.')
+    parser.add_argument(
+        '--bootstrap',
+        required=False,
+        default=None,
+        nargs='+',
+        metavar='SFS',
+        help='Bootstrap spectra of the SFS (e.g. from Make_2DSFS.py --bootstrap). When given, the standard errors of the parameters of the best replicate are estimated from the Godambe information matrix, and written with 95%% confidence intervals of the scaled parameters. The perturbed model spectra are computed in the -j processes.')
+    parser.add_argument(
+        '--gim-step',
+        required=False,
+        default=0.01,
+        type=float,
+        help='Relative step of the finite differences for the Godambe standard errors. Defaults to 0.01.')
+    parser.add_argument(
+        '--profile',
+        required=False,
+        default=None,
+        nargs='+',
+        metavar='PARAM',
+        help='After the replicates, compute the profile likelihood of these parameters (e.g. Tam p), fixing each at --profile-points values between its bounds and optimizing the others with BFGS, starting from the best replicate. A table is written for each parameter. The scans are run in the -j processes.')
+    parser.add_argument(
+        '--profile-points',
+        required=False,
+        default=11,
+        type=int,
+        help='Number of values of each parameter in --profile. Defaults to 11.')
+    parser.add_argument(
+        '--results-db',
+        required=False,
+        default=None,
+        metavar='DB',
+        help='SQLite database to also store the results in, along with those of other runs, for results_and_stats/collate_AIC.py and make_dadi_summary_by_model.py. Several runs can write to the same database at the same time. Defaults to the output file only.')
     parser.add_argument(
         '-l',
         '--length',
         required=True,
         type=int,
         help='Length of the locus. Note that this is the size of region, including invariant sites, that was used to generate the SFS.')
-    if len(sys.argv) == 1:
+    if argv is None and len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
     else:
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
         return args
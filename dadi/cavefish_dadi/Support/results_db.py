@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Keep the results of the dadi runs in one SQLite database, so that they can
+be collated with a query instead of reading every output file. Each run (one
+model fit to one pair of populations with one output prefix) has a row in
+the runs table, with a row per replicate in replicates, the parameters of
+each replicate at each stage in parameters, and the mean and scaled estimate
+of each parameter in estimates. theta (with only a mean) and Na (with only a
+scaled value) have rows in estimates as well. When Godambe standard errors
+were estimated, estimates also has the standard error of the mean of each
+parameter and of theta, and the 95% interval of the scaled value of each
+parameter and of Na. The database is in WAL mode, so that the many runs of a
+sweep can write to it at the same time; it should be on a local disk or a
+cluster file system that supports locking, not NFS."""
+
+import time
+import sqlite3
+
+# Seconds to wait for another run to finish writing before giving up
+TIMEOUT = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    pop1 TEXT NOT NULL,
+    pop2 TEXT NOT NULL,
+    output TEXT NOT NULL,
+    model TEXT NOT NULL,
+    sfs TEXT,
+    max_iterations INTEGER,
+    locus_length INTEGER,
+    seed TEXT,
+    search TEXT,
+    theta_mean REAL,
+    na REAL,
+    written REAL,
+    UNIQUE (pop1, pop2, output, model));
+CREATE TABLE IF NOT EXISTS replicates (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    replicate INTEGER NOT NULL,
+    seed TEXT,
+    last_stage TEXT,
+    stopped INTEGER,
+    data_likelihood REAL,
+    optimized_likelihood REAL,
+    aic REAL,
+    theta REAL,
+    evaluations INTEGER,
+    model_time REAL,
+    elapsed REAL,
+    PRIMARY KEY (run_id, replicate));
+CREATE TABLE IF NOT EXISTS parameters (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    replicate INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    perturbed REAL,
+    hot REAL,
+    cold REAL,
+    bfgs REAL,
+    PRIMARY KEY (run_id, replicate, name));
+CREATE TABLE IF NOT EXISTS estimates (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER,
+    mean REAL,
+    scaled REAL,
+    se REAL,
+    ci_low REAL,
+    ci_high REAL,
+    PRIMARY KEY (run_id, name));
+CREATE INDEX IF NOT EXISTS runs_model ON runs (model, pop1, pop2);
+"""
+
+
+def connect(path):
+    """Open the database at path, creating its tables if they are not there
+    yet, in WAL mode."""
+    conn = sqlite3.connect(path, timeout=TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_run(path, run, replicates, parameters, estimates):
+    """Write the results of a run to the database at path, replacing what was
+    stored for the same populations, output prefix and model before (the
+    results are written again as the replicates go). run is a dictionary of
+    the columns of the runs table, and replicates, parameters and estimates
+    are lists of dictionaries of the columns of the other tables, without
+    run_id. Everything is written in one transaction, so other runs see all
+    of it or none of it."""
+    run = dict(run, written=time.time())
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute(
+                'DELETE FROM runs WHERE pop1 = ? AND pop2 = ? AND output = ? AND model = ?',
+                (run['pop1'], run['pop2'], run['output'], run['model']))
+            run_id = _insert(conn, 'runs', run)
+            for table, rows in [('replicates', replicates), ('parameters', parameters), ('estimates', estimates)]:
+                for row in rows:
+                    _insert(conn, table, dict(row, run_id=run_id))
+    finally:
+        conn.close()
+    return run_id
+
+
+def _insert(conn, table, row):
+    """Insert a dictionary as a row of table, and return its rowid."""
+    columns = sorted(row)
+    cursor = conn.execute(
+        'INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES (' +
+        ', '.join(['?'] * len(columns)) + ')',
+        [row[c] for c in columns])
+    return cursor.lastrowid
@@ -3,9 +3,10 @@
 import os
 import sys
 import re
+import sqlite3
 from collections import defaultdict
 
-USAGE = "Usage: python Collate_AIC.py <POP1-POP2 or POP1_POP2>"
+USAGE = "Usage: python Collate_AIC.py <POP1-POP2 or POP1_POP2> [results.db]"
 
 # Check that population pair name was provided
 if len(sys.argv) < 2:
@@ -13,59 +14,86 @@ if len(sys.argv) < 2:
     sys.exit(1)
 
 popcomp_arg = sys.argv[1]
+# Optional results database (SEM_CaveFish_Dadi.py --results-db) to query
+# instead of reading every output file
+db_path = sys.argv[2] if len(sys.argv) > 2 else None
 
 # Base output dir
 base_dir = "/home/mcgaughs/robac028/CabMoro_PopGen/dadi_package/Scripts/OUTPUT"
 
-# Try common directory name variants: as-given, hyphen, underscore
-candidates = [
-    os.path.join(base_dir, popcomp_arg),
-    os.path.join(base_dir, popcomp_arg.replace("_", "-")),
-    os.path.join(base_dir, popcomp_arg.replace("-", "_")),
-]
-
-full_path = next((p for p in candidates if os.path.isdir(p)), None)
-if full_path is None:
-    print(f"Directory not found. Tried:\n  " + "\n  ".join(candidates))
-    sys.exit(1)
-
 # Prepare storage for replicate => model => AIC
 data = defaultdict(dict)
 models_set = set()
 
-# New filename format inside the directory:
-#   Pop1_Pop2_rep<digits>_<MODEL>.txt
-# e.g., Choy_CMcave_rep20_AM.txt
-# Capture groups: rep, model
-fname_re = re.compile(r"^[A-Za-z0-9]+_[A-Za-z0-9]+_rep(\d+)_([A-Za-z0-9]+)\.txt$")
+if db_path:
+    pops = re.split(r"[-_]", popcomp_arg)
+    if len(pops) != 2:
+        print(USAGE)
+        sys.exit(1)
+    if not os.path.isfile(db_path):
+        print(f"Results database not found: {db_path}")
+        sys.exit(1)
+    # The AIC of the first replicate of each run of the pair, as in the
+    # first "#AIC:" value of each file below
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT r.output, r.model, p.aic FROM runs r "
+        "JOIN replicates p ON p.run_id = r.run_id AND p.replicate = 0 "
+        "WHERE r.pop1 = ? AND r.pop2 = ?", pops)
+    for output, model, aic in rows:
+        # Only the rep<digits> output prefixes, as for the file names
+        if not re.fullmatch(r"rep\d+", output):
+            continue
+        models_set.add(model)
+        # A replicate that did not finish has a NULL AIC
+        data[output][model] = "NA" if aic is None else aic
+    conn.close()
+else:
+    # Try common directory name variants: as-given, hyphen, underscore
+    candidates = [
+        os.path.join(base_dir, popcomp_arg),
+        os.path.join(base_dir, popcomp_arg.replace("_", "-")),
+        os.path.join(base_dir, popcomp_arg.replace("-", "_")),
+    ]
 
-# Read AICs from each output file
-for filename in sorted(os.listdir(full_path)):
-    if not filename.endswith(".txt"):
-        continue
-    m = fname_re.match(filename)
-    if not m:
-        # Skip non-matching .txt files (e.g., summaries or other outputs)
-        continue
+    full_path = next((p for p in candidates if os.path.isdir(p)), None)
+    if full_path is None:
+        print(f"Directory not found. Tried:\n  " + "\n  ".join(candidates))
+        sys.exit(1)
 
-    rep, model = m.groups()
-    rep_id = f"rep{rep}"
-    models_set.add(model)
+    # New filename format inside the directory:
+    #   Pop1_Pop2_rep<digits>_<MODEL>.txt
+    # e.g., Choy_CMcave_rep20_AM.txt
+    # Capture groups: rep, model
+    fname_re = re.compile(r"^[A-Za-z0-9]+_[A-Za-z0-9]+_rep(\d+)_([A-Za-z0-9]+)\.txt$")
 
-    filepath = os.path.join(full_path, filename)
-    with open(filepath, "r") as f:
-        for line in f:
-            # Lines look like: "#AIC: 809484.0297416621"
-            if line.startswith("#AIC:"):
-                parts = line.strip().split()
-                # Expect ["#AIC:", "<number>", ...] (sometimes multiple AICs);
-                # we take the first numeric after "#AIC:"
-                try:
-                    aic = float(parts[1])
-                    data[rep_id][model] = aic
-                except (IndexError, ValueError):
-                    data[rep_id][model] = "NA"
-                break  # done with this file
+    # Read AICs from each output file
+    for filename in sorted(os.listdir(full_path)):
+        if not filename.endswith(".txt"):
+            continue
+        m = fname_re.match(filename)
+        if not m:
+            # Skip non-matching .txt files (e.g., summaries or other outputs)
+            continue
+
+        rep, model = m.groups()
+        rep_id = f"rep{rep}"
+        models_set.add(model)
+
+        filepath = os.path.join(full_path, filename)
+        with open(filepath, "r") as f:
+            for line in f:
+                # Lines look like: "#AIC: 809484.0297416621"
+                if line.startswith("#AIC:"):
+                    parts = line.strip().split()
+                    # Expect ["#AIC:", "<number>", ...] (sometimes multiple AICs);
+                    # we take the first numeric after "#AIC:"
+                    try:
+                        aic = float(parts[1])
+                        data[rep_id][model] = aic
+                    except (IndexError, ValueError):
+                        data[rep_id][model] = "NA"
+                    break  # done with this file
 
 # Print header
 models = sorted(models_set)
@@ -77,4 +105,3 @@ for rep_id in sorted(data.keys(), key=lambda x: int(x.replace("rep", ""))):
     for model in models:
         row.append(str(data[rep_id].get(model, "NA")))
     print("\t".join(row))
-
@@ -2,12 +2,18 @@
 
 import os
 import re
+import sys
+import sqlite3
 from collections import defaultdict, OrderedDict
 
 # Directories
 output_root = "/home/mcgaughs/robac028/CabMoro_PopGen/dadi_package/Scripts/OUTPUT"
 results_dir = "/home/mcgaughs/robac028/CabMoro_PopGen/dadi_package/Results"
 
+# Optional results database (SEM_CaveFish_Dadi.py --results-db) to query
+# instead of reading every output file
+db_path = sys.argv[1] if len(sys.argv) > 1 else None
+
 # Ensure results directory exists
 os.makedirs(results_dir, exist_ok=True)
 
@@ -18,37 +24,84 @@ model_fields = defaultdict(set)
 # Pattern to extract replicate number
 rep_pattern = re.compile(r"rep(\d+)")
 
-# Walk through each population pair directory
-for popdir in sorted(os.listdir(output_root)):
-    subdir = os.path.join(output_root, popdir)
-    if not os.path.isdir(subdir):
-        continue
 
-    for filename in sorted(os.listdir(subdir)):
-        if not filename.endswith(".txt"):
+def joined(values):
+    """Join the values of the replicates of a run as in the output files,
+    where NaN (stored as NULL) is written as nan."""
+    return " ".join("nan" if v is None else str(v) for v in values)
+
+
+if db_path:
+    if not os.path.isfile(db_path):
+        print(f"Results database not found: {db_path}")
+        sys.exit(1)
+    conn = sqlite3.connect(db_path)
+    runs = conn.execute(
+        "SELECT run_id, pop1, pop2, output, model, max_iterations, theta_mean, na "
+        "FROM runs ORDER BY pop1, pop2, output, model").fetchall()
+    for run_id, pop1, pop2, output, model, niter, theta_mean, na in runs:
+        # The same fields as the "#Key: value" lines of an output file
+        replicate_match = rep_pattern.search(output)
+        entry = {
+            "replicate": replicate_match.group(1) if replicate_match else "NA",
+            "Pop 1": pop1,
+            "Pop 2": pop2,
+            "Model": model,
+            "Max iterations": str(niter),
+            "4*Na*u*L": joined([theta_mean]),
+            "Na": joined([na]),
+        }
+        reps = conn.execute(
+            "SELECT data_likelihood, optimized_likelihood, aic, evaluations "
+            "FROM replicates WHERE run_id = ? ORDER BY replicate", (run_id,)).fetchall()
+        for key, values in zip(["Data Likelihoods", "Optimized Likelihoods", "AIC", "Evaluations"], zip(*reps)):
+            entry[key] = joined(values)
+        estimates = conn.execute(
+            "SELECT name, scaled, se, ci_low, ci_high FROM estimates "
+            "WHERE run_id = ? ORDER BY position", (run_id,)).fetchall()
+        for name, scaled, se, ci_low, ci_high in estimates:
+            # theta and Na are in the run columns above
+            if name not in ("theta", "Na"):
+                entry[name] = joined([scaled])
+            if se is not None:
+                entry["SE " + name] = joined([se])
+            if ci_low is not None:
+                entry[name + " 95% CI"] = joined([ci_low, ci_high])
+        model_data[model].append(entry)
+        model_fields[model].update(entry.keys())
+    conn.close()
+else:
+    # Walk through each population pair directory
+    for popdir in sorted(os.listdir(output_root)):
+        subdir = os.path.join(output_root, popdir)
+        if not os.path.isdir(subdir):
             continue
 
-        filepath = os.path.join(subdir, filename)
-        entry = {}
-        replicate_match = rep_pattern.search(filename)
-        entry["replicate"] = replicate_match.group(1) if replicate_match else "NA"
-
-        model = None
-
-        with open(filepath, "r") as f:
-            for line in f:
-                if line.startswith("#") and not line.startswith("#LocusLem"):
-                    parts = line[1:].strip().split(":", 1)
-                    if len(parts) == 2:
-                        key = parts[0].strip()
-                        val = parts[1].strip()
-                        entry[key] = val
-                        if key == "Model":
-                            model = val
-
-        if model:
-            model_data[model].append(entry)
-            model_fields[model].update(entry.keys())
+        for filename in sorted(os.listdir(subdir)):
+            if not filename.endswith(".txt"):
+                continue
+
+            filepath = os.path.join(subdir, filename)
+            entry = {}
+            replicate_match = rep_pattern.search(filename)
+            entry["replicate"] = replicate_match.group(1) if replicate_match else "NA"
+
+            model = None
+
+            with open(filepath, "r") as f:
+                for line in f:
+                    if line.startswith("#") and not line.startswith("#LocusLem"):
+                        parts = line[1:].strip().split(":", 1)
+                        if len(parts) == 2:
+                            key = parts[0].strip()
+                            val = parts[1].strip()
+                            entry[key] = val
+                            if key == "Model":
+                                model = val
+
+            if model:
+                model_data[model].append(entry)
+                model_fields[model].update(entry.keys())
 
 # Write summary files per model
 for model, entries in model_data.items():
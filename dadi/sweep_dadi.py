@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""Run a sweep of dadi fits: every model and replicate of a set of joint SFS
+files, as listed in a manifest, on a pool of local processes. Each task fits
+one replicate of one model to one SFS, exactly as
+
+    SEM_CaveFish_Dadi.py -f SFS -p POP1 -p POP2 -l LENGTH -m MODEL -r 1 -o repNN
+
+would, but the packages are imported once per process rather than once per
+task. Tasks are handed out one at a time as processes become free, with the
+models that take longest first.
+
+The manifest has one line per SFS, with whitespace separated columns:
+
+    SFS  POP1  POP2  LENGTH  MODELS  REPLICATES
+
+where MODELS is a comma separated list of models or 'all'. Lines starting
+with # are ignored. Each pair of populations may only be listed once, since
+the output files are named after the populations and not the SFS. Each finished task is recorded in the state file, so a
+sweep that is interrupted continues where it stopped when it is run again.
+
+With --slurm, a SLURM array script that runs the same sweep split into
+--slurm-jobs array tasks (with --shard) is written instead.
+"""
+
+import os
+import sys
+import time
+import zlib
+import shlex
+import argparse
+import multiprocessing
+import numpy
+
+# Models in the order their tasks are started: the slowest first, so that
+# the last tasks to finish are short. Models with more parameters take
+# longer to optimize, and two-rate migration models integrate two spectra.
+MODEL_ORDER = ['AM2M', 'SC2M', 'IM2M', 'AM', 'SC', 'IM', 'SI']
+
+# Default file that finished tasks are recorded in
+STATE_FILE = 'dadi_sweep_state.txt'
+
+
+def parse_args():
+    """Set up an argument parser, and parse the arguments with it."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'manifest',
+        help='Manifest of SFS files, models and numbers of replicates.')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        required=False,
+        default=1,
+        type=int,
+        help='Number of tasks to run at the same time. Defaults to 1.')
+    parser.add_argument(
+        '--options',
+        required=False,
+        default='',
+        help='Other options of SEM_CaveFish_Dadi.py for every task, as one quoted string, e.g. "-n 500 --halving 2". -j and --grid-jobs cannot be used, since each task runs in one process.')
+    parser.add_argument(
+        '-s',
+        '--seed',
+        required=False,
+        default=None,
+        type=int,
+        help='Random seed, from which the seed of each task is derived, so that a task gives the same results whenever it is run. Defaults to a random seed for each task.')
+    parser.add_argument(
+        '--state',
+        required=False,
+        default=STATE_FILE,
+        help='File that finished tasks are recorded in. Defaults to ' + STATE_FILE + '.')
+    parser.add_argument(
+        '--shard',
+        required=False,
+        default=None,
+        help='Only run part I of N of the tasks, given as I/N with I from 0 to N-1, e.g. for a SLURM array task.')
+    parser.add_argument(
+        '--list',
+        required=False,
+        action='store_true',
+        help='List the tasks that are still to be run, in order, and exit.')
+    parser.add_argument(
+        '--slurm',
+        required=False,
+        default=None,
+        metavar='SCRIPT',
+        help='Write a SLURM array script that runs this sweep, instead of running it.')
+    parser.add_argument(
+        '--slurm-jobs',
+        required=False,
+        default=100,
+        type=int,
+        help='Number of array tasks in the SLURM script, each running with the -j processes. Defaults to 100.')
+    parser.add_argument(
+        '--slurm-time',
+        required=False,
+        default='96:00:00',
+        help='Time limit of each array task in the SLURM script. Defaults to 96:00:00.')
+    parser.add_argument(
+        '--slurm-mem',
+        required=False,
+        default='1G',
+        help='Memory per CPU of each array task in the SLURM script. Defaults to 1G.')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.shard:
+        try:
+            args.shard = tuple(int(x) for x in args.shard.split('/'))
+            if len(args.shard) != 2 or not 0 <= args.shard[0] < args.shard[1]:
+                raise ValueError
+        except ValueError:
+            parser.error('--shard must be I/N with 0 <= I < N')
+    return args
+
+
+def read_manifest(path, models):
+    """Read a manifest. Returns a list of (sfs, pop1, pop2, length, models,
+    replicates) entries. models is the list of models that can be fit. The
+    output files of a task are named after its populations, output prefix and
+    model only, so each pair of populations may only be listed once."""
+    entries = []
+    # The line each pair of populations is listed on
+    pair_lines = {}
+    with open(path) as handle:
+        for lineno, line in enumerate(handle, 1):
+            tmp = line.split()
+            if not tmp or tmp[0].startswith('#'):
+                continue
+            where = path + ' line ' + str(lineno)
+            if len(tmp) != 6:
+                raise ValueError(where + ' does not have 6 columns')
+            sfs, pop1, pop2, length, names, reps = tmp
+            if (pop1, pop2) in pair_lines:
+                raise ValueError(
+                    where + ' lists ' + pop1 + ' and ' + pop2 + ' again (first on line ' +
+                    str(pair_lines[(pop1, pop2)]) + '); their results would overwrite each other')
+            pair_lines[(pop1, pop2)] = lineno
+            if names.lower() == 'all':
+                names = list(models)
+            else:
+                names = names.split(',')
+            for name in names:
+                if name not in models:
+                    raise ValueError(where + ' has an unknown model ' + name + '; choose from ' + ', '.join(models))
+            try:
+                entries.append((sfs, pop1, pop2, int(length), names, int(reps)))
+            except ValueError:
+                raise ValueError(where + ' needs whole numbers for the length and replicates')
+    return entries
+
+
+def expand_tasks(entries):
+    """Expand manifest entries into a list of tasks, one per SFS, model and
+    replicate, ordered with the slowest models first and then by replicate,
+    so that replicates of different SFS are interleaved. Each task is a
+    dictionary with its SFS, populations, length, model and output prefix,
+    and an id that names it in the state file."""
+    tasks = []
+    for sfs, pop1, pop2, length, models, reps in entries:
+        for model in models:
+            for rep in range(reps):
+                out = 'rep%02d' % (rep + 1)
+                tasks.append({
+                    'id': '\t'.join([sfs, model, out]),
+                    'sfs': sfs,
+                    'pops': [pop1, pop2],
+                    'length': length,
+                    'model': model,
+                    'out': out,
+                    'rep': rep})
+    tasks.sort(key=lambda t: (MODEL_ORDER.index(t['model']), t['rep']))
+    return tasks
+
+
+def task_argv(task, options, seed=None):
+    """Return the SEM_CaveFish_Dadi.py arguments of a task. With a seed, the
+    seed of the task is derived from it and the task id."""
+    argv = [
+        '-f', task['sfs'],
+        '-p', task['pops'][0],
+        '-p', task['pops'][1],
+        '-l', str(task['length']),
+        '-m', task['model'],
+        '-r', '1',
+        '-o', task['out']] + options
+    if seed is not None:
+        task_seed = numpy.random.SeedSequence([seed, zlib.crc32(task['id'].encode())])
+        argv += ['-s', str(int(task_seed.generate_state(1)[0]))]
+    return argv
+
+
+def read_state(path):
+    """Return the ids of the tasks recorded as done in a state file. Each
+    line has the task id (SFS, model and output prefix), its status and the
+    seconds it took, separated by tabs. A line cut short by an interruption
+    is ignored."""
+    done = set()
+    if not os.path.isfile(path):
+        return done
+    with open(path) as handle:
+        for line in handle:
+            if not line.endswith('\n'):
+                continue
+            tmp = line.rstrip('\n').split('\t')
+            if len(tmp) == 5 and tmp[3] == 'done':
+                done.add('\t'.join(tmp[:3]))
+    return done
+
+
+def record(handle, task_id, status, seconds):
+    """Append the outcome of a task to the state file, and make sure it is on
+    disk before going on."""
+    handle.write('\t'.join([task_id, status, '%.1f' % seconds]) + '\n')
+    handle.flush()
+    os.fsync(handle.fileno())
+    return
+
+
+def run_task(task_argv):
+    """Fit the model of one task, given its arguments, in a worker process.
+    Returns its status ('done' or 'failed: ' and the reason) and the seconds
+    it took."""
+    import SEM_CaveFish_Dadi
+    from cavefish_dadi.Support import arguments
+    start = time.time()
+    try:
+        args = arguments.parse_args(task_argv)
+        deadline = None
+        if args.time_budget is not None:
+            deadline = start + args.time_budget
+        SEM_CaveFish_Dadi.run_model(args, args.model[0], deadline)
+    except SystemExit as e:
+        # The checks of SEM_CaveFish_Dadi.py print their message and exit
+        return 'failed: exit status ' + str(e.code), time.time() - start
+    except Exception as e:
+        return 'failed: ' + (str(e) or type(e).__name__), time.time() - start
+    return 'done', time.time() - start
+
+
+def _run_indexed(item):
+    """Run one (index, argv) task, returning the index with the outcome."""
+    index, argv = item
+    return (index,) + run_task(argv)
+
+
+def write_slurm(args, n_tasks):
+    """Write a SLURM array script that runs the sweep in --slurm-jobs array
+    tasks of -j processes each. Every array task records what it finished in
+    its own state file, so resubmitting the script after some tasks were
+    killed only runs what is left."""
+    script = os.path.abspath(__file__)
+    manifest = os.path.abspath(args.manifest)
+    n_jobs = min(args.slurm_jobs, n_tasks)
+    command = ['python', script, manifest, '-j', str(args.jobs),
+               '--shard', '${SLURM_ARRAY_TASK_ID}/' + str(n_jobs),
+               '--state', args.state + '.${SLURM_ARRAY_TASK_ID}']
+    if args.options:
+        command += ['--options', shlex.quote(args.options)]
+    if args.seed is not None:
+        command += ['-s', str(args.seed)]
+    with open(args.slurm, 'w') as handle:
+        handle.write('#!/bin/bash -l\n')
+        handle.write('#SBATCH --job-name=dadi_sweep\n')
+        handle.write('#SBATCH --array=0-' + str(n_jobs - 1) + '\n')
+        handle.write('#SBATCH --cpus-per-task=' + str(args.jobs) + '\n')
+        handle.write('#SBATCH --mem-per-cpu=' + args.slurm_mem + '\n')
+        handle.write('#SBATCH --time=' + args.slurm_time + '\n')
+        handle.write('#SBATCH --output=dadi_sweep_%A_%a.out\n')
+        handle.write('#SBATCH --error=dadi_sweep_%A_%a.err\n')
+        handle.write('\n')
+        handle.write('module load conda\n')
+        handle.write('source activate dadi_env\n')
+        handle.write('\n')
+        handle.write('cd ' + shlex.quote(os.getcwd()) + '\n')
+        handle.write('\n')
+        handle.write('# ' + str(n_tasks) + ' tasks from ' + manifest + ', split across ' + str(n_jobs) + ' array tasks\n')
+        handle.write(' '.join(command) + '\n')
+    return n_jobs
+
+
+def main():
+    """Expand the manifest and run the tasks that are not done yet."""
+    # The tasks import the package from this directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from cavefish_dadi.Support import arguments
+    args = parse_args()
+    try:
+        tasks = expand_tasks(read_manifest(args.manifest, arguments.MODELS))
+    except (OSError, ValueError) as e:
+        sys.stderr.write('Error: could not read the manifest: ' + str(e) + '\n')
+        sys.exit(1)
+    options = shlex.split(args.options)
+    # Check the options once, before any task is started
+    if tasks:
+        checked = arguments.parse_args(task_argv(tasks[0], options))
+        if checked.jobs != 1 or checked.grid_jobs != 1:
+            sys.stderr.write('Error: -j and --grid-jobs cannot be given in --options; use the -j of the sweep.\n')
+            sys.exit(1)
+    if args.slurm:
+        n_jobs = write_slurm(args, len(tasks))
+        sys.stderr.write('Wrote ' + args.slurm + ' for ' + str(len(tasks)) + ' tasks in ' + str(n_jobs) + ' array tasks\n')
+        return
+    if args.shard:
+        part, n_parts = args.shard
+        # Dealing the tasks out in turn gives every part a share of the slow
+        # models
+        tasks = tasks[part::n_parts]
+    done = read_state(args.state)
+    todo = [(i, task_argv(t, options, args.seed)) for i, t in enumerate(tasks) if t['id'] not in done]
+    if args.list:
+        for _index, argv in todo:
+            sys.stdout.write('python SEM_CaveFish_Dadi.py ' + ' '.join([shlex.quote(a) for a in argv]) + '\n')
+        return
+    sys.stderr.write(str(len(tasks)) + ' tasks, ' + str(len(tasks) - len(todo)) + ' already done\n')
+    failed = 0
+    with open(args.state, 'a') as state:
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            results = pool.imap_unordered(_run_indexed, todo, chunksize=1)
+        else:
+            pool = None
+            results = (_run_indexed(item) for item in todo)
+        try:
+            for count, (index, status, seconds) in enumerate(results, 1):
+                task = tasks[index]
+                record(state, task['id'], status.split(':')[0], seconds)
+                if status != 'done':
+                    failed += 1
+                sys.stderr.write(
+                    '[' + str(count) + '/' + str(len(todo)) + '] ' + task['model'] + ' '
+                    + task['sfs'] + ' ' + task['out'] + ': ' + status + ' (%.0f s)\n' % seconds)
+        finally:
+            if pool is not None:
+                pool.terminate()
+    if failed:
+        sys.stderr.write(str(failed) + ' tasks failed; run the sweep again to retry them.\n')
+        sys.exit(1)
+    return
+
+
+# Guard the entry point, since worker processes may import this script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Microbenchmark of the objective function overhead (everything but the
+model integration): dadi's _object_func, building a PreparedObjective for
+every call (as _object_func did before it cached them), _object_func with
+its cache, and one PreparedObjective called directly. The model returns a
+precomputed spectrum the size of the CMcave/CMeyed SFS, so only the
+likelihood and bookkeeping are timed. Run with python tests/benchmark_objective.py."""
+
+import io
+import os
+import sys
+import timeit
+import numpy
+import dadi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cavefish_dadi.Models import si
+from cavefish_dadi.Optim import dadi_custom
+
+NS = (38, 34)
+PTS = [50]
+CALLS = 2000
+
+
+def main():
+    model = dadi.Numerics.make_extrap_log_func(si.si)(numpy.array([0.8, 1.5, 0.05]), NS, PTS)
+    data = dadi.Spectrum(numpy.random.default_rng(1).poisson(20000 * model))
+
+    def model_func(params, ns, pts):
+        return model
+
+    params = numpy.array([0.8, 1.5, 0.05])
+    bounds = ([1e-3, 1e-3, 1e-4], [20, 20, 5])
+    quiet = io.StringIO()
+    prepared = dadi_custom.PreparedObjective(data, model_func, PTS, *bounds)
+    cases = [
+        ('dadi.Inference._object_func', lambda: dadi.Inference._object_func(
+            params, data, model_func, PTS, *bounds, output_stream=quiet)),
+        ('PreparedObjective per call', lambda: dadi_custom.PreparedObjective(
+            data, model_func, PTS, *bounds)(params)),
+        ('_object_func (cached)', lambda: dadi_custom._object_func(
+            params, data, model_func, PTS, *bounds)),
+        ('PreparedObjective reused', lambda: prepared(params)),
+    ]
+    for name, call in cases:
+        seconds = min(timeit.repeat(call, number=CALLS, repeat=3)) / CALLS
+        print('%-30s %8.1f us per call' % (name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Benchmark of the coarse-to-fine grid schedule (--hot-grid, --hot-project,
+--cold-grid, --bfgs-grid) against the fixed 50 point grid: the time taken to
+fit a model, and the log likelihoods of the fitted replicates, all scored on
+a common extrapolated 60/70/80 point grid so that schedules can be compared.
+Run from a directory with the SFS, e.g.
+
+    python tests/benchmark_schedule.py CMcave_CMeyed_2DSFS.sfs -m SI -n 5 -r 3
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy
+import dadi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cavefish_dadi.Models import demo_model
+
+# The grid every fit is scored on
+SCORE_GRID = [60, 70, 80]
+# The schedules compared: name, grids and the sample sizes the SFS of the hot
+# annealing is projected to (those of the README example, for the
+# CMcave/CMeyed SFS)
+SCHEDULES = [
+    ('fixed 50', {'hot': [50], 'cold': [50], 'bfgs': [50]}, None),
+    ('hot 30+proj, cold 40, 40/50/60', {'hot': [30], 'cold': [40], 'bfgs': [40, 50, 60]}, [8, 6]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sfs')
+    parser.add_argument('-m', '--model', default='SI')
+    parser.add_argument('-n', '--niter', default=5, type=int)
+    parser.add_argument('-r', '--replicates', default=3, type=int)
+    parser.add_argument('-s', '--seed', default=7, type=int)
+    args = parser.parse_args()
+    for name, grids, project in SCHEDULES:
+        dm = demo_model.DemoModel(args.sfs, args.model, ['pop1', 'pop2'], 'benchmark')
+        dm.set_schedule(grids, project)
+        start = time.time()
+        dm.infer(args.niter, args.replicates, seed=args.seed)
+        seconds = time.time() - start
+        score = dadi.Numerics.make_extrap_log_func(dm.set_model_func(args.model))
+        lls = [dadi.Inference.ll_multinom(score(numpy.array(p), dm.sfs.sample_sizes, SCORE_GRID), dm.sfs)
+               for p in dm.opt_params]
+        print('%s %-32s %7.1f s, ll %s' % (args.model, name + ':', seconds, ' '.join(['%.2f' % ll for ll in lls])))
+
+
+if __name__ == '__main__':
+    main()
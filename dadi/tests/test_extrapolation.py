@@ -0,0 +1,31 @@
+"""Tests that ConcurrentExtrapModel gives the spectra of dadi's serial
+extrapolation, and that its pool of processes is stopped at the end of a with
+block, including that of a DemoModel."""
+
+import os
+import numpy
+import dadi
+from cavefish_dadi.Models import demo_model, si
+from cavefish_dadi.Optim import extrapolation
+
+PARAMS = [0.5, 2.0, 0.3]
+NS = (6, 8)
+PTS = [20, 24, 28]
+
+
+def test_matches_serial_and_closes():
+    serial = dadi.Numerics.make_extrap_log_func(si.si)(PARAMS, NS, PTS)
+    with extrapolation.ConcurrentExtrapModel(si.si, 2) as model:
+        fs = model(PARAMS, NS, PTS)
+        assert model.pool is not None
+    assert model.pool is None
+    numpy.testing.assert_allclose(fs, serial, rtol=1e-12)
+
+
+def test_demo_model_closes_pool(tmp_path):
+    path = os.path.join(str(tmp_path), 'data.sfs')
+    dadi.Spectrum(numpy.arange(63, dtype=float).reshape(NS[0] + 1, NS[1] + 1)).to_file(path)
+    with demo_model.DemoModel(path, 'SI', ['pop1', 'pop2'], 'test', grid_jobs=2) as dm:
+        dm.modelfunc(PARAMS, NS, PTS)
+        assert dm.extrap_func.pool is not None
+    assert dm.extrap_func.pool is None
@@ -0,0 +1,41 @@
+"""Tests that gim_uncert gives the standard errors of dadi.Godambe.GIM_uncert,
+including for parameters that are zero or so small that they are only
+stepped upwards."""
+
+import numpy
+import dadi
+from cavefish_dadi.Models import im
+from cavefish_dadi.Optim import godambe
+
+NS = (6, 8)
+PTS = [20, 24, 28]
+EPS = 0.01
+
+
+def check(p0):
+    """Compare the standard errors of both at p0, with a data spectrum and
+    bootstrap spectra drawn from the IM model there."""
+    func_ex = dadi.Numerics.make_extrap_log_func(im.im)
+    rng = numpy.random.RandomState(3)
+    model = 5000 * func_ex(p0, NS, PTS)
+    data = dadi.Spectrum(rng.poisson(model))
+    boots = [dadi.Spectrum(rng.poisson(model)) for _ in range(10)]
+    expected = dadi.Godambe.GIM_uncert(func_ex, PTS, boots, p0, data, eps=EPS)
+    se, _cov, _evaluations = godambe.gim_uncert(func_ex, PTS, boots, p0, data, eps=EPS)
+    numpy.testing.assert_allclose(se, expected, rtol=1e-6)
+
+
+def test_step_sizes():
+    steps, central = godambe.step_sizes([2.0, 0.0, 1e-7, -3.0], EPS)
+    numpy.testing.assert_allclose(steps, [0.02, 0.01, 0.01, 0.01])
+    assert central.tolist() == [True, False, False, False]
+
+
+def test_matches_dadi():
+    check([0.8, 1.5, 0.3, 0.5, 0.4])
+
+
+def test_matches_dadi_zero_and_small():
+    # A migration rate of zero, stepped upwards as dadi does, and one small
+    # enough for a one-sided step
+    check([0.8, 1.5, 0.0, 1e-5, 0.4])
@@ -0,0 +1,19 @@
+"""Tests of the spectrum cache in cavefish_dadi.Optim.model_cache."""
+
+import numpy
+import dadi
+from cavefish_dadi.Models import si
+from cavefish_dadi.Optim import model_cache
+
+
+def test_positional_and_keyword_pts_share_an_entry():
+    """A spectrum computed with pts= is found again with a positional grid,
+    as PreparedObjective and DemoModel call the model in the two forms."""
+    func = model_cache.CachedModel(dadi.Numerics.make_extrap_log_func(si.si), 'SI')
+    params = numpy.array([0.5, 2.0, 0.1])
+    first = func(params, [4, 4], pts=[20])
+    second = func(params, [4, 4], [20])
+    assert (func.hits, func.misses) == (1, 1)
+    assert numpy.allclose(first, second)
+    func(params, [4, 4], pts=[20])
+    assert (func.hits, func.misses) == (2, 1)
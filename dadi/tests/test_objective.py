@@ -0,0 +1,71 @@
+"""Tests that the prepared objective function of
+cavefish_dadi.Optim.dadi_custom gives the same values as dadi's own
+_object_func, which the SEA lab version was a copy of."""
+
+import io
+import numpy
+import dadi
+from cavefish_dadi.Models import si
+from cavefish_dadi.Optim import dadi_custom
+
+NS = (10, 12)
+PTS = [20, 24]
+LOWER = [1e-3, 1e-3, 1e-4]
+UPPER = [20, 20, 5]
+POINTS = [[0.5, 2.0, 0.1], [1.5, 0.3, 0.02], [3.0, 3.0, 1.0]]
+
+
+def make_data():
+    """A Poisson sample from the SI model, with some cells masked."""
+    func = dadi.Numerics.make_extrap_log_func(si.si)
+    model = func(numpy.array([0.8, 1.5, 0.05]), NS, PTS)
+    data = dadi.Spectrum(numpy.random.default_rng(1).poisson(5000 * model))
+    data.mask[1, 2] = True
+    data.mask[4, 0] = True
+    return data, func
+
+
+def reference(params, data, func, **kwargs):
+    """dadi's objective, with its verbose output kept off stdout."""
+    return dadi.Inference._object_func(
+        numpy.array(params), data, func, PTS, output_stream=io.StringIO(), **kwargs)
+
+
+def test_same_values_as_dadi():
+    data, func = make_data()
+    for multinom in [True, False]:
+        for params in POINTS:
+            expected = reference(params, data, func, lower_bound=LOWER,
+                                 upper_bound=UPPER, multinom=multinom)
+            prepared = dadi_custom.PreparedObjective(
+                data, func, PTS, LOWER, UPPER, multinom=multinom)(numpy.array(params))
+            legacy = dadi_custom._object_func(
+                numpy.array(params), data, func, PTS, LOWER, UPPER, multinom=multinom)
+            assert numpy.isclose(prepared, expected, rtol=1e-12, atol=0)
+            assert numpy.isclose(legacy, expected, rtol=1e-12, atol=0)
+
+
+def test_fixed_and_out_of_bounds():
+    data, func = make_data()
+    fixed = [None, 2.0, None]
+    for params in [[0.5, 0.1], [50.0, 0.1]]:
+        expected = reference(params, data, func, lower_bound=LOWER,
+                             upper_bound=UPPER, fixed_params=fixed)
+        value = dadi_custom._object_func(
+            numpy.array(params), data, func, PTS, LOWER, UPPER, fixed_params=fixed)
+        assert numpy.isclose(value, expected, rtol=1e-12, atol=0)
+
+
+def test_object_func_reuses_the_prepared_objective():
+    data, func = make_data()
+    context = dadi_custom.OptimizationContext()
+    for params in POINTS:
+        dadi_custom._object_func(numpy.array(params), data, func, PTS, LOWER, UPPER,
+                                 context=context)
+    objectives = [o for o in dadi_custom._prepared.values() if o.data is data]
+    assert len(objectives) == 1
+    assert context.evaluations == len(POINTS)
+    # Different settings get their own objective
+    dadi_custom._object_func(numpy.array(POINTS[0]), data, func, PTS, LOWER, UPPER,
+                             multinom=False, context=context)
+    assert len([o for o in dadi_custom._prepared.values() if o.data is data]) == 2
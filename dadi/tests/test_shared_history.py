@@ -0,0 +1,60 @@
+"""Tests that the 2M models, which integrate the history shared by their
+neutral and genomic island spectra once, give the same spectra as two
+independent integrations from the ancestral population, as the models were
+first written."""
+
+import numpy
+import dadi
+from cavefish_dadi.Models import am2m, im2m, sc2m
+
+NS = (6, 8)
+PTS = [20, 24]
+
+
+def unshared(ns, pts, neutral, island, P):
+    """Integrate the neutral and island categories separately, each from its
+    own equilibrium ancestral phi, through their lists of (T, nu1, nu2, m12,
+    m21) epochs, and sum the spectra in proportion P."""
+    n1, n2 = ns
+    xx = dadi.Numerics.default_grid(pts)
+    spectra = []
+    for epochs in [neutral, island]:
+        phi = dadi.PhiManip.phi_1D(xx)
+        phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        for T, nu1, nu2, m12, m21 in epochs:
+            phi = dadi.Integration.two_pops(phi, xx, T, nu1, nu2, m12=m12, m21=m21)
+        spectra.append(dadi.Spectrum.from_phi(phi, (n1, n2), (xx, xx)))
+    return P * spectra[0] + (1 - P) * spectra[1]
+
+
+def check(model_func, params, neutral, island):
+    """Compare a model with the unshared integration at each grid size, and
+    check that calling it again gives the same spectrum."""
+    P = params[-1]
+    for pts in PTS:
+        expected = unshared(NS, pts, neutral, island, P)
+        first = model_func(numpy.array(params), NS, pts)
+        second = model_func(numpy.array(params), NS, pts)
+        assert numpy.allclose(first, expected, rtol=1e-12, atol=0)
+        assert numpy.array_equal(first, second)
+
+
+def test_sc2m():
+    nu1, nu2, m12, m21, me12, me21, Ts, Tsc, P = 0.8, 2.5, 1.2, 0.4, 0.05, 0.02, 0.6, 0.15, 0.7
+    check(sc2m.sc2m, [nu1, nu2, m12, m21, me12, me21, Ts, Tsc, P],
+          [(Ts, nu1, nu2, 0, 0), (Tsc, nu1, nu2, m12, m21)],
+          [(Ts, nu1, nu2, 0, 0), (Tsc, nu1, nu2, me12, me21)])
+
+
+def test_im2m():
+    nu1, nu2, m12, m21, me12, me21, Ts, P = 0.8, 2.5, 1.2, 0.4, 0.05, 0.02, 0.6, 0.7
+    check(im2m.im2m, [nu1, nu2, m12, m21, me12, me21, Ts, P],
+          [(Ts, nu1, nu2, m12, m21)],
+          [(Ts, nu1, nu2, me12, me21)])
+
+
+def test_am2m():
+    nu1, nu2, m12, m21, me12, me21, Tam, Ts, P = 0.8, 2.5, 1.2, 0.4, 0.05, 0.02, 0.3, 0.5, 0.7
+    check(am2m.am2m, [nu1, nu2, m12, m21, me12, me21, Tam, Ts, P],
+          [(Tam, nu1, nu2, m12, m21), (Ts, nu1, nu2, 0, 0)],
+          [(Tam, nu1, nu2, me12, me21), (Ts, nu1, nu2, 0, 0)])
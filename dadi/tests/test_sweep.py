@@ -0,0 +1,26 @@
+"""Tests of the sweep manifest: a pair of populations listed twice would have
+its output files overwritten, so it is rejected."""
+
+import pytest
+import sweep_dadi
+
+MODELS = ['SI', 'SC']
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'manifest.txt'
+    path.write_text(text)
+    return str(path)
+
+
+def test_tasks_of_manifest(tmp_path):
+    path = write(tmp_path, '# comment\na.sfs A B 100 all 2\nb.sfs B A 100 SC 1\n')
+    tasks = sweep_dadi.expand_tasks(sweep_dadi.read_manifest(path, MODELS))
+    assert len(tasks) == 5
+    assert len(set(t['id'] for t in tasks)) == 5
+
+
+def test_duplicate_pair_rejected(tmp_path):
+    path = write(tmp_path, 'a.sfs A B 100 SI 2\nb.sfs A B 100 SC 2\n')
+    with pytest.raises(ValueError, match='line 2 lists A and B again'):
+        sweep_dadi.read_manifest(path, MODELS)
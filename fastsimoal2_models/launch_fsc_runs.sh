@@ -53,7 +53,8 @@ useMonoSites="" #Uncomment this line to use monomorphic sites
 #asm="--ASM"
 asm=""
 #----------multiSFS------------
-# FYI you will never change this if you use Emma's SFS generation code
+# Keep this empty to fit the pairwise *_jointDAFpopX_Y.obs files. To fit the joint SFS
+# of all populations instead, use the *_DSFS.obs file written by Make_2DSFS.py --multi
 multiSFS=""
 #multiSFS="--multiSFS"
 
@@ -5,28 +5,50 @@ populations of interest. Takes three arguments:
     1) Gzipped VCF with invariant sites
     2) Population 1 name
     3) Population 2 name
+More than two population names may be given, in which case the VCF is read
+once and the 2D SFS of every pair of populations is written to
+<Pop1>_<Pop2>_2DSFS.sfs in the output directory, along with the fastsimcoal2
+jointDAFpopX_Y.obs matrices. Population indices for fastsimcoal2 are the
+positions of the populations in --order (by default the order of POPNAMES),
+whatever order they are given in.
+
+With --multi, the joint SFS of all of the populations together is also
+written, both as a dadi N-dimensional spectrum and as a fastsimcoal2
+DSFS.obs file for use with --multiSFS.
+
+A bgzipped VCF can be counted in parallel (--jobs), split by chromosome if it
+has a tabix/CSI index or into byte ranges otherwise. Partial spectra can be
+saved (--partial) from separate tasks (--shard) and combined later (--merge).
+
+Existing 2D SFS files can be converted to fastsimcoal2 .obs matrices with
+--convert, numbering the populations in the order given by --order.
+
+To build spectra for several groupings of samples, first convert the VCF to a
+binary genotype cache with --make-cache DIR, then give DIR in place of the VCF.
+
+Progress is reported on stderr as the VCF is read. Long runs can save
+checkpoints (--checkpoint) and be continued after an interruption (--resume).
+
+For block bootstrap confidence intervals, the 2D spectra can also be counted
+in windows of the genome in the same pass (--windows). Bootstrap replicates of
+the SFS and .obs files are then made by resampling the windows (--bootstrap),
+without reading the VCF again.
 """
 
+import os
 import sys
 import gzip
-import pprint
 import re
+import argparse
+import itertools
+import multiprocessing
+import functools
+import time
+import numpy as np
+import vcf_shards
+import genotype_cache
 
 
-# Unpack arguments
-try:
-    gzvcf = sys.argv[1]
-    pop1 = sys.argv[2]
-    pop2 = sys.argv[3]
-except IndexError:
-    print("""Parse the VCF with invariant sites, and generate a 2D SFS
-We will skip sites that have any missing data in any of the
-populations of interest. Takes three arguments:
-    1) Gzipped VCF with invariant sites
-    2) Population 1 name
-    3) Population 2 name""")
-    exit(1)
-
 # Define a population name dictionary to identify samples in VCF
 POPNAMES = {
     'CMcave': r'^C[0-9]',
@@ -38,111 +60,1300 @@ POPNAMES = {
 # hybrid origin, or are from potential outgroups we decided not to use
 EXCLUDE = ['A_aenus_surface']
 
-# Translate the names from the full name into the VCF name
-pop1 = POPNAMES[pop1]
-pop2 = POPNAMES[pop2]
 # And define the ancestral
 ANCESTRAL = ['Nicara_T6903', 'Nicara_T6904']
 
-# Start a counter for the number of sites considered
-n_sites = 0
+# Joint spectra of all populations with more cells than this are accumulated
+# sparsely, as the counts of the cells that have been seen
+DENSE_CELLS = 1 << 26
+
+# Counters of the records read, reported on stderr and kept in partial
+# spectra: bytes of VCF text, records, records that are not single-base SNPs,
+# SNPs without a usable ancestral state, usable sites with no missing data in
+# any population, and usable sites counted by the invariant site fast path and
+# by the full (slow) path
+STATS = ['bytes', 'records', 'not_snp', 'no_ancestral', 'retained', 'fast', 'slow']
+
+# Default number of seconds between progress reports and between checkpoints
+PROGRESS_INTERVAL = 60
+CHECKPOINT_INTERVAL = 600
+
+# Default size in bp of the windows that spectra are counted in for the block
+# bootstrap. A size of 0 gives one window per chromosome.
+WINDOW_SIZE = 1000000
+
+# Approximate number of bytes of VCF text that are parsed together as one
+# batch of records
+CHUNK_BYTES = 16 * 1024 * 1024
 
-with gzip.open(gzvcf, 'rt') as f:
-    for line in f:
-        if line.startswith('##'):
+# Integer codes for the genotype calls. Anything that is not a diploid call of
+# the REF/ALT alleles or fully missing is OTHER, which counts as zero derived
+# alleles, exactly like the string comparisons of the original script.
+HOM_REF, HET, HOM_ALT, MISSING, OTHER = range(5)
+GT_CODES = {'0/0': HOM_REF, '0/1': HET, '1/0': HET, '1/1': HOM_ALT, './.': MISSING}
+
+# Number of derived alleles carried by each genotype code, with rows for sites
+# where the ancestral state is REF (0/0) and ALT (1/1)
+DERIVED = np.array([
+    [0, 1, 2, 0, 0],
+    [2, 1, 0, 0, 0]], dtype=np.int64)
+
+# Byte values used to locate fields and decode genotypes without splitting
+# each record in Python
+TAB, NEWLINE, SLASH, COLON, DOT, ZERO = (ord(c) for c in '\t\n/:.0')
+# Allele characters are weighted so that the sum of the two alleles of a
+# call identifies it: 0-2 are the REF/ALT dosages, 8 is './.', and every other
+# sum is an unrecognized call.
+ALLELE_WEIGHT = np.full(256, 16, dtype=np.int8)
+ALLELE_WEIGHT[ord('0')] = 0
+ALLELE_WEIGHT[ord('1')] = 1
+ALLELE_WEIGHT[ord('.')] = 4
+CODE_OF_WEIGHT = np.full(33, OTHER, dtype=np.int8)
+CODE_OF_WEIGHT[0:3] = [HOM_REF, HET, HOM_ALT]
+CODE_OF_WEIGHT[8] = MISSING
+# Whitespace that str.split() would treat as a separator, or non-ASCII bytes
+# that might contain some. Chunks containing these are parsed line by line.
+UNUSUAL_BYTES = re.compile(rb'[ \r\x0b\x0c\x1c-\x1f\x80-\xff]')
+# An INFO entry saying that no ALT allele was called, which marks an invariant
+# site even when the record lists an ALT allele. It must be a whole entry,
+# between tabs or semicolons.
+NO_ALT_CALLS = b'AC=0'
+SEMICOLON = ord(';')
+
+
+def parse_args():
+    """Set up an argument parser, and parse the arguments with it."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'vcf',
+        nargs='?',
+        help='Gzipped VCF with invariant sites, or a genotype cache directory made with --make-cache')
+    parser.add_argument(
+        'pops',
+        nargs='*',
+        metavar='POP',
+        help='Population names, as defined in POPNAMES. At least two.')
+    parser.add_argument(
+        '-o',
+        '--outdir',
+        default=None,
+        help='Write the SFS of every pair of populations to files in this directory instead of printing to stdout. Implied when more than two populations are given.')
+    parser.add_argument(
+        '--prefix',
+        default=None,
+        help='Prefix for the fastsimcoal2 .obs files, e.g. CaballoMoro gives CaballoMoro_jointDAFpop1_0.obs')
+    parser.add_argument(
+        '--multi',
+        action='store_true',
+        help='Also write the joint SFS of all populations together, in dadi format and as a fastsimcoal2 --multiSFS DSFS.obs file.')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        type=int,
+        help='Number of processes used to count a bgzipped VCF. Defaults to 1.')
+    parser.add_argument(
+        '--shard',
+        default=None,
+        help='Only count part I of N of a bgzipped VCF, given as I/N with I from 0 to N-1, e.g. for a SLURM array task. Requires --partial.')
+    parser.add_argument(
+        '--partial',
+        default=None,
+        help='Save the partial spectra to this .npz file instead of writing the SFS.')
+    parser.add_argument(
+        '--progress',
+        default=PROGRESS_INTERVAL,
+        type=float,
+        metavar='SECONDS',
+        help='Report progress on stderr this often. 0 turns reports off. Defaults to ' + str(PROGRESS_INTERVAL) + '.')
+    parser.add_argument(
+        '--checkpoint',
+        default=None,
+        metavar='NPZ',
+        help='Save the partial spectra and how far the VCF has been read to this file as counting goes, so that the run can be resumed.')
+    parser.add_argument(
+        '--checkpoint-interval',
+        default=CHECKPOINT_INTERVAL,
+        type=float,
+        metavar='SECONDS',
+        help='Seconds between checkpoints. Defaults to ' + str(CHECKPOINT_INTERVAL) + '.')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue from the checkpoint file, if it exists, instead of starting over. The other arguments must be the same as in the interrupted run.')
+    parser.add_argument(
+        '--make-cache',
+        default=None,
+        metavar='DIR',
+        help='Convert the VCF to a binary genotype cache in this directory, which can be given in place of the VCF in later runs. No populations are needed.')
+    parser.add_argument(
+        '--merge',
+        nargs='+',
+        default=None,
+        metavar='NPZ',
+        help='Sum partial spectra saved with --partial and write the SFS, instead of reading a VCF.')
+    parser.add_argument(
+        '--convert',
+        nargs='+',
+        default=None,
+        metavar='SFS',
+        help='Write the fastsimcoal2 .obs matrix of existing 2D SFS files, instead of reading a VCF.')
+    parser.add_argument(
+        '--order',
+        nargs='+',
+        default=list(POPNAMES),
+        metavar='POP',
+        help='Population order that sets the fastsimcoal2 indices of the .obs files, also for --convert. Defaults to the order of POPNAMES.')
+    parser.add_argument(
+        '--windows',
+        default=None,
+        metavar='NPZ',
+        help='Also count the 2D spectra in windows of the genome and save them to this file, for --bootstrap. With --bootstrap, the file to resample.')
+    parser.add_argument(
+        '--window-size',
+        default=None,
+        type=int,
+        metavar='BP',
+        help='Size of the windows in bp, or 0 for one window per chromosome. Giving it also counts windows into --partial and --checkpoint files. Defaults to ' + str(WINDOW_SIZE) + ' with --windows.')
+    parser.add_argument(
+        '--bootstrap',
+        default=None,
+        type=int,
+        metavar='N',
+        help='Write N block bootstrap replicates of the 2D SFS and .obs files, resampling the windows saved with --windows, to bootstrap_1 to bootstrap_N in the output directory, instead of reading a VCF.')
+    parser.add_argument(
+        '--seed',
+        default=None,
+        type=int,
+        help='Random seed for --bootstrap.')
+    args = parser.parse_args()
+    if args.window_size is not None and args.window_size < 0:
+        parser.error('--window-size must be 0 or more')
+    if args.convert:
+        if args.vcf or args.pops or args.merge or args.make_cache or args.bootstrap:
+            parser.error('--convert reads SFS files, not a VCF')
+        return args
+    if args.bootstrap is not None:
+        if args.vcf or args.pops or args.merge or args.make_cache:
+            parser.error('--bootstrap reads the windows saved with --windows, not a VCF')
+        if not args.windows:
+            parser.error('--bootstrap requires --windows')
+        if args.bootstrap < 1:
+            parser.error('--bootstrap must be at least 1')
+        return args
+    if args.windows and args.window_size is None and not args.merge:
+        args.window_size = WINDOW_SIZE
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.checkpoint and (args.merge or args.make_cache):
+        parser.error('--checkpoint only applies when counting a VCF')
+    if args.merge:
+        if args.vcf or args.pops:
+            parser.error('--merge reads partial spectra, not a VCF')
+        return args
+    if args.make_cache:
+        if not args.vcf or genotype_cache.is_cache(args.vcf):
+            parser.error('--make-cache needs a VCF')
+        if args.windows or args.window_size is not None:
+            parser.error('--windows only applies when counting spectra')
+        return args
+    if not args.vcf or len(args.pops) < 2:
+        parser.error('a VCF and at least two populations are required')
+    for pop in args.pops:
+        if pop not in POPNAMES:
+            parser.error('unknown population ' + pop + '; choose from ' + ', '.join(sorted(POPNAMES)))
+    if len(set(args.pops)) != len(args.pops):
+        parser.error('populations may only be given once')
+    for pop in args.pops:
+        if pop not in args.order:
+            parser.error('population ' + pop + ' is not in --order')
+    if args.shard:
+        try:
+            args.shard = tuple(int(x) for x in args.shard.split('/'))
+            if len(args.shard) != 2 or not 0 <= args.shard[0] < args.shard[1]:
+                raise ValueError
+        except ValueError:
+            parser.error('--shard must be I/N with 0 <= I < N')
+        if not args.partial:
+            parser.error('--shard requires --partial')
+    return args
+
+
+def read_header(handle):
+    """Skip the meta-information lines of an open (binary) VCF and return the
+    #CHROM header line split into columns."""
+    for line in handle:
+        if line.startswith(b'##'):
             continue
-        elif line.startswith('#CHROM'):
-            header = line.strip().split()
-            # Get the indices of the sample fields we want to process
-            pop1_pattern = re.compile(pop1)
-            pop1_samples = [i for i, s in enumerate(header) if pop1_pattern.search(s) and s not in EXCLUDE]
-            pop2_pattern = re.compile(pop2)
-            pop2_samples = [i for i, s in enumerate(header) if pop2_pattern.search(s) and s not in EXCLUDE]
-            anc_samples = [header.index(s) for s in ANCESTRAL if s in header]
-            # Write some output to stderr
-            sys.stderr.write('Pop 1: ' + ','.join([header[i] for i in pop1_samples]) + '\n')
-            sys.stderr.write('Pop 2: ' + ','.join([header[i] for i in pop2_samples]) + '\n')
-            sys.stderr.write('Anc: ' + ','.join(ANCESTRAL) + '\n')
-            # How many alleleic states can we identify?
-            pop1_n = (2*len(pop1_samples)) + 1
-            pop2_n = (2*len(pop2_samples)) + 1
-            # Then, start an empty matrix to hold the SFS data. Rows will be
-            # pop1 samples, and columns will be pop2 samples.
-            sfs = []
-            for i in range(0, pop1_n):
-                tmp = []
-                for j in range(0, pop2_n):
-                    tmp.append(0)
-                sfs.append(tmp)
-        else:
-            tmp = line.strip().split()
-            # Check ref and alt. If there are length polymorphisms, we want to
-            # avoid those.
-            ref = tmp[3]
-            alt = tmp[4]
-            if len(ref) != 1 or len(alt) != 1:
-                continue
-            # Now, we are in the data rows. First, subset the genotypes
-            pop1_geno = [tmp[g].split(':')[0] for g in pop1_samples]
-            pop2_geno = [tmp[g].split(':')[0] for g in pop2_samples]
-            anc_genos = [tmp[i].split(':')[0] for i in anc_samples]
-            # Skip site if any ancestral genotype is missing or heterozygous
-            if any(g not in ['0/0', '1/1'] for g in anc_genos):
-                continue
-            # Ensure all ancestral samples agree
-            if len(set(anc_genos)) != 1:
-                continue
+        elif line.startswith(b'#CHROM'):
+            return line.decode().strip().split()
+        break
+    sys.stderr.write('Error: no #CHROM header line found in the VCF.\n')
+    sys.exit(1)
+
+
+def population_samples(header, pattern):
+    """Return the indices of the header columns that belong to a population,
+    given its regular expression."""
+    pop_pattern = re.compile(pattern)
+    return [i for i, s in enumerate(header) if pop_pattern.search(s) and s not in EXCLUDE]
+
+
+def _field_bounds(buf, ncol):
+    """Locate every field of a chunk of VCF records held in a uint8 array.
+    Returns arrays of the start and end offsets of each field, with one row per
+    record, or None if the chunk is not a clean tab-delimited table with ncol
+    columns (these are left to the line-by-line parser)."""
+    seps = np.flatnonzero((buf == TAB) | (buf == NEWLINE))
+    if seps.size == 0 or seps.size % ncol:
+        return None
+    ends = seps.reshape(-1, ncol)
+    # Every record must end with the only newline in it
+    if np.count_nonzero(buf == NEWLINE) != ends.shape[0]:
+        return None
+    if not np.all(buf[ends[:, -1]] == NEWLINE):
+        return None
+    starts = np.empty_like(ends)
+    starts.flat[0] = 0
+    starts.flat[1:] = seps[:-1] + 1
+    # Empty fields would be merged by str.split(), shifting the columns
+    if np.any(ends == starts):
+        return None
+    return starts, ends
+
+
+def _genotype_codes(buf, starts, ends):
+    """Decode the GT subfield of the sample fields bounded by starts and ends
+    into genotype codes."""
+    length = ends - starts
+    first = buf[starts]
+    sep = buf[starts + 1]
+    second = buf[starts + 2]
+    after = buf[starts + 3]
+    # The GT subfield is exactly three characters with a '/' in the middle
+    whole = ((length == 3) | ((length > 3) & (after == COLON))) & (sep == SLASH)
+    weight = ALLELE_WEIGHT[first] + ALLELE_WEIGHT[second]
+    return np.where(whole, CODE_OF_WEIGHT[weight], OTHER)
+
+
+def _sample_codes(buf, starts, ends, invariant, n_anc=None):
+    """Decode the genotype codes of the sample fields bounded by starts and
+    ends, with one row per record. If n_anc is given, the first n_anc columns
+    are the outgroup samples. Invariant records whose outgroup calls are all
+    0/0 and whose population calls are all exactly 0/0 (unphased, with no
+    other subfield before the ':') are then counted by the fast path whatever
+    their codes, so only their outgroup calls are decoded and their population
+    codes are set to HOM_REF. Every other record is decoded in full."""
+    if n_anc is None or not invariant.any():
+        return _genotype_codes(buf, starts, ends)
+    rows = np.flatnonzero(invariant)
+    anc_codes = _genotype_codes(buf, starts[rows, :n_anc], ends[rows, :n_anc])
+    pop_starts = starts[rows, n_anc:]
+    pop_length = ends[rows, n_anc:] - pop_starts
+    hom_ref = (buf[pop_starts] == ZERO) & (buf[pop_starts + 1] == SLASH) & (buf[pop_starts + 2] == ZERO)
+    hom_ref &= (pop_length == 3) | ((pop_length > 3) & (buf[pop_starts + 3] == COLON))
+    plain = np.all(anc_codes == HOM_REF, axis=1) & np.all(hom_ref, axis=1)
+    codes = np.full(starts.shape, HOM_REF, dtype=np.int8)
+    decode = np.ones(starts.shape[0], dtype=bool)
+    decode[rows[plain]] = False
+    codes[decode] = _genotype_codes(buf, starts[decode], ends[decode])
+    codes[rows[plain], :n_anc] = anc_codes[plain]
+    return codes
+
+
+def read_chunks(blocks, size=CHUNK_BYTES):
+    """Regroup an iterable of blocks of VCF text into chunks of about size
+    bytes that end at the end of a record."""
+    pending = []
+    pending_len = 0
+    for block in blocks:
+        pending.append(block)
+        pending_len += len(block)
+        if pending_len < size:
+            continue
+        data = b''.join(pending)
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            yield data[:cut]
+        pending = [data[cut:]]
+        pending_len = len(pending[0])
+    data = b''.join(pending)
+    if data:
+        yield data
+    return
+
+
+def parse_chunk(chunk, ncol, columns, sites=False, n_anc=None):
+    """Parse a chunk of VCF records. Returns a boolean array that is True for
+    records with single-base REF and ALT alleles, a boolean array that is True
+    for records of invariant sites (ALT is '.' or INFO has AC=0), and an array
+    of genotype codes for the requested sample columns, with one row per
+    record. If sites is True, the chromosome (bytes) and position of each
+    record are returned as well. If n_anc is given, the first n_anc columns
+    are the outgroup, and invariant sites with only 0/0 calls are not fully
+    decoded (see _sample_codes)."""
+    if not chunk.endswith(b'\n'):
+        chunk += b'\n'
+    bounds = None
+    if not UNUSUAL_BYTES.search(chunk):
+        # Pad the buffer so that looking ahead in short fields stays in range
+        buf = np.frombuffer(chunk + b'\0\0\0', dtype=np.uint8)
+        bounds = _field_bounds(buf, ncol)
+    if bounds is None:
+        return _parse_lines(chunk.splitlines(), columns, sites)
+    starts, ends = bounds
+    # Check ref and alt. If there are length polymorphisms, we want to
+    # avoid those.
+    snp = (ends[:, 3] - starts[:, 3] == 1) & (ends[:, 4] - starts[:, 4] == 1)
+    invariant = snp & (buf[starts[:, 4]] == DOT)
+    invariant |= _no_alt_calls(chunk, buf, starts, ends)
+    codes = _sample_codes(buf, starts[:, columns], ends[:, columns], invariant, n_anc)
+    if not sites:
+        return snp, invariant, codes
+    chroms = [chunk[a:b] for a, b in zip(starts[:, 0].tolist(), ends[:, 0].tolist())]
+    return snp, invariant, codes, chroms, _positions(buf, starts[:, 1], ends[:, 1])
+
+
+def _no_alt_calls(chunk, buf, starts, ends):
+    """Find the records of a chunk whose INFO field has AC=0. The text is
+    searched for the literal with bytes.find, which is much faster than a
+    regular expression over the sample columns, and the separators around
+    each match are checked afterwards."""
+    found = np.zeros(starts.shape[0], dtype=bool)
+    hits = []
+    at = chunk.find(NO_ALT_CALLS)
+    while at >= 0:
+        hits.append(at)
+        at = chunk.find(NO_ALT_CALLS, at + len(NO_ALT_CALLS))
+    # Point at the 'A' of each match; the buffer is padded at the end
+    hits = np.array(hits, dtype=np.int64)
+    if hits.size:
+        before = buf[np.maximum(hits - 1, 0)]
+        after = buf[hits + len(NO_ALT_CALLS)]
+        whole = (hits > 0) & ((before == TAB) | (before == SEMICOLON))
+        whole &= (after == TAB) | (after == SEMICOLON)
+        hits = hits[whole]
+    if hits.size:
+        rows = np.searchsorted(starts[:, 0], hits, side='right') - 1
+        # Only matches inside the INFO column count
+        inside = (hits >= starts[rows, 7]) & (hits < ends[rows, 7])
+        found[rows[inside]] = True
+    return found
+
+
+def _positions(buf, starts, ends):
+    """Convert the POS fields bounded by starts and ends to integers."""
+    length = ends - starts
+    offsets = np.arange(int(length.max()))
+    valid = offsets < length[:, None]
+    digits = buf[np.where(valid, starts[:, None] + offsets, 0)].astype(np.int64) - ord('0')
+    powers = np.where(valid, length[:, None] - 1 - offsets, 0)
+    return np.where(valid, digits * 10 ** powers, 0).sum(axis=1)
+
+
+def _parse_lines(lines, columns, sites=False):
+    """Parse a batch of VCF records one line at a time. This is the fallback
+    for chunks that are not plain tab-delimited tables."""
+    snp = []
+    invariant = []
+    codes = []
+    chroms = []
+    positions = []
+    for line in lines:
+        tmp = line.decode().strip().split()
+        if not tmp:
+            continue
+        snp.append(len(tmp[3]) == 1 and len(tmp[4]) == 1)
+        invariant.append(tmp[4] == '.' or 'AC=0' in tmp[7].split(';'))
+        codes.append([GT_CODES.get(tmp[g].split(':')[0], OTHER) for g in columns])
+        if sites:
+            chroms.append(tmp[0].encode())
+            positions.append(int(tmp[1]))
+    snp = np.array(snp, dtype=bool)
+    invariant = np.array(invariant, dtype=bool)
+    codes = np.array(codes, dtype=np.int8).reshape(len(snp), len(columns))
+    if not sites:
+        return snp, invariant, codes
+    return snp, invariant, codes, chroms, np.array(positions, dtype=np.int64)
+
+
+def polarize(snp, anc_codes):
+    """Find the records whose ancestral state can be used. Returns a boolean
+    array of usable records and a boolean array that is True where the
+    ancestral allele is ALT."""
+    if anc_codes.shape[1] == 0:
+        # Without an outgroup no site can be polarized
+        return np.zeros_like(snp), np.zeros_like(snp)
+    # Skip site if any ancestral genotype is missing or heterozygous, and
+    # ensure all ancestral samples agree
+    first = anc_codes[:, 0]
+    usable = snp & ((first == HOM_REF) | (first == HOM_ALT))
+    usable &= np.all(anc_codes == first[:, None], axis=1)
+    return usable, first == HOM_ALT
+
+
+def derived_counts(pop_codes, anc_alt):
+    """Count the derived alleles of one population at each record."""
+    return DERIVED[anc_alt.astype(np.intp)[:, None], pop_codes].sum(axis=1)
+
+
+class JointSpectra(object):
+    """Joint derived allele counts for every pair of a set of populations, and
+    optionally for all of them together, accumulated over batches of VCF
+    records. Populations are identified by their position in the list given at
+    construction.
+
+    If a window size is given, the 2D spectra of every window of the genome
+    are counted as well, for the block bootstrap. The counts of a window are
+    kept as one flat vector holding the matrices of all pairs in turn."""
+
+    def __init__(self, pops, samples, ancestral, multi=False, window=None):
+        """Set up empty count matrices. samples is a list with the sample
+        names of each population, and ancestral the list of outgroup samples
+        found in the VCF. If multi is True, the joint SFS of all populations
+        is also counted. window is the size of the windows in bp (0 for whole
+        chromosomes), or None to count no windows."""
+        self.pops = pops
+        self.samples = samples
+        self.ancestral = ancestral
+        self.multi = multi
+        self.window = window
+        self.pairs = list(itertools.combinations(range(len(pops)), 2))
+        # Each population's genotype columns follow the ancestral columns
+        bounds = np.cumsum([len(ancestral)] + [len(s) for s in samples])
+        self.slices = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        # How many alleleic states can we identify?
+        self.dims = [(2*len(s)) + 1 for s in samples]
+        # Rows will be the first population of the pair, and columns will be
+        # the second
+        self.sfs = {}
+        self.n_sites = {}
+        for i, j in self.pairs:
+            self.sfs[(i, j)] = np.zeros((self.dims[i], self.dims[j]), dtype=np.int64)
+            self.n_sites[(i, j)] = 0
+        # Where the matrix of each pair starts in the vector of a window, and
+        # the vectors of the windows seen so far, keyed by (chromosome, start)
+        sizes = [self.sfs[pair].size for pair in self.pairs]
+        self.offsets = dict(zip(self.pairs, np.cumsum([0] + sizes[:-1]).tolist()))
+        self.window_cells = sum(sizes)
+        self.windows = {}
+        # The joint SFS of all populations is a dense array if it is small
+        # enough, otherwise sorted flat indices of the non-empty cells and
+        # their counts
+        self.joint = None
+        self.joint_n_sites = 0
+        self.joint_cells = int(np.prod(self.dims, dtype=object))
+        if multi and self.joint_cells <= DENSE_CELLS:
+            self.joint = np.zeros(self.dims, dtype=np.int64)
+        self.joint_keys = np.zeros(0, dtype=np.int64)
+        self.joint_counts = np.zeros(0, dtype=np.int64)
+        self.stats = dict.fromkeys(STATS, 0)
+        return
+
+    def add_chunk(self, snp, codes, invariant=None, chroms=None, positions=None):
+        """Add the sites of one parsed chunk, with genotype codes for the
+        ancestral samples followed by the samples of each population.
+        invariant marks the records of invariant sites, which can be counted
+        without looking at their derived alleles. When counting windows, the
+        chromosome and position of each record are needed too."""
+        n_anc = len(self.ancestral)
+        usable, anc_alt = polarize(snp, codes[:, :n_anc])
+        missing = [np.any(codes[:, s] == MISSING, axis=1) for s in self.slices]
+        complete = ~np.any(missing, axis=0)
+        # An invariant site with a REF ancestral state and no REF/ALT calls
+        # in any population has no derived alleles, so it can only fall in
+        # the fixed ancestral cell of each spectrum. Anything else about it
+        # takes the slow path, so the counts are unchanged.
+        fast = np.zeros_like(usable)
+        if invariant is not None:
+            fast = invariant & usable & ~anc_alt
+            if fast.any():
+                pop_codes = codes[:, n_anc:]
+                fast &= ~np.any((pop_codes == HET) | (pop_codes == HOM_ALT), axis=1)
+        slow = np.flatnonzero(usable & ~fast)
+        self.stats['records'] += len(snp)
+        self.stats['not_snp'] += int(np.count_nonzero(~snp))
+        self.stats['no_ancestral'] += int(np.count_nonzero(snp & ~usable))
+        self.stats['retained'] += int(np.count_nonzero(usable & complete))
+        self.stats['fast'] += int(np.count_nonzero(fast))
+        self.stats['slow'] += len(slow)
+        slow_codes = codes[slow]
+        derived = [derived_counts(slow_codes[:, s], anc_alt[slow]) for s in self.slices]
+        if self.window is not None:
+            keys, window_of = self._window_keys(chroms, positions)
+            counts = np.zeros((len(keys), self.window_cells), dtype=np.int64)
+        for i, j in self.pairs:
             # Skip site if any population genotype is missing
-            if './.' in pop1_geno or './.' in pop2_geno:
-                continue
-            # Ancestral state is shared and unambiguous
-            anc_geno = anc_genos[0]
-            # Next, we count up the derived alleles
-            if anc_geno == '0/0':
-                derived = '1'
-                anc = '0'
-            elif anc_geno == '1/1':
-                derived = '0'
-                anc = '1'
-            pop1_der = 0
-            pop2_der = 0
-            for call in pop1_geno:
-                if call == derived + '/' + derived:
-                    pop1_der += 2
-                elif call == derived + '/' + anc or call == anc + '/' + derived:
-                    pop1_der += 1
-                else:
-                    pop1_der += 0
-            for call in pop2_geno:
-                if call == derived + '/' + derived:
-                    pop2_der += 2
-                elif call == derived + '/' + anc or call == anc + '/' + derived:
-                    pop2_der += 1
+            keep = ~missing[i] & ~missing[j]
+            fast_keep = fast & keep
+            n_fast = int(np.count_nonzero(fast_keep))
+            keep = keep[slow]
+            sfs = self.sfs[(i, j)]
+            cells = derived[i][keep] * sfs.shape[1] + derived[j][keep]
+            sfs += np.bincount(cells, minlength=sfs.size).reshape(sfs.shape)
+            sfs[0, 0] += n_fast
+            self.n_sites[(i, j)] += n_fast + int(np.count_nonzero(keep))
+            if self.window is not None:
+                # Count the cells of every window of the chunk at once
+                offset = self.offsets[(i, j)]
+                block = counts[:, offset:offset + sfs.size]
+                cells += window_of[slow[keep]] * sfs.size
+                block += np.bincount(cells, minlength=block.size).reshape(block.shape)
+                block[:, 0] += np.bincount(window_of[fast_keep], minlength=len(keys))
+        if self.window is not None:
+            # Windows with no counted sites are left out, so that they are
+            # the same whether the records were read from a VCF or a cache
+            for key, row in zip(keys, counts):
+                if row.any():
+                    self._add_window(key, row)
+        if self.multi:
+            n_fast = int(np.count_nonzero(fast & complete))
+            keep = complete[slow]
+            flat = np.zeros(np.count_nonzero(keep), dtype=np.int64)
+            for der, dim in zip(derived, self.dims):
+                flat = flat * dim + der[keep]
+            self._add_joint(*np.unique(flat, return_counts=True))
+            if n_fast:
+                self._add_joint(np.zeros(1, dtype=np.int64), np.array([n_fast], dtype=np.int64))
+            self.joint_n_sites += len(flat) + n_fast
+        return
+
+    def _window_keys(self, chroms, positions):
+        """Find the windows of the records of a chunk. Returns the list of
+        (chromosome, start) keys of the windows in the chunk, and the index
+        in that list of the window of each record."""
+        if chroms is None or positions is None:
+            raise ValueError('the chromosome and position of each record are needed to count windows')
+        names, chrom_index = np.unique(np.asarray(chroms, dtype=bytes), return_inverse=True)
+        starts = np.asarray(positions, dtype=np.int64)
+        if self.window:
+            starts = starts // self.window * self.window
+        else:
+            starts = np.zeros_like(starts)
+        pairs = np.stack([chrom_index.reshape(-1), starts], axis=1)
+        found, window_of = np.unique(pairs, axis=0, return_inverse=True)
+        keys = [(names[c].decode(), int(start)) for c, start in found.tolist()]
+        return keys, window_of.reshape(-1)
+
+    def _add_window(self, key, counts):
+        """Add a vector of counts to the window with this key."""
+        if key in self.windows:
+            self.windows[key] += counts
+        else:
+            self.windows[key] = counts.copy()
+        return
+
+    def _add_joint(self, keys, counts):
+        """Add counts to the cells of the joint SFS of all populations with
+        the given (unique) flat indices."""
+        if self.joint is not None:
+            self.joint.reshape(-1)[keys] += counts
+            return
+        keys, inverse = np.unique(np.concatenate([self.joint_keys, keys]), return_inverse=True)
+        total = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(total, inverse, np.concatenate([self.joint_counts, counts]))
+        self.joint_keys = keys
+        self.joint_counts = total
+        return
+
+    def _joint_vector(self, axes=None, block=1 << 20):
+        """Yield the joint SFS of all populations as a flat vector, in blocks.
+        The first population varies slowest (dadi), or, if axes is given, the
+        populations are in that order, from slowest to fastest."""
+        if self.joint is not None:
+            data = self.joint if axes is None else self.joint.transpose(axes)
+            flat = data.ravel()
+            for start in range(0, flat.size, block):
+                yield flat[start:start + block]
+            return
+        keys, counts = self.joint_keys, self.joint_counts
+        if axes is not None:
+            index = np.unravel_index(keys, self.dims)
+            keys = np.ravel_multi_index([index[a] for a in axes], [self.dims[a] for a in axes])
+            order = np.argsort(keys)
+            keys, counts = keys[order], counts[order]
+        for start in range(0, self.joint_cells, block):
+            out = np.zeros(min(block, self.joint_cells - start), dtype=np.int64)
+            lo, hi = np.searchsorted(keys, [start, start + block])
+            out[keys[lo:hi] - start] = counts[lo:hi]
+            yield out
+        return
+
+    def empty_copy(self):
+        """Return a JointSpectra for the same populations with no counts."""
+        return JointSpectra(self.pops, self.samples, self.ancestral, self.multi, self.window)
+
+    def merge(self, other):
+        """Add the counts of another JointSpectra for the same samples."""
+        if (other.pops, other.samples, other.ancestral) != (self.pops, self.samples, self.ancestral):
+            raise ValueError('Partial spectra were built from different populations or samples')
+        if other.multi != self.multi:
+            raise ValueError('Only some of the partial spectra include the joint SFS of all populations')
+        if other.window != self.window:
+            raise ValueError('Partial spectra were counted in different windows')
+        for pair in self.pairs:
+            self.sfs[pair] += other.sfs[pair]
+            self.n_sites[pair] += other.n_sites[pair]
+        for key, counts in other.windows.items():
+            self._add_window(key, counts)
+        for key in STATS:
+            self.stats[key] += other.stats[key]
+        if self.multi:
+            if other.joint is not None:
+                keys = np.flatnonzero(other.joint)
+                counts = other.joint.reshape(-1)[keys]
+            else:
+                keys, counts = other.joint_keys, other.joint_counts
+            self._add_joint(keys, counts)
+            self.joint_n_sites += other.joint_n_sites
+        return
+
+    def save(self, path, **extra):
+        """Save the counts to a .npz file that can be merged later, along
+        with any extra arrays given."""
+        arrays = {
+            'pops': np.array(self.pops),
+            'ancestral': np.array(self.ancestral, dtype=str),
+            'n_sites': np.array([self.n_sites[pair] for pair in self.pairs], dtype=np.int64),
+            'stat_names': np.array(STATS),
+            'stats': np.array([self.stats[key] for key in STATS], dtype=np.int64)}
+        for k, samples in enumerate(self.samples):
+            arrays['samples_%d' % k] = np.array(samples, dtype=str)
+        for i, j in self.pairs:
+            arrays['sfs_%d_%d' % (i, j)] = self.sfs[(i, j)]
+        if self.multi:
+            arrays['joint_n_sites'] = np.array(self.joint_n_sites, dtype=np.int64)
+            if self.joint is not None:
+                arrays['joint'] = self.joint
+            else:
+                arrays['joint_keys'] = self.joint_keys
+                arrays['joint_counts'] = self.joint_counts
+        if self.window is not None:
+            # Most cells of a window are empty, so the stacked matrix of
+            # windows is saved as the flat indices and counts of the others
+            keys = sorted(self.windows)
+            stacked = self.window_matrix(keys)
+            cells = np.flatnonzero(stacked)
+            arrays['window_size'] = np.array(self.window, dtype=np.int64)
+            arrays['window_chroms'] = np.array([k[0] for k in keys], dtype=str)
+            arrays['window_starts'] = np.array([k[1] for k in keys], dtype=np.int64)
+            arrays['window_cells'] = cells
+            arrays['window_counts'] = stacked.reshape(-1)[cells]
+        arrays.update(extra)
+        with open(path, 'wb') as handle:
+            np.savez(handle, **arrays)
+        return
+
+    def window_matrix(self, keys=None):
+        """Return the counts of the windows with the given keys (by default
+        all of them, sorted by chromosome and start) stacked into a matrix
+        with one row per window."""
+        if keys is None:
+            keys = sorted(self.windows)
+        stacked = np.zeros((len(keys), self.window_cells), dtype=np.int64)
+        for row, key in zip(stacked, keys):
+            row += self.windows[key]
+        return stacked
+
+    @classmethod
+    def load(cls, path):
+        """Load counts saved with save()."""
+        with np.load(path) as data:
+            pops = data['pops'].tolist()
+            samples = [data['samples_%d' % k].tolist() for k in range(len(pops))]
+            window = int(data['window_size']) if 'window_size' in data else None
+            spectra = cls(pops, samples, data['ancestral'].tolist(), 'joint_n_sites' in data, window)
+            for pair, n in zip(spectra.pairs, data['n_sites']):
+                spectra.sfs[pair] += data['sfs_%d_%d' % pair]
+                spectra.n_sites[pair] = int(n)
+            # Partial spectra from older versions have no counters
+            if 'stats' in data:
+                spectra.stats.update(zip(data['stat_names'].tolist(), data['stats'].tolist()))
+            if spectra.multi:
+                spectra.joint_n_sites = int(data['joint_n_sites'])
+                if 'joint' in data:
+                    joint = data['joint']
+                    keys = np.flatnonzero(joint)
+                    spectra._add_joint(keys, joint.reshape(-1)[keys])
                 else:
-                    pop2_der += 0
-            # Then, put them into the matrix
-            sfs[pop1_der][pop2_der] += 1
-            n_sites += 1
-
-# Unpack the SFS into the vector expected by dadi, and build the mask
-sfs_vec = []
-mask = []
-for row in sfs:
-    for col in row:
-        sfs_vec.append(str(col))
-        mask.append('0')
-
-# Then, we want to mask the fixed sites
-mask[0] = '1'
-mask[-1] = '1'
-
-# Print the SFS. We can include comment lines.
-print('#Pop 1: ' + sys.argv[2])
-print('#Pop 1 Samples: ' + ','.join([header[i] for i in pop1_samples]))
-print('#Pop 2: ' + sys.argv[3])
-print('#Pop 2 Samples: ' + ','.join([header[i] for i in pop2_samples]))
-print('#Ancestral: ' + ','.join(ANCESTRAL))
-print('#N sites: ' + str(n_sites))
-print(pop1_n, pop2_n, 'unfolded')
-print(' '.join(sfs_vec))
-print(' '.join(mask))
+                    spectra._add_joint(data['joint_keys'], data['joint_counts'])
+            if window is not None:
+                keys = list(zip(data['window_chroms'].tolist(), data['window_starts'].tolist()))
+                stacked = np.zeros((len(keys), spectra.window_cells), dtype=np.int64)
+                stacked.reshape(-1)[data['window_cells']] = data['window_counts']
+                spectra.windows = dict(zip(keys, stacked))
+        return spectra
+
+    def bootstrap(self, n, rng):
+        """Make n block bootstrap replicates by drawing as many windows as
+        were counted, with replacement, and summing their counts. Returns a
+        list of JointSpectra holding the 2D spectra of the replicates."""
+        if not self.windows:
+            raise ValueError('no windows were counted')
+        counts = self.window_matrix()
+        n_windows = counts.shape[0]
+        # How many times each window is drawn in each replicate, so that all
+        # of the replicates are summed with one matrix product
+        draws = rng.integers(0, n_windows, size=(n, n_windows))
+        weights = np.zeros((n, n_windows), dtype=np.int64)
+        np.add.at(weights, (np.arange(n)[:, None], draws), 1)
+        totals = weights @ counts
+        replicates = []
+        for total in totals:
+            spectra = JointSpectra(self.pops, self.samples, self.ancestral)
+            for pair in self.pairs:
+                offset = self.offsets[pair]
+                sfs = spectra.sfs[pair]
+                sfs += total[offset:offset + sfs.size].reshape(sfs.shape)
+                spectra.n_sites[pair] = int(sfs.sum())
+            replicates.append(spectra)
+        return replicates
+
+    def summary(self):
+        """Describe how many sites were retained and why the others were
+        filtered. Sites with missing data may still be used for pairs of
+        populations where they are complete."""
+        stats = self.stats
+        return ', '.join([
+            'retained: ' + str(stats['retained']),
+            'not SNPs: ' + str(stats['not_snp']),
+            'no ancestral state: ' + str(stats['no_ancestral']),
+            'missing data: ' + str(stats['fast'] + stats['slow'] - stats['retained'])])
+
+    def report(self, handle):
+        """Write how many records were read, and how many were counted by
+        each path."""
+        stats = self.stats
+        handle.write('Records: ' + str(stats['records']) + ' (' + self.summary() + ')\n')
+        handle.write('Fast path (invariant sites): ' + str(stats['fast']) + ', slow path: ' + str(stats['slow']) + '\n')
+        return
+
+    def write_sfs(self, pair, handle):
+        """Write the SFS of one pair in dadi format."""
+        i, j = pair
+        sfs = self.sfs[pair]
+        # Unpack the SFS into the vector expected by dadi, and build the mask
+        sfs_vec = [str(c) for c in sfs.ravel()]
+        mask = ['0'] * len(sfs_vec)
+        # Then, we want to mask the fixed sites
+        mask[0] = '1'
+        mask[-1] = '1'
+        # Print the SFS. We can include comment lines.
+        handle.write('#Pop 1: ' + self.pops[i] + '\n')
+        handle.write('#Pop 1 Samples: ' + ','.join(self.samples[i]) + '\n')
+        handle.write('#Pop 2: ' + self.pops[j] + '\n')
+        handle.write('#Pop 2 Samples: ' + ','.join(self.samples[j]) + '\n')
+        handle.write('#Ancestral: ' + ','.join(ANCESTRAL) + '\n')
+        handle.write('#N sites: ' + str(self.n_sites[pair]) + '\n')
+        handle.write(' '.join([str(self.dims[i]), str(self.dims[j]), 'unfolded']) + '\n')
+        handle.write(' '.join(sfs_vec) + '\n')
+        handle.write(' '.join(mask) + '\n')
+        return
+
+    def write_obs(self, pair, handle, indices):
+        """Write the SFS of one pair as a fastsimcoal2 joint derived allele
+        frequency matrix, given the fastsimcoal2 index of each population."""
+        i, j = pair
+        write_obs_matrix(handle, self.sfs[pair], indices[i], indices[j])
+        return
+
+    def write_multi_sfs(self, handle):
+        """Write the joint SFS of all populations in dadi format. As for the
+        2D spectra, the cells where the site is fixed ancestral or derived in
+        every population are masked."""
+        for k, pop in enumerate(self.pops):
+            handle.write('#Pop ' + str(k + 1) + ': ' + pop + '\n')
+            handle.write('#Pop ' + str(k + 1) + ' Samples: ' + ','.join(self.samples[k]) + '\n')
+        handle.write('#Ancestral: ' + ','.join(ANCESTRAL) + '\n')
+        handle.write('#N sites: ' + str(self.joint_n_sites) + '\n')
+        handle.write(' '.join([str(d) for d in self.dims] + ['unfolded']) + '\n')
+        _write_vector(handle, self._joint_vector(), ' ')
+        handle.write('\n')
+        # Write the mask in blocks too, since it is as long as the spectrum
+        handle.write('1')
+        for start in range(1, self.joint_cells - 1, 1 << 20):
+            handle.write(' 0' * min(1 << 20, self.joint_cells - 1 - start))
+        handle.write(' 1\n')
+        return
+
+    def write_multi_obs(self, handle, indices):
+        """Write the joint SFS of all populations as a fastsimcoal2 DSFS.obs
+        file for --multiSFS, with the populations in the order of their
+        fastsimcoal2 indices: the number of populations and their haploid
+        sample sizes, then all counts on one line with the derived allele count
+        of the first population changing fastest."""
+        axes = sorted(range(len(self.pops)), key=lambda k: indices[k])
+        handle.write('1 observations. No. of demes and sample sizes are on next line\n')
+        handle.write('\t'.join([str(len(self.dims))] + [str(self.dims[k] - 1) for k in axes]) + '\n')
+        _write_vector(handle, self._joint_vector(axes=axes[::-1]), '\t')
+        handle.write('\n')
+        return
+
+
+def obs_name(index_1, index_2):
+    """Return the fastsimcoal2 name of the joint derived allele frequency
+    file of the populations with these indices."""
+    return 'jointDAFpop%d_%d.obs' % (max(index_1, index_2), min(index_1, index_2))
+
+
+def write_obs_matrix(handle, sfs, index_1, index_2):
+    """Write a 2D SFS, with rows for the population with fastsimcoal2 index
+    index_1 and columns for index_2, as a fastsimcoal2 joint derived allele
+    frequency matrix. fastsimcoal2 expects the rows to be the population with
+    the higher index, so the matrix is transposed if needed."""
+    if index_1 < index_2:
+        sfs = np.transpose(sfs)
+        index_1, index_2 = index_2, index_1
+    handle.write('1 observations\n')
+    handle.write('\t' + '\t'.join(['d%d_%d' % (index_2, k) for k in range(sfs.shape[1])]) + '\n')
+    for k, row in enumerate(sfs):
+        handle.write('d%d_%d\t' % (index_1, k) + '\t'.join([str(c) for c in row]) + '\n')
+    return
+
+
+def read_sfs(path):
+    """Read a 2D SFS written by this script. Returns the names of the two
+    populations and the matrix of counts. The names come from the comment
+    lines, or else from the file name (<Pop1>_<Pop2>_2DSFS.sfs)."""
+    names = {}
+    with open(path) as handle:
+        lines = [line.strip() for line in handle if line.strip()]
+    for line in lines:
+        match = re.match(r'^#Pop ([12]): (\S+)$', line)
+        if match:
+            names[match.group(1)] = match.group(2)
+    data = [line for line in lines if not line.startswith('#')]
+    if len(data) < 2:
+        raise ValueError(path + ' has no dimensions and counts lines')
+    dims = [int(d) for d in data[0].split() if d.isdigit()]
+    counts = data[1].split()
+    if len(dims) != 2 or len(counts) != dims[0] * dims[1]:
+        raise ValueError(path + ' is not a 2D SFS')
+    if len(names) != 2:
+        match = re.match(r'^([^_]+)_([^_]+)_2DSFS\.sfs$', os.path.basename(path))
+        if not match:
+            raise ValueError('could not find the population names in ' + path)
+        names = {'1': match.group(1), '2': match.group(2)}
+    sfs = np.array([int(c) for c in counts], dtype=np.int64).reshape(dims)
+    return [names['1'], names['2']], sfs
+
+
+def convert_sfs(path, order, outdir, prefix=''):
+    """Write the fastsimcoal2 .obs matrix of a 2D SFS file, numbering the
+    populations by their position in order. The haploid sample sizes come
+    from the dimensions of the SFS. Returns the name of the .obs file."""
+    pops, sfs = read_sfs(path)
+    for pop in pops:
+        if pop not in order:
+            raise ValueError('population ' + pop + ' of ' + path + ' is not in the population order')
+    index_1, index_2 = order.index(pops[0]), order.index(pops[1])
+    out = os.path.join(outdir, prefix + obs_name(index_1, index_2))
+    with open(out, 'w') as handle:
+        write_obs_matrix(handle, sfs, index_1, index_2)
+    return out
+
+
+def _write_vector(handle, blocks, sep):
+    """Write blocks of counts as one line of text, without building the whole
+    line in memory."""
+    first = True
+    for block in blocks:
+        if not first:
+            handle.write(sep)
+        handle.write(sep.join([str(c) for c in block]))
+        first = False
+    return
+
+
+class Monitor(object):
+    """Reports progress on stderr and saves checkpoints while a VCF is being
+    counted. A checkpoint holds the partial spectra, the plan of the run (the
+    parts of the VCF or cache being counted, or 'sequential' when the VCF is
+    read from start to end), and either the parts that are done or how far
+    into the uncompressed VCF text the counts go."""
+
+    def __init__(self, args, plan):
+        """Set up the reports and checkpoints requested in args for a run
+        that counts the given list of parts."""
+        self.progress = args.progress
+        self.path = args.checkpoint
+        self.interval = args.checkpoint_interval
+        self.resuming = args.resume
+        self.plan = [str(part) for part in plan]
+        # The size of the VCF identifies it well enough to refuse resuming
+        # from the checkpoint of another file
+        self.size = os.path.getsize(args.vcf) if os.path.isfile(args.vcf) else 0
+        self.started = self.reported = self.saved = time.time()
+        self.start_stats = dict.fromkeys(STATS, 0)
+        return
+
+    def resume(self, template):
+        """Return the spectra to add counts to, the offset of the uncompressed
+        VCF to continue from (or None) and the set of parts that are done. If
+        resuming, these come from the checkpoint."""
+        spectra = template.empty_copy()
+        if not (self.resuming and os.path.isfile(self.path)):
+            return spectra, None, set()
+        try:
+            with np.load(self.path) as data:
+                plan = data['plan'].tolist()
+                size = int(data['vcf_size'])
+                offset = int(data['offset'])
+                done = set(data['done'].tolist())
+            spectra.merge(JointSpectra.load(self.path))
+        except (OSError, KeyError, ValueError) as e:
+            sys.stderr.write('Error: could not resume from ' + self.path + ': ' + str(e) + '\n')
+            sys.exit(1)
+        if plan != self.plan or size != self.size:
+            sys.stderr.write('Error: ' + self.path + ' is a checkpoint of a different VCF, or of a run with different --jobs or --shard.\n')
+            sys.exit(1)
+        sys.stderr.write('Resuming from ' + self.path + ' after ' + str(spectra.stats['records']) + ' records\n')
+        self.start_stats = dict(spectra.stats)
+        return spectra, (offset if offset >= 0 else None), done
+
+    def update(self, spectra, where, offset=None, done=None):
+        """Report progress and save a checkpoint, if they are due. where
+        describes how far the run has got, offset is how far into the
+        uncompressed VCF text the counts go and done the parts counted."""
+        now = time.time()
+        if self.progress and now - self.reported >= self.progress:
+            self.report(spectra, where, now)
+            self.reported = now
+        if self.path and now - self.saved >= self.interval:
+            self.save(spectra, offset, done)
+            self.saved = time.time()
+        return
+
+    def report(self, spectra, where, now):
+        """Write a progress line with the rate of this run so far."""
+        stats = spectra.stats
+        elapsed = max(now - self.started, 1e-6)
+        rate = (stats['records'] - self.start_stats['records']) / elapsed
+        mb_rate = (stats['bytes'] - self.start_stats['bytes']) / elapsed / 1e6
+        sys.stderr.write(
+            'Progress: ' + str(stats['records']) + ' records, %.0f records/s, %.1f MB read (%.1f MB/s), at ' % (rate, stats['bytes'] / 1e6, mb_rate)
+            + where + ' (' + spectra.summary() + ')\n')
+        return
+
+    def save(self, spectra, offset=None, done=None):
+        """Save a checkpoint, replacing the previous one only once the new one
+        is complete."""
+        tmp = self.path + '.tmp'
+        spectra.save(
+            tmp,
+            plan=np.array(self.plan),
+            vcf_size=np.array(self.size, dtype=np.int64),
+            offset=np.array(-1 if offset is None else offset, dtype=np.int64),
+            done=np.array(sorted(done or []), dtype=str))
+        os.replace(tmp, self.path)
+        return
+
+
+def _last_site(chunk):
+    """Return the chromosome and position of the last record of a chunk of
+    VCF text, as chrom:pos."""
+    start = chunk.rfind(b'\n', 0, len(chunk) - 1) + 1
+    fields = chunk[start:start + 1024].split(None, 2)
+    if len(fields) < 2:
+        return '?'
+    return fields[0].decode(errors='replace') + ':' + fields[1].decode(errors='replace')
+
+
+def count_range(vcf, ncol, columns, template, rng):
+    """Count the records in one (name, begin, end) range of a bgzipped VCF.
+    Returns a new JointSpectra like template. Run in the worker processes."""
+    spectra = template.empty_copy()
+    _name, beg, end = rng
+    for chunk in read_chunks(vcf_shards.iter_range(vcf, beg, end)):
+        add_vcf_chunk(spectra, chunk, ncol, columns)
+    return spectra
+
+
+def add_vcf_chunk(spectra, chunk, ncol, columns):
+    """Parse a chunk of VCF text and add its records to spectra, along with
+    their chromosomes and positions if windows are being counted."""
+    n_anc = len(spectra.ancestral)
+    if spectra.window is None:
+        snp, invariant, codes = parse_chunk(chunk, ncol, columns, n_anc=n_anc)
+        spectra.add_chunk(snp, codes, invariant)
+    else:
+        snp, invariant, codes, chroms, positions = parse_chunk(chunk, ncol, columns, sites=True, n_anc=n_anc)
+        spectra.add_chunk(snp, codes, invariant, chroms, positions)
+    spectra.stats['bytes'] += len(chunk)
+    return
+
+
+def count_cache_chunk(cache, columns, template, name):
+    """Count the records in one chunk of a genotype cache. Returns a new
+    JointSpectra like template. Run in the worker processes."""
+    spectra = template.empty_copy()
+    codes = genotype_cache.read_chunk(cache, name, columns - genotype_cache.FIRST_SAMPLE)
+    # Only single-base REF and ALT records are cached
+    invariant = genotype_cache.read_invariant(cache, name)
+    chroms = positions = None
+    if spectra.window is not None:
+        chroms, positions = genotype_cache.read_sites(cache, name)
+    spectra.add_chunk(np.ones(codes.shape[0], dtype=bool), codes, invariant, chroms, positions)
+    return spectra
+
+
+def _count_part(worker, part):
+    """Count one part with worker, returning the part along with its
+    spectra so that the order they finish in does not matter."""
+    return part, worker(part)
+
+
+def count_parts(worker, parts, template, jobs, monitor):
+    """Count a list of parts (ranges of a VCF or chunks of a cache), in a pool
+    of processes if more than one job is requested, and sum the partial
+    spectra. Parts already counted in a checkpoint being resumed are
+    skipped."""
+    spectra, _offset, done = monitor.resume(template)
+    todo = [part for part in parts if str(part) not in done]
+    counter = functools.partial(_count_part, worker)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(counter, todo)
+    else:
+        pool = None
+        results = (counter(part) for part in todo)
+    try:
+        for part, counted in results:
+            spectra.merge(counted)
+            done.add(str(part))
+            monitor.update(spectra, str(len(done)) + ' of ' + str(len(parts)) + ' parts', done=done)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return spectra
+
+
+def read_vcf_header(path):
+    """Return the #CHROM header of a VCF or of a genotype cache."""
+    if genotype_cache.is_cache(path):
+        return genotype_cache.read_header(path)
+    with gzip.open(path, 'rb') as f:
+        return read_header(f)
+
+
+def count_vcf(args):
+    """Read the VCF header, find the samples of each population and count the
+    joint SFS of every pair of populations."""
+    header = read_vcf_header(args.vcf)
+    # Get the indices of the sample fields we want to process. Translate the
+    # names from the full name into the VCF name.
+    pop_samples = [population_samples(header, POPNAMES[p]) for p in args.pops]
+    anc_samples = [header.index(s) for s in ANCESTRAL if s in header]
+    # Write some output to stderr
+    if len(args.pops) == 2:
+        labels = ['Pop 1', 'Pop 2']
+    else:
+        labels = args.pops
+    for label, samples in zip(labels, pop_samples):
+        sys.stderr.write(label + ': ' + ','.join([header[i] for i in samples]) + '\n')
+    sys.stderr.write('Anc: ' + ','.join(ANCESTRAL) + '\n')
+    template = JointSpectra(
+        args.pops,
+        [[header[i] for i in samples] for samples in pop_samples],
+        [header[i] for i in anc_samples],
+        args.multi,
+        args.window_size)
+    columns = np.array(anc_samples + sum(pop_samples, []), dtype=np.intp)
+    if genotype_cache.is_cache(args.vcf):
+        parts = genotype_cache.list_chunks(args.vcf)
+        if args.shard:
+            task, n_tasks = args.shard
+            parts = parts[task::n_tasks]
+        worker = functools.partial(count_cache_chunk, args.vcf, columns, template)
+        return count_parts(worker, parts, template, args.jobs, Monitor(args, parts))
+    worker = functools.partial(count_range, args.vcf, len(header), columns, template)
+    bgzf = vcf_shards.is_bgzf(args.vcf)
+    if args.shard and not bgzf:
+        sys.stderr.write('Error: --shard needs a bgzipped VCF (bgzip, not gzip).\n')
+        sys.exit(1)
+    if args.shard:
+        task, n_tasks = args.shard
+        ranges = vcf_shards.group_ranges(vcf_shards.plan_ranges(args.vcf, n_tasks), n_tasks)[task]
+        sys.stderr.write('Shard ' + str(task) + '/' + str(n_tasks) + ': ' + ','.join([r[0] for r in ranges]) + '\n')
+        return count_parts(worker, ranges, template, args.jobs, Monitor(args, ranges))
+    if args.jobs > 1 and bgzf:
+        ranges = vcf_shards.plan_ranges(args.vcf, 4 * args.jobs)
+        return count_parts(worker, ranges, template, args.jobs, Monitor(args, ranges))
+    if args.jobs > 1:
+        sys.stderr.write('Warning: the VCF is not bgzipped, so it will be read by a single process.\n')
+    monitor = Monitor(args, ['sequential'])
+    spectra, offset, _done = monitor.resume(template)
+    with gzip.open(args.vcf, 'rb') as f:
+        read_header(f)
+        if offset is None:
+            offset = f.tell()
+        else:
+            # Seeking still decompresses up to the offset, but skips parsing
+            f.seek(offset)
+        for chunk in read_chunks(iter(functools.partial(f.read, 1 << 20), b'')):
+            add_vcf_chunk(spectra, chunk, len(header), columns)
+            offset += len(chunk)
+            monitor.update(spectra, _last_site(chunk), offset=offset)
+    return spectra
+
+
+def cache_chunks(chunks, ncol, cache, index):
+    """Parse chunks of VCF text and write the single-base REF and ALT records
+    to the genotype cache. Chunks are named by index and their order, so that
+    the cache keeps the order of the VCF. Returns the number of records."""
+    columns = np.arange(genotype_cache.FIRST_SAMPLE, ncol)
+    n_records = 0
+    for k, chunk in enumerate(chunks):
+        snp, invariant, codes, chroms, positions = parse_chunk(chunk, ncol, columns, sites=True)
+        if not snp.any():
+            continue
+        kept = np.flatnonzero(snp)
+        genotype_cache.write_chunk(
+            cache,
+            '%05d_%06d' % (index, k),
+            codes[kept],
+            [chroms[i] for i in kept],
+            positions[kept],
+            invariant[kept])
+        n_records += len(kept)
+    return n_records
+
+
+def cache_range(vcf, ncol, cache, part):
+    """Write one (index, (name, begin, end)) range of a bgzipped VCF to the
+    genotype cache. Run in the worker processes."""
+    index, (_name, beg, end) = part
+    return cache_chunks(read_chunks(vcf_shards.iter_range(vcf, beg, end)), ncol, cache, index)
+
+
+def make_cache(args):
+    """Convert the VCF to a binary genotype cache."""
+    header = read_vcf_header(args.vcf)
+    if os.path.isdir(args.make_cache) and genotype_cache.list_chunks(args.make_cache):
+        sys.stderr.write('Error: ' + args.make_cache + ' already holds a genotype cache.\n')
+        sys.exit(1)
+    genotype_cache.write_header(args.make_cache, header)
+    if args.jobs > 1 and vcf_shards.is_bgzf(args.vcf):
+        ranges = vcf_shards.plan_ranges(args.vcf, 4 * args.jobs)
+        worker = functools.partial(cache_range, args.vcf, len(header), args.make_cache)
+        with multiprocessing.Pool(args.jobs) as pool:
+            n_records = sum(pool.imap_unordered(worker, list(enumerate(ranges))))
+    else:
+        with gzip.open(args.vcf, 'rb') as f:
+            read_header(f)
+            chunks = read_chunks(iter(functools.partial(f.read, 1 << 20), b''))
+            n_records = cache_chunks(chunks, len(header), args.make_cache, 0)
+    sys.stderr.write('Cached ' + str(n_records) + ' records of ' + str(len(header) - genotype_cache.FIRST_SAMPLE) + ' samples in ' + args.make_cache + '\n')
+    return
+
+
+def write_spectra(spectra, args, outdir=None):
+    """Write the SFS of every pair, either to stdout or to files in the output
+    directory (or outdir, if given) along with the fastsimcoal2 .obs
+    matrices."""
+    if outdir is None and args.outdir is None and len(spectra.pops) == 2 and not spectra.multi:
+        spectra.write_sfs((0, 1), sys.stdout)
+        return
+    outdir = outdir or args.outdir or '.'
+    os.makedirs(outdir, exist_ok=True)
+    prefix = args.prefix + '_' if args.prefix else ''
+    missing = [pop for pop in spectra.pops if pop not in args.order]
+    if missing:
+        sys.stderr.write('Error: ' + ', '.join(missing) + ' not in --order, so there is no fastsimcoal2 index.\n')
+        sys.exit(1)
+    indices = [args.order.index(pop) for pop in spectra.pops]
+    for i, j in spectra.pairs:
+        sfs_name = os.path.join(outdir, spectra.pops[i] + '_' + spectra.pops[j] + '_2DSFS.sfs')
+        with open(sfs_name, 'w') as handle:
+            spectra.write_sfs((i, j), handle)
+        obs_file = os.path.join(outdir, prefix + obs_name(indices[i], indices[j]))
+        with open(obs_file, 'w') as handle:
+            spectra.write_obs((i, j), handle, indices)
+        sys.stderr.write('Wrote ' + sfs_name + ' and ' + obs_file + '\n')
+    if spectra.multi:
+        sfs_name = os.path.join(outdir, '_'.join(spectra.pops) + '_%dDSFS.sfs' % len(spectra.pops))
+        with open(sfs_name, 'w') as handle:
+            spectra.write_multi_sfs(handle)
+        obs_file = os.path.join(outdir, prefix + 'DSFS.obs')
+        with open(obs_file, 'w') as handle:
+            spectra.write_multi_obs(handle, indices)
+        sys.stderr.write('Wrote ' + sfs_name + ' and ' + obs_file + '\n')
+    return
+
+
+def write_bootstrap(args):
+    """Write block bootstrap replicates of the 2D spectra saved with
+    --windows, each to its own directory so that the file names are the same
+    as those of the full spectra."""
+    try:
+        spectra = JointSpectra.load(args.windows)
+        if spectra.window is None:
+            raise ValueError('no windows were counted')
+        replicates = spectra.bootstrap(args.bootstrap, np.random.default_rng(args.seed))
+    except (OSError, KeyError, ValueError) as e:
+        sys.stderr.write('Error: could not resample the windows of ' + args.windows + ': ' + str(e) + '\n')
+        sys.exit(1)
+    if spectra.window:
+        size = str(spectra.window) + ' bp windows'
+    else:
+        size = 'chromosomes'
+    sys.stderr.write('Resampling ' + str(len(spectra.windows)) + ' ' + size + ' from ' + args.windows + '\n')
+    outdir = args.outdir or '.'
+    for k, replicate in enumerate(replicates):
+        write_spectra(replicate, args, os.path.join(outdir, 'bootstrap_%d' % (k + 1)))
+    return
+
+
+def main():
+    """Build the 2D SFS and print it in dadi format."""
+    args = parse_args()
+    if args.convert:
+        outdir = args.outdir or '.'
+        os.makedirs(outdir, exist_ok=True)
+        prefix = args.prefix + '_' if args.prefix else ''
+        for path in args.convert:
+            try:
+                out = convert_sfs(path, args.order, outdir, prefix)
+            except (OSError, ValueError) as e:
+                sys.stderr.write('Error: could not convert ' + path + ': ' + str(e) + '\n')
+                sys.exit(1)
+            sys.stderr.write('Wrote ' + out + ' from ' + path + '\n')
+        return
+    if args.bootstrap:
+        write_bootstrap(args)
+        return
+    if args.make_cache:
+        make_cache(args)
+        return
+    if args.merge:
+        try:
+            spectra = JointSpectra.load(args.merge[0])
+            for path in args.merge[1:]:
+                spectra.merge(JointSpectra.load(path))
+        except (OSError, KeyError, ValueError) as e:
+            sys.stderr.write('Error: could not merge the partial spectra: ' + str(e) + '\n')
+            sys.exit(1)
+        if args.windows and spectra.window is None:
+            sys.stderr.write('Error: the partial spectra were not counted in windows (--window-size).\n')
+            sys.exit(1)
+    else:
+        spectra = count_vcf(args)
+    spectra.report(sys.stderr)
+    if args.windows:
+        spectra.save(args.windows)
+        sys.stderr.write('Saved ' + str(len(spectra.windows)) + ' windows to ' + args.windows + '\n')
+    if args.partial:
+        spectra.save(args.partial)
+        sys.stderr.write('Saved partial spectra to ' + args.partial + '\n')
+    else:
+        write_spectra(spectra, args)
+    # The counts are complete, so a checkpoint is no longer needed
+    if args.checkpoint and os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+    return
+
+
+if __name__ == '__main__':
+    main()
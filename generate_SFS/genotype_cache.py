@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""A binary cache of the genotypes in a VCF, so that spectra for different
+population groupings can be built without parsing the VCF text again.
+
+A cache is a directory holding the VCF #CHROM header line (header.txt) and a
+series of chunks of records. Each chunk has a gt_<name>.npy file of genotype
+codes (as defined in Make_2DSFS.py) packed two samples per byte, one row per
+record, which is memory-mapped when read, and a sites_<name>.npz file with the
+chromosome and position of each record and whether it is an invariant site.
+Only records with single-base REF and ALT alleles are stored, since no others
+are ever counted."""
+
+import os
+import numpy as np
+
+HEADER = 'header.txt'
+# The first sample column of a VCF
+FIRST_SAMPLE = 9
+
+
+def is_cache(path):
+    """Check whether a path is a genotype cache directory."""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, HEADER))
+
+
+def write_header(cache, header):
+    """Start a cache directory with the #CHROM header of the VCF."""
+    os.makedirs(cache, exist_ok=True)
+    with open(os.path.join(cache, HEADER), 'w') as handle:
+        handle.write('\t'.join(header) + '\n')
+    return
+
+
+def read_header(cache):
+    """Return the #CHROM header of the cached VCF, split into columns."""
+    with open(os.path.join(cache, HEADER)) as handle:
+        return handle.read().strip().split()
+
+
+def list_chunks(cache):
+    """Return the names of the chunks in a cache, in the order of the VCF."""
+    names = [f[3:-4] for f in os.listdir(cache) if f.startswith('gt_') and f.endswith('.npy')]
+    return sorted(names)
+
+
+def pack(codes):
+    """Pack genotype codes (0-15) two samples to a byte."""
+    if codes.shape[1] % 2:
+        codes = np.concatenate([codes, np.zeros((codes.shape[0], 1), dtype=codes.dtype)], axis=1)
+    codes = codes.astype(np.uint8)
+    return codes[:, 0::2] | (codes[:, 1::2] << 4)
+
+
+def unpack(packed, samples):
+    """Return the genotype codes of the given sample indices (from 0 for the
+    first sample column) from packed rows."""
+    samples = np.asarray(samples, dtype=np.intp)
+    data = packed[:, samples // 2]
+    shift = ((samples % 2) * 4).astype(np.uint8)
+    return ((data >> shift) & 15).astype(np.int8)
+
+
+def write_chunk(cache, name, codes, chroms, positions, invariant):
+    """Write one chunk of records. codes has the genotype codes of every
+    sample column, chroms the chromosome name (bytes) of each record,
+    positions their positions and invariant is True for invariant sites."""
+    names, chrom_index = np.unique(np.asarray(chroms, dtype=bytes), return_inverse=True)
+    # Write to temporary names first so that an interrupted run never leaves
+    # a partial chunk that looks complete
+    gt_path = os.path.join(cache, 'gt_' + name + '.npy')
+    sites_path = os.path.join(cache, 'sites_' + name + '.npz')
+    with open(sites_path + '.tmp', 'wb') as handle:
+        np.savez(handle, chroms=names, chrom=chrom_index.astype(np.int32),
+                 pos=np.asarray(positions, dtype=np.int64),
+                 invariant=np.asarray(invariant, dtype=bool))
+    with open(gt_path + '.tmp', 'wb') as handle:
+        np.save(handle, pack(codes))
+    os.replace(sites_path + '.tmp', sites_path)
+    os.replace(gt_path + '.tmp', gt_path)
+    return
+
+
+def read_chunk(cache, name, samples):
+    """Read the genotype codes of the given sample indices from one chunk.
+    The packed array is memory-mapped, so only the bytes holding these
+    samples are decoded."""
+    packed = np.load(os.path.join(cache, 'gt_' + name + '.npy'), mmap_mode='r')
+    return unpack(packed, samples)
+
+
+def read_sites(cache, name):
+    """Return the chromosome name and position of each record of a chunk."""
+    with np.load(os.path.join(cache, 'sites_' + name + '.npz')) as data:
+        return data['chroms'][data['chrom']], data['pos']
+
+
+def read_invariant(cache, name):
+    """Return whether each record of a chunk is an invariant site, or None for
+    caches written before this was stored."""
+    with np.load(os.path.join(cache, 'sites_' + name + '.npz')) as data:
+        if 'invariant' not in data:
+            return None
+        return data['invariant']
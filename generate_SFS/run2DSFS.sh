@@ -5,17 +5,22 @@
 #SBATCH --tmp=100g
 
 
-module load parallel
-
 # Set paths
 SFS_SCRIPT="/home/mcgaughs/robac028/CabMoro_PopGen/2D-SFS/Make_2DSFS.py"
 VCF="/home/mcgaughs/robac028/CabMoro_PopGen/vcf_manip/CabMoroProject_ALLpopulations_norep_noindel_noallhet.vcf.gz"
 
+# Each pair's SFS is named and oriented in this order (e.g. CMsurface_CMeyed).
+# The fastsimcoal2 population index (0 to n-1) follows POPNAMES (or --order).
 POPS=(CMsurface CMeyed CMcave)
 
-for ((i=0; i<${#POPS[@]}; i++)); do
-    for ((j=i+1; j<${#POPS[@]}; j++)); do
-        echo "python ${SFS_SCRIPT} ${VCF} ${POPS[$i]} ${POPS[$j]} > ${POPS[$i]}_${POPS[$j]}_2DSFS.sfs"
-    done
-done | parallel
-
+# The VCF is read once, and a 2D SFS and fsc2 .obs matrix is written for every pair.
+# --multi also writes the joint SFS of all populations (dadi N-D format and fsc2 DSFS.obs).
+# A bgzipped VCF (ideally with a tabix index) is split across the 8 tasks; for a
+# SLURM array use --shard ${SLURM_ARRAY_TASK_ID}/N --partial part_${SLURM_ARRAY_TASK_ID}.npz
+# in each task, then combine with: python ${SFS_SCRIPT} --merge part_*.npz -o . --prefix CaballoMoro
+# Counts are checkpointed every 10 minutes; if the job is killed, resubmitting it
+# resumes from the checkpoint (keep the same arguments).
+# For block bootstrap replicates, add --windows CaballoMoro_windows.npz to also count
+# the spectra in 1 Mb windows, then: python ${SFS_SCRIPT} --bootstrap 100 --windows CaballoMoro_windows.npz -o bootstrap --prefix CaballoMoro
+python ${SFS_SCRIPT} ${VCF} "${POPS[@]}" -o . --prefix CaballoMoro --multi --jobs 8 \
+    --checkpoint CaballoMoro_SFS_checkpoint.npz --resume
@@ -0,0 +1,48 @@
+"""The per-record string logic of the original Make_2DSFS.py, for every pair
+of a list of populations, to check the vectorized counts against."""
+
+import itertools
+import numpy as np
+
+
+def baseline_spectra(lines, header, pops, ancestral):
+    """Count the 2D SFS of every pair of populations in lines of VCF records
+    as the original script did. pops is a list of lists of sample names, and
+    ancestral the list of outgroup sample names. Returns dictionaries of the
+    SFS matrices and of the numbers of sites, keyed by pair of indices."""
+    pop_samples = [[header.index(s) for s in samples] for samples in pops]
+    anc_samples = [header.index(s) for s in ancestral]
+    pairs = list(itertools.combinations(range(len(pops)), 2))
+    sfs = dict((p, np.zeros((2 * len(pops[p[0]]) + 1, 2 * len(pops[p[1]]) + 1), dtype=np.int64)) for p in pairs)
+    n_sites = dict.fromkeys(pairs, 0)
+    for line in lines:
+        tmp = line.strip().split()
+        if not tmp:
+            continue
+        if len(tmp[3]) != 1 or len(tmp[4]) != 1:
+            continue
+        genos = [[tmp[g].split(':')[0] for g in samples] for samples in pop_samples]
+        anc_genos = [tmp[i].split(':')[0] for i in anc_samples]
+        if any(g not in ['0/0', '1/1'] for g in anc_genos):
+            continue
+        if len(set(anc_genos)) != 1:
+            continue
+        if anc_genos[0] == '0/0':
+            derived, anc = '1', '0'
+        else:
+            derived, anc = '0', '1'
+        counts = []
+        for calls in genos:
+            der = 0
+            for call in calls:
+                if call == derived + '/' + derived:
+                    der += 2
+                elif call == derived + '/' + anc or call == anc + '/' + derived:
+                    der += 1
+            counts.append(der)
+        for i, j in pairs:
+            if './.' in genos[i] or './.' in genos[j]:
+                continue
+            sfs[(i, j)][counts[i], counts[j]] += 1
+            n_sites[(i, j)] += 1
+    return sfs, n_sites
@@ -0,0 +1,111 @@
+"""Tests that Make_2DSFS.py counts the records of a small VCF (phased,
+haploid, missing, multi-allelic, indel and invariant records) as the
+per-record logic of the original script does, and that counting it in one
+process, in several (-j), in shards merged afterwards (--shard, --merge) and
+from a genotype cache (--make-cache) gives the same files."""
+
+import os
+import sys
+import gzip
+import struct
+import zlib
+import filecmp
+import subprocess
+import numpy as np
+import Make_2DSFS
+from baseline import baseline_spectra
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(HERE), 'Make_2DSFS.py')
+VCF = os.path.join(HERE, 'data', 'mixed.vcf')
+POPS = ['CMcave', 'CMeyed', 'CMsurface']
+# Records per BGZF block, so that the small VCF still has several ranges
+BLOCK_LINES = 20
+# An empty BGZF block, which ends every BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def read_vcf():
+    """Return the header and the record lines of the test VCF."""
+    with open(VCF) as handle:
+        lines = handle.readlines()
+    header = [line for line in lines if line.startswith('#CHROM')][0].split()
+    return header, [line for line in lines if not line.startswith('#')]
+
+
+def write_bgzf(path, lines):
+    """Write lines to a BGZF file (as bgzip does), BLOCK_LINES to a block."""
+    with open(path, 'wb') as handle:
+        for i in range(0, len(lines), BLOCK_LINES):
+            data = ''.join(lines[i:i + BLOCK_LINES]).encode()
+            compress = zlib.compressobj(6, zlib.DEFLATED, -15)
+            body = compress.compress(data) + compress.flush()
+            handle.write(b'\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0')
+            handle.write(struct.pack('<H', len(body) + 25))
+            handle.write(body)
+            handle.write(struct.pack('<II', zlib.crc32(data), len(data)))
+        handle.write(BGZF_EOF)
+    return
+
+
+def run(cwd, *args):
+    """Run Make_2DSFS.py in cwd."""
+    subprocess.run([sys.executable, SCRIPT, '--progress', '0'] + list(args),
+                   cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return
+
+
+def test_counts_match_baseline():
+    header, records = read_vcf()
+    samples = [[header[i] for i in Make_2DSFS.population_samples(header, Make_2DSFS.POPNAMES[p])] for p in POPS]
+    ancestral = [s for s in Make_2DSFS.ANCESTRAL if s in header]
+    columns = [header.index(s) for s in ancestral + sum(samples, [])]
+    sfs, n_sites = baseline_spectra(records, header, samples, ancestral)
+    # Counted in chunks of several sizes, by the vectorized parser with and
+    # without the invariant site shortcut, and by the line by line parser
+    for size, n_anc in [(300, None), (300, len(ancestral)), (7, len(ancestral)), (1, None)]:
+        spectra = Make_2DSFS.JointSpectra(POPS, samples, ancestral)
+        for i in range(0, len(records), size):
+            chunk = ''.join(records[i:i + size]).encode()
+            snp, invariant, codes = Make_2DSFS.parse_chunk(chunk, len(header), columns, n_anc=n_anc)
+            spectra.add_chunk(snp, codes, invariant)
+        for pair in spectra.pairs:
+            np.testing.assert_array_equal(spectra.sfs[pair], sfs[pair])
+            assert spectra.n_sites[pair] == n_sites[pair]
+    spectra = Make_2DSFS.JointSpectra(POPS, samples, ancestral)
+    snp, invariant, codes = Make_2DSFS._parse_lines([r.encode() for r in records], columns)
+    spectra.add_chunk(snp, codes, invariant)
+    for pair in spectra.pairs:
+        np.testing.assert_array_equal(spectra.sfs[pair], sfs[pair])
+
+
+def test_inputs_agree(tmp_path):
+    tmp = str(tmp_path)
+    with open(VCF) as handle:
+        lines = handle.readlines()
+    with gzip.open(os.path.join(tmp, 'plain.vcf.gz'), 'wt') as handle:
+        handle.writelines(lines)
+    write_bgzf(os.path.join(tmp, 'mixed.vcf.gz'), lines)
+    run(tmp, 'plain.vcf.gz', *POPS, '--multi', '-o', 'plain')
+    run(tmp, 'mixed.vcf.gz', *POPS, '--multi', '-o', 'sequential')
+    run(tmp, 'mixed.vcf.gz', *POPS, '--multi', '-j', '3', '-o', 'jobs')
+    for i in range(3):
+        run(tmp, 'mixed.vcf.gz', *POPS, '--multi', '--shard', '%d/3' % i, '--partial', 'part%d.npz' % i)
+    run(tmp, '--merge', 'part0.npz', 'part1.npz', 'part2.npz', '-o', 'merged')
+    run(tmp, 'mixed.vcf.gz', '--make-cache', 'cache')
+    run(tmp, 'cache', *POPS, '--multi', '-o', 'cached')
+    names = sorted(os.listdir(os.path.join(tmp, 'sequential')))
+    assert 'CMcave_CMeyed_2DSFS.sfs' in names and 'DSFS.obs' in names
+    for other in ['plain', 'jobs', 'merged', 'cached']:
+        assert sorted(os.listdir(os.path.join(tmp, other))) == names
+        match, mismatch, errors = filecmp.cmpfiles(
+            os.path.join(tmp, 'sequential'), os.path.join(tmp, other), names, shallow=False)
+        assert not mismatch and not errors, other
+    # The written spectrum is the one of the original script
+    header, records = read_vcf()
+    samples = [[header[i] for i in Make_2DSFS.population_samples(header, Make_2DSFS.POPNAMES[p])] for p in POPS]
+    sfs, n_sites = baseline_spectra(records, header, samples, Make_2DSFS.ANCESTRAL)
+    with open(os.path.join(tmp, 'sequential', 'CMcave_CMeyed_2DSFS.sfs')) as handle:
+        text = handle.read()
+    assert '#N sites: ' + str(n_sites[(0, 1)]) + '\n' in text
+    assert ' '.join(str(c) for c in sfs[(0, 1)].flat) + '\n' in text
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""Split a bgzipped VCF into ranges of records that can be read independently,
+so that Make_2DSFS.py can count them in parallel. Ranges are pairs of BGZF
+virtual offsets (compressed block offset << 16 | offset within the block)
+that both fall on the start of a record. With a tabix (.tbi) or CSI (.csi)
+index there is one range per chromosome; otherwise the compressed file is cut
+into byte ranges at BGZF block boundaries."""
+
+import os
+import gzip
+import zlib
+import struct
+
+# The fixed part of a BGZF block header: gzip magic, deflate, FEXTRA set, ...
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_HEADER = 18
+
+
+def is_bgzf(path):
+    """Check whether a file is BGZF compressed (as written by bgzip), rather
+    than plain gzip."""
+    with open(path, 'rb') as f:
+        return _block_size(f.read(BGZF_HEADER)) is not None
+
+
+def _block_size(header):
+    """Return the total size of the BGZF block starting with this header, or
+    None if it is not a BGZF block header."""
+    if len(header) < BGZF_HEADER or not header.startswith(BGZF_MAGIC):
+        return None
+    xlen, si1, si2, slen, bsize = struct.unpack('<HBBHH', header[10:18])
+    if xlen != 6 or (si1, si2) != (66, 67) or slen != 2:
+        return None
+    return bsize + 1
+
+
+def _read_block(f, coffset):
+    """Read and decompress the BGZF block at a compressed offset. Returns the
+    data and the offset of the next block."""
+    f.seek(coffset)
+    header = f.read(BGZF_HEADER)
+    size = _block_size(header)
+    if size is None:
+        raise ValueError('No BGZF block at offset ' + str(coffset))
+    body = f.read(size - BGZF_HEADER)
+    # Strip the CRC32 and ISIZE footer before inflating
+    return zlib.decompress(body[:-8], -15), coffset + size
+
+
+def iter_range(path, beg, end):
+    """Yield the decompressed data between two virtual offsets, one BGZF block
+    at a time."""
+    coffset, uoffset = beg >> 16, beg & 0xFFFF
+    end_coffset, end_uoffset = end >> 16, end & 0xFFFF
+    with open(path, 'rb') as f:
+        while coffset < end_coffset or (coffset == end_coffset and uoffset < end_uoffset):
+            data, next_coffset = _read_block(f, coffset)
+            if coffset == end_coffset:
+                data = data[:end_uoffset]
+            if data[uoffset:]:
+                yield data[uoffset:]
+            coffset, uoffset = next_coffset, 0
+    return
+
+
+def _index_path(path):
+    """Return the path of the tabix or CSI index of a VCF, if there is one."""
+    for ext in ('.tbi', '.csi'):
+        if os.path.isfile(path + ext):
+            return path + ext
+    return None
+
+
+def read_index(path):
+    """Read the tabix or CSI index of a VCF. Returns a list of
+    (chromosome, begin, end) virtual offset ranges, one for each chromosome with
+    records, or None if the VCF has no index."""
+    index = _index_path(path)
+    if index is None:
+        return None
+    with gzip.open(index, 'rb') as f:
+        data = f.read()
+    magic = data[:4]
+    if magic == b'TBI\x01':
+        n_ref, = struct.unpack_from('<i', data, 4)
+        l_nm, = struct.unpack_from('<i', data, 32)
+        names = data[36:36 + l_nm].split(b'\x00')
+        pos = 36 + l_nm
+        # tabix always uses 5 levels of bins
+        depth = 5
+        linear = True
+    elif magic == b'CSI\x01':
+        _min_shift, depth, l_aux = struct.unpack_from('<iii', data, 4)
+        aux = data[16:16 + l_aux]
+        names = []
+        if l_aux >= 28:
+            l_nm, = struct.unpack_from('<i', aux, 24)
+            names = aux[28:28 + l_nm].split(b'\x00')
+        pos = 16 + l_aux
+        n_ref, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        linear = False
+    else:
+        raise ValueError('Unrecognized index format: ' + index)
+    # The pseudo-bin holds summary statistics rather than record offsets
+    pseudo_bin = ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+    ranges = []
+    for ref in range(n_ref):
+        n_bin, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        beg = end = None
+        for _ in range(n_bin):
+            if linear:
+                bin_id, n_chunk = struct.unpack_from('<Ii', data, pos)
+                pos += 8
+            else:
+                bin_id, _loffset, n_chunk = struct.unpack_from('<IQi', data, pos)
+                pos += 16
+            chunks = struct.unpack_from('<' + 'QQ' * n_chunk, data, pos)
+            pos += 16 * n_chunk
+            if bin_id == pseudo_bin or not chunks:
+                continue
+            beg = min(chunks[0::2]) if beg is None else min(beg, min(chunks[0::2]))
+            end = max(chunks[1::2]) if end is None else max(end, max(chunks[1::2]))
+        if linear:
+            n_intv, = struct.unpack_from('<i', data, pos)
+            pos += 4 + 8 * n_intv
+        if beg is not None:
+            name = names[ref].decode() if ref < len(names) else str(ref)
+            ranges.append((name, beg, end))
+    return ranges
+
+
+def _next_block(f, offset, file_size):
+    """Find the first BGZF block that starts at or after a compressed offset.
+    Candidate headers are confirmed by checking that the following block (or
+    the end of the file) is where the header says it is."""
+    while offset < file_size:
+        f.seek(offset)
+        window = f.read(65536 + BGZF_HEADER)
+        hit = window.find(BGZF_MAGIC)
+        while hit >= 0:
+            size = _block_size(window[hit:hit + BGZF_HEADER])
+            if size is not None:
+                following = offset + hit + size
+                f.seek(following)
+                if following == file_size or _block_size(f.read(BGZF_HEADER)) is not None:
+                    return offset + hit
+            hit = window.find(BGZF_MAGIC, hit + 1)
+        offset += 65536
+    return file_size
+
+
+def byte_ranges(path, n, data_start):
+    """Cut a BGZF file into about n ranges of records at block boundaries,
+    starting from the virtual offset of the first record. Each range ends at
+    the start of the first complete record of the next one."""
+    file_size = os.path.getsize(path)
+    first = data_start >> 16
+    step = max((file_size - first) // n, 1)
+    cuts = [data_start]
+    with open(path, 'rb') as f:
+        for i in range(1, n):
+            coffset = _next_block(f, first + i * step, file_size)
+            if coffset >= file_size or coffset <= cuts[-1] >> 16:
+                continue
+            data, _ = _read_block(f, coffset)
+            newline = data.find(b'\n')
+            if newline < 0:
+                # A record spanning the whole block; let the previous range
+                # keep it
+                continue
+            cuts.append((coffset << 16) | (newline + 1))
+    cuts.append(file_size << 16)
+    return [('bytes%d' % i, beg, end) for i, (beg, end) in enumerate(zip(cuts[:-1], cuts[1:]))]
+
+
+def data_start(path):
+    """Return the virtual offset of the first record, after the header."""
+    coffset = 0
+    line_start = True
+    with open(path, 'rb') as f:
+        while True:
+            data, next_coffset = _read_block(f, coffset)
+            if not data:
+                break
+            pos = 0
+            while pos < len(data):
+                if line_start and data[pos:pos + 1] != b'#':
+                    return (coffset << 16) | pos
+                newline = data.find(b'\n', pos)
+                if newline < 0:
+                    # The header line continues in the next block
+                    line_start = False
+                    break
+                pos = newline + 1
+                line_start = True
+            coffset = next_coffset
+    return coffset << 16
+
+
+def plan_ranges(path, n):
+    """Plan the ranges of records to count in parallel. Uses the index if there
+    is one, otherwise cuts the file into about n byte ranges."""
+    ranges = read_index(path)
+    if ranges is None:
+        ranges = byte_ranges(path, n, data_start(path))
+    return ranges
+
+
+def group_ranges(ranges, n):
+    """Split ranges into n groups of roughly equal compressed size, for running
+    as separate tasks. Returns a list of n lists of ranges."""
+    groups = [[] for _ in range(n)]
+    sizes = [0] * n
+    for rng in sorted(ranges, key=lambda r: (r[2] >> 16) - (r[1] >> 16), reverse=True):
+        i = sizes.index(min(sizes))
+        groups[i].append(rng)
+        sizes[i] += (rng[2] >> 16) - (rng[1] >> 16)
+    return groups